@@ -0,0 +1,181 @@
+"""
+answer_cache.py — cache sémantique des réponses du chat (Redis)
+
+Une réponse est réutilisée si :
+  1) les chunks récupérés sont EXACTEMENT les mêmes (même liste d'IDs, même ordre)
+  2) la question est proche : cosinus(embedding normalisé) >= seuil
+
+Organisation Redis (préfixe `answer_cache:`) :
+    entry:{id}     HASH  vec (float32 bytes), answer, sources (json), created   + TTL
+    bucket:{sig}   SET   ids des entrées partageant la même signature de chunks
+    src:{source}   SET   ids des entrées qui citent ce document (invalidation /upload)
+    lru            ZSET  id -> dernier accès (éviction LRU au-delà de max_entries)
+    stats          HASH  hits / misses / near_misses
+
+Le client Redis doit être créé avec decode_responses=False (vecteurs binaires).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Any, List, Optional
+
+import numpy as np
+
+
+def chunk_id(doc: Any) -> str:
+    """Identifiant stable d'un chunk : pk Milvus si dispo, sinon hash source+contenu."""
+    meta = getattr(doc, "metadata", {}) or {}
+    if meta.get("pk") is not None:
+        return str(meta["pk"])
+    raw = f"{meta.get('source', '')}\x00{getattr(doc, 'page_content', '')}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _norm_source(path: str) -> str:
+    return os.path.normpath(path) if path else ""
+
+
+def _normalize(vec) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n > 0 else v
+
+
+class SemanticAnswerCache:
+    """Cache de réponses indexé par (chunks récupérés, embedding de la question)."""
+
+    # marge sous le seuil comptée comme "near miss" (aide au réglage du seuil)
+    NEAR_MISS_MARGIN = 0.05
+
+    def __init__(
+        self,
+        redis_client,
+        threshold: float = 0.95,
+        ttl_seconds: int = 24 * 3600,
+        max_entries: int = 5000,
+        prefix: str = "answer_cache",
+    ):
+        self.r = redis_client
+        self.threshold = float(threshold)
+        self.ttl = int(ttl_seconds)
+        self.max_entries = int(max_entries)
+        self.prefix = prefix
+
+    # ---------- Clés ----------
+
+    def _k(self, *parts: str) -> str:
+        return ":".join((self.prefix, *parts))
+
+    @staticmethod
+    def signature(docs: List[Any]) -> str:
+        ids = [chunk_id(d) for d in docs or []]
+        return hashlib.sha1("\x1f".join(ids).encode("utf-8")).hexdigest()
+
+    # ---------- API ----------
+
+    def lookup(self, vector, docs: List[Any]) -> Optional[str]:
+        """Renvoie la réponse en cache la plus proche (>= seuil) ou None."""
+        sig = self.signature(docs)
+        bucket = self._k("bucket", sig)
+        ids = [i.decode() if isinstance(i, bytes) else i for i in self.r.smembers(bucket)]
+
+        best_id, best_sim, best_answer = None, -1.0, None
+        if ids:
+            q = _normalize(vector)
+            pipe = self.r.pipeline(transaction=False)
+            for eid in ids:
+                pipe.hmget(self._k("entry", eid), "vec", "answer")
+            stale = []
+            for eid, (vec, answer) in zip(ids, pipe.execute()):
+                if vec is None or answer is None:
+                    stale.append(eid)  # expirée / évincée / invalidée
+                    continue
+                sim = float(np.dot(q, np.frombuffer(vec, dtype=np.float32)))
+                if sim > best_sim:
+                    best_id, best_sim, best_answer = eid, sim, answer
+            if stale:
+                self.r.srem(bucket, *stale)
+
+        if best_id is not None and best_sim >= self.threshold:
+            pipe = self.r.pipeline(transaction=False)
+            pipe.zadd(self._k("lru"), {best_id: time.time()})
+            pipe.hincrby(self._k("stats"), "hits", 1)
+            pipe.execute()
+            return best_answer.decode("utf-8") if isinstance(best_answer, bytes) else best_answer
+
+        field = "near_misses" if best_sim >= self.threshold - self.NEAR_MISS_MARGIN else "misses"
+        self.r.hincrby(self._k("stats"), field, 1)
+        return None
+
+    def store(self, vector, docs: List[Any], answer: str) -> str:
+        """Enregistre une réponse générée ; applique TTL + éviction LRU."""
+        eid = uuid.uuid4().hex
+        sig = self.signature(docs)
+        sources = sorted({_norm_source((getattr(d, "metadata", {}) or {}).get("source", "")) for d in docs or []} - {""})
+
+        entry = self._k("entry", eid)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.hset(entry, mapping={
+            "vec": _normalize(vector).tobytes(),
+            "answer": answer,
+            "sources": json.dumps(sources),
+            "created": time.time(),
+        })
+        pipe.expire(entry, self.ttl)
+        pipe.sadd(self._k("bucket", sig), eid)
+        pipe.expire(self._k("bucket", sig), self.ttl)
+        for src in sources:
+            pipe.sadd(self._k("src", src), eid)
+            pipe.expire(self._k("src", src), self.ttl)
+        pipe.zadd(self._k("lru"), {eid: time.time()})
+        pipe.zcard(self._k("lru"))
+        size = pipe.execute()[-1]
+
+        if self.max_entries and size > self.max_entries:
+            self._evict(size - self.max_entries)
+        return eid
+
+    def invalidate_source(self, source: str) -> int:
+        """Supprime toutes les entrées citant `source` ; renvoie leur nombre."""
+        key = self._k("src", _norm_source(source))
+        ids = [i.decode() if isinstance(i, bytes) else i for i in self.r.smembers(key)]
+        pipe = self.r.pipeline(transaction=False)
+        for eid in ids:
+            pipe.delete(self._k("entry", eid))
+        if ids:
+            pipe.zrem(self._k("lru"), *ids)
+        pipe.delete(key)
+        pipe.execute()
+        return len(ids)
+
+    def stats(self) -> dict:
+        raw = self.r.hgetall(self._k("stats")) or {}
+        vals = {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in raw.items()}
+        hits = vals.get("hits", 0)
+        misses = vals.get("misses", 0) + vals.get("near_misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "near_misses": vals.get("near_misses", 0),
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "entries": int(self.r.zcard(self._k("lru"))),
+            "threshold": self.threshold,
+        }
+
+    # ---------- Interne ----------
+
+    def _evict(self, n: int):
+        """Évince les n entrées les moins récemment utilisées."""
+        oldest = self.r.zpopmin(self._k("lru"), n)
+        if not oldest:
+            return
+        pipe = self.r.pipeline(transaction=False)
+        for eid, _score in oldest:
+            eid = eid.decode() if isinstance(eid, bytes) else eid
+            pipe.delete(self._k("entry", eid))
+        pipe.execute()
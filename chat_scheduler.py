@@ -0,0 +1,364 @@
+"""
+chat_scheduler.py — ordonnanceur des requêtes /chat (batching continu)
+
+Remplace l'ancien couple `chat_queue` + `chat_worker` unique :
+
+- les requêtes en attente sont regroupées (jusqu'à CHAT_MAX_BATCH, fenêtre
+  CHAT_BATCH_WINDOW_MS) et la recherche Milvus est faite une seule fois pour
+  tout le lot (retriever.batch_retrieve, vectorielle ou hybride BM25 + RRF
+  selon `retrieval_mode`, puis reranking cross-encoder optionnel)
+- la génération est répartie sur plusieurs "slots" (un ChatLlamaCpp = un
+  contexte llama.cpp) ; dès qu'un slot se libère, la requête suivante démarre
+- chaque requête a une échéance (deadline) ; une requête expirée avant d'avoir
+  démarré n'est jamais générée, une génération en cours est interrompue au
+  fragment suivant (le slot llama.cpp est libéré)
+- contre-pression : au-delà de CHAT_MAX_QUEUE requêtes en attente/en cours,
+  submit() lève QueueFullError (-> HTTP 429) au lieu d'attendre indéfiniment
+- cache sémantique optionnel (answer_cache.SemanticAnswerCache) consulté
+  juste après la recherche : un hit est servi sans occuper de slot
+- mode streaming (submit(..., stream=True)) : les fragments générés sont
+  poussés dans `req.tokens` au fil de l'eau (None = fin du flux)
+- métriques Prometheus (metrics.py) : latence bout en bout par issue,
+  attente d'un slot de génération
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+import generator
+import metrics
+import retriever as rt
+
+
+class QueueFullError(RuntimeError):
+    """Trop de requêtes en attente : le client doit réessayer plus tard."""
+
+
+class DeadlineExceededError(TimeoutError):
+    """L'échéance de la requête est dépassée avant la fin du traitement."""
+
+
+@dataclass
+class ChatRequest:
+    session_id: str
+    user_input: str
+    deadline: float
+    future: asyncio.Future
+    tokens: Optional[asyncio.Queue] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+
+class ChatScheduler:
+    """
+    Regroupe les requêtes de chat, lance la recherche par lot puis
+    entrelace la génération sur `len(chains)` slots llama.cpp.
+    """
+
+    def __init__(
+        self,
+        retriever: Any,
+        chains: List[Any],
+        max_batch: int = 4,
+        batch_window_ms: int = 20,
+        max_queue: int = 32,
+        timeout_s: float = 180.0,
+        cache: Any = None,
+        retrieval_mode: str = "vector",
+        lexical: Any = None,
+        reranker: Any = None,
+    ):
+        if not chains:
+            raise ValueError("ChatScheduler needs at least one generator chain.")
+        self.retriever = retriever
+        self.max_batch = max(1, int(max_batch))
+        self.batch_window = max(0, int(batch_window_ms)) / 1000.0
+        self.max_queue = max(1, int(max_queue))
+        self.timeout_s = float(timeout_s)
+        self.cache = cache
+        self.retrieval_mode = retrieval_mode
+        self.lexical = lexical  # lexical_index.LexicalIndex, remplaçable à chaud
+        self.reranker = reranker
+
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._slots: asyncio.Queue = asyncio.Queue()
+        for chain in chains:
+            self._slots.put_nowait(chain)
+        self.n_slots = len(chains)
+
+        self._pending = 0          # requêtes acceptées et non terminées
+        self._running = 0          # requêtes en cours de génération
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+
+    # ---------- Cycle de vie ----------
+
+    def start(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def stop(self):
+        tasks = [t for t in [self._dispatcher, *self._tasks] if t is not None]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatcher = None
+        self._tasks.clear()
+
+    # ---------- API ----------
+
+    @property
+    def queue_depth(self) -> int:
+        """Requêtes acceptées qui n'ont pas encore commencé à générer."""
+        return max(0, self._pending - self._running)
+
+    @property
+    def running(self) -> int:
+        """Requêtes en cours de génération."""
+        return self._running
+
+    def submit(
+        self,
+        session_id: str,
+        user_input: str,
+        timeout: float | None = None,
+        stream: bool = False,
+    ) -> ChatRequest:
+        """
+        Enfile une requête et renvoie immédiatement son ChatRequest
+        (attendre `req.future` pour obtenir (réponse, durée)).
+
+        Avec `stream=True`, les fragments sont publiés dans `req.tokens` et
+        `req.future` reçoit le dict final de generator.stream_chat_st.
+
+        Raises:
+            QueueFullError: si la file est pleine (contre-pression)
+        """
+        if self._pending >= self.max_queue:
+            raise QueueFullError(f"Chat queue is full ({self._pending}/{self.max_queue}).")
+
+        timeout = self.timeout_s if not timeout or timeout <= 0 else min(timeout, self.timeout_s)
+        loop = asyncio.get_running_loop()
+        req = ChatRequest(
+            session_id=session_id,
+            user_input=user_input,
+            deadline=time.monotonic() + timeout,
+            future=loop.create_future(),
+            tokens=asyncio.Queue() if stream else None,
+        )
+        self._pending += 1
+        self._queue.put_nowait(req)
+        return req
+
+    async def wait(self, req: ChatRequest):
+        """Attend le résultat d'une requête en respectant son échéance."""
+        remaining = max(0.0, req.deadline - time.monotonic())
+        try:
+            return await asyncio.wait_for(asyncio.shield(req.future), timeout=remaining)
+        except asyncio.TimeoutError:
+            # Si la génération n'a pas démarré, elle sera ignorée par le dispatcher ;
+            # sinon elle s'arrête au fragment suivant et le slot est rendu.
+            if not req.future.done():
+                req.future.set_exception(DeadlineExceededError("Chat request deadline exceeded."))
+                req.future.exception()  # marque l'exception comme consommée
+            raise DeadlineExceededError("Chat request deadline exceeded.")
+
+    # ---------- Interne ----------
+
+    @staticmethod
+    def _observe(req: ChatRequest, outcome: str):
+        metrics.CHAT_LATENCY.labels(outcome).observe(time.monotonic() - req.enqueued_at)
+
+    def _release(self, req: ChatRequest):
+        """La requête quitte le scheduler (terminée, expirée ou en échec)."""
+        if req.tokens is not None:
+            req.tokens.put_nowait(None)
+        self._pending -= 1
+
+    async def _collect_batch(self) -> List[ChatRequest]:
+        """Bloque jusqu'à la 1ère requête, puis complète le lot pendant la fenêtre."""
+        batch = [await self._queue.get()]
+        end = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = end - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        return batch
+
+    def _live(self, batch: List[ChatRequest]) -> List[ChatRequest]:
+        """Écarte (et libère) les requêtes déjà abandonnées ou expirées."""
+        live = []
+        for req in batch:
+            if not req.future.done() and req.expired():
+                req.future.set_exception(DeadlineExceededError("Chat request expired in queue."))
+                self._observe(req, "expired")
+            if req.future.done():
+                self._release(req)
+                continue
+            live.append(req)
+        return live
+
+    async def _dispatch_loop(self):
+        while True:
+            # Réserve un slot avant de prendre un lot : la file ne se vide pas
+            # plus vite que la génération ne peut suivre.
+            chain = await self._slots.get()
+            try:
+                batch = self._live(await self._collect_batch())
+                if not batch:
+                    self._slots.put_nowait(chain)
+                    continue
+
+                try:
+                    contexts, vectors = await rt.batch_retrieve(
+                        self.retriever, [r.user_input for r in batch], return_vectors=True,
+                        mode=self.retrieval_mode, lexical=self.lexical, reranker=self.reranker,
+                    )
+                except Exception as e:
+                    for req in batch:
+                        if not req.future.done():
+                            req.future.set_exception(e)
+                        self._observe(req, "error")
+                        self._release(req)
+                    self._slots.put_nowait(chain)
+                    continue
+            except asyncio.CancelledError:
+                self._slots.put_nowait(chain)
+                raise
+
+            misses = [
+                (req, docs, vec) for req, docs, vec in zip(batch, contexts, vectors)
+                if not self._serve_cached(req, docs, vec)
+            ]
+            if not misses:
+                self._slots.put_nowait(chain)
+                continue
+
+            first, *rest = misses
+            self._spawn(self._generate(*first, chain=chain))
+            for req, docs, vec in rest:
+                self._spawn(self._generate(req, docs, vec))
+
+    def _serve_cached(self, req: ChatRequest, docs, vector) -> bool:
+        """Sert la requête depuis le cache sémantique si possible (True = servie)."""
+        if self.cache is None or vector is None:
+            return False
+        start = time.monotonic()
+        try:
+            answer = self.cache.lookup(vector, docs)
+            if answer is None:
+                return False
+            elapsed = time.monotonic() - start
+            chat_hist = generator.get_chat_hist_instance(req.session_id)
+            generator.record_cached_answer(req.user_input, chat_hist, answer, elapsed)
+        except Exception as e:
+            print(f"[CACHE][WARN] lookup failed: {e}")
+            return False
+
+        if req.tokens is None:
+            req.future.set_result((answer, elapsed))
+        else:
+            req.tokens.put_nowait(answer)
+            req.future.set_result({
+                "response": answer,
+                "sources": generator.SourceRenderer(docs).labels(),
+                "duration": elapsed,
+                "ttft": elapsed,
+                "cached": True,
+            })
+        self._observe(req, "cached")
+        self._release(req)
+        return True
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _generate(self, req: ChatRequest, docs, vector=None, chain=None):
+        if chain is None:
+            try:
+                chain = await self._slots.get()
+            except asyncio.CancelledError:
+                self._release(req)
+                raise
+        try:
+            if req.future.done():
+                return
+            if req.expired():
+                req.future.set_exception(DeadlineExceededError("Chat request expired before generation."))
+                self._observe(req, "expired")
+                return
+
+            wait = time.monotonic() - req.enqueued_at
+            metrics.SLOT_WAIT_SECONDS.observe(wait)
+            metrics.LAST_SLOT_WAIT.set(wait)
+            self._running += 1
+            try:
+                chat_hist = generator.get_chat_hist_instance(req.session_id)
+                final = await self._stream(req, chain, chat_hist, docs)
+            finally:
+                self._running -= 1
+
+            if final is None:  # abandonnée en cours de génération
+                if not req.future.done():
+                    req.future.set_exception(DeadlineExceededError("Chat request deadline exceeded."))
+                self._observe(req, "expired")
+                return
+            result = final if req.tokens is not None else (final["response"], final["duration"])
+            if not req.future.done():
+                req.future.set_result(result)
+            self._observe(req, "generated")
+            self._store_cached(docs, vector, result)
+        except Exception as e:
+            if not req.future.done():
+                req.future.set_exception(e)
+            self._observe(req, "error")
+        finally:
+            self._release(req)
+            self._slots.put_nowait(chain)
+
+    def _store_cached(self, docs, vector, result):
+        if self.cache is None or vector is None or not result:
+            return
+        answer = result[0] if isinstance(result, tuple) else result.get("response")
+        if not answer:
+            return
+        try:
+            self.cache.store(vector, docs, answer)
+        except Exception as e:
+            print(f"[CACHE][WARN] store failed: {e}")
+
+    @staticmethod
+    async def _stream(req: ChatRequest, chain, chat_hist, docs):
+        """
+        Génère en flux (aussi pour /chat : l'échéance est vérifiée entre deux
+        fragments) et relaie les fragments vers `req.tokens` en mode streaming.
+        Renvoie le dict final, ou None si la requête a été abandonnée.
+        """
+        final = None
+        gen = generator.stream_chat_st(req.user_input, chain, chat_hist, docs)
+        try:
+            async for kind, payload in gen:
+                if req.future.done() or req.expired():
+                    # Client parti / échéance dépassée : on libère le slot au plus tôt
+                    break
+                if kind == "token":
+                    if req.tokens is not None:
+                        req.tokens.put_nowait(payload)
+                else:
+                    final = payload
+        finally:
+            await gen.aclose()
+        return final
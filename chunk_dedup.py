@@ -0,0 +1,305 @@
+"""
+chunk_dedup.py — détection des chunks dupliqués / quasi dupliqués à l'ingestion
+
+Le corpus contient plusieurs révisions d'un même manuel (v1.0, v1.1…) : sans
+filtre, chaque chunk identique est embeddé, stocké dans Milvus (index HNSW
+plus gros, plus lent) et occupe des places du contexte k=2 du chat.
+SourceRenderer et _dedupe_by_source ne dédupliquent qu'après la recherche.
+
+Signatures par chunk (16 octets) :
+- exacte : blake2b 64 bits du texte normalisé (minuscules, blancs fusionnés)
+- SimHash 64 bits des 3-grammes de mots : deux chunks quasi identiques
+  (quelques mots modifiés) sont à une distance de Hamming <= max_hamming
+  (6 par défaut ; deux chunks sans rapport sont vers 32). Recherche par
+  bandes : max_hamming + 1 bandes, deux signatures à distance <= max_hamming
+  en partagent au moins une (principe des tiroirs).
+  Appliqué aux chunks d'au moins `min_words` mots (SimHash peu fiable en
+  dessous) ; les plus courts ne sont comparés qu'à l'identique.
+
+Un chunk dont un équivalent est déjà indexé pour une AUTRE source n'est ni
+embeddé ni stocké : il est lié à la source canonique (links). Si la source
+canonique change ou disparaît, ses dépendantes sont ré-ingérées
+(dependents() ; sync_index le fait, /upload les retire du manifeste pour le
+prochain `sync`).
+
+Fichiers (paths.dedup_dir) : meta.json (sources, liens, chunks évités),
+arrays.npz (exact, simhash, src). Amorcé depuis l'index BM25 si absent.
+
+    python chunk_dedup.py report    # vecteurs et octets évités
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+INDEX_VERSION = 1
+SHINGLE = 3
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def exact_key(text: str) -> int:
+    """Empreinte du texte normalisé (casse et blancs ignorés)."""
+    return _hash64(" ".join((text or "").lower().split()))
+
+
+def simhash(words: List[str]) -> int:
+    """SimHash 64 bits des 3-grammes de mots."""
+    if not words:
+        return 0
+    shingles = {" ".join(words[i:i + SHINGLE]) for i in range(max(1, len(words) - SHINGLE + 1))}
+    hashes = np.fromiter((_hash64(s) for s in shingles), dtype=np.uint64, count=len(shingles))
+    ones = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).sum(axis=0)
+    return sum(1 << int(i) for i in np.flatnonzero(ones * 2 > len(hashes)))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(sig: int, n_bands: int) -> List[int]:
+    """Clés des `n_bands` bandes de bits consécutifs (préfixées par leur rang)."""
+    width = 64 // n_bands
+    mask = (1 << width) - 1
+    return [(b << width) | ((sig >> (b * width)) & mask) for b in range(n_bands)]
+
+
+class DedupIndex:
+    """Signatures des chunks indexés, par source ; liens des chunks évités vers leur source canonique."""
+
+    def __init__(self, path: str, near: bool = True, max_hamming: int = 6, min_words: int = 20):
+        self.path = path
+        self.near, self.max_hamming, self.min_words = near, max_hamming, min_words
+        self.n_bands = max_hamming + 1
+        self.sources: List[str] = []
+        self._source_ids: Dict[str, int] = {}
+        self.exact: List[int] = []
+        self.sims: List[int] = []   # 0 = chunk trop court pour SimHash
+        self.src: List[int] = []    # -1 = supprimé
+        # source -> {source canonique: nb de chunks liés}
+        self.links: Dict[str, Dict[str, int]] = {}
+        # source -> {"exact": n, "near": n, "bytes": octets de texte}
+        self.skipped: Dict[str, Dict[str, int]] = {}
+        self.run = {"exact": 0, "near": 0, "bytes": 0}  # depuis le chargement
+        self._by_exact: Dict[int, List[int]] = defaultdict(list)
+        self._by_band: Dict[int, List[int]] = defaultdict(list)
+
+    # ---------- Fichiers ----------
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.path, "meta.json")
+
+    @property
+    def _arrays_path(self) -> str:
+        return os.path.join(self.path, "arrays.npz")
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "DedupIndex":
+        idx = cls(path, **kwargs)
+        if not os.path.exists(idx._meta_path):
+            return idx
+        try:
+            with open(idx._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != INDEX_VERSION:
+                raise ValueError(f"unsupported version {meta.get('version')}")
+            idx.sources = list(meta["sources"])
+            idx._source_ids = {s: i for i, s in enumerate(idx.sources)}
+            idx.links = {s: dict(v) for s, v in meta.get("links", {}).items()}
+            idx.skipped = {s: dict(v) for s, v in meta.get("skipped", {}).items()}
+            with np.load(idx._arrays_path) as arrays:
+                idx.exact = [int(x) for x in arrays["exact"]]
+                idx.sims = [int(x) for x in arrays["simhash"]]
+                idx.src = [int(x) for x in arrays["src"]]
+            idx._reindex()
+        except Exception as e:
+            print(f"[DEDUP][WARN] cannot load signature index from {path}: {e} — starting empty")
+            return cls(path, **kwargs)
+        return idx
+
+    @classmethod
+    def create(cls, path: str, **kwargs) -> "DedupIndex":
+        """Index vide ; efface les fichiers existants (reconstruction complète)."""
+        idx = cls(path, **kwargs)
+        for p in (idx._meta_path, idx._arrays_path):
+            if os.path.exists(p):
+                os.remove(p)
+        return idx
+
+    def save(self) -> None:
+        """Compacte (lignes supprimées retirées) puis écrit arrays + meta atomiquement."""
+        os.makedirs(self.path, exist_ok=True)
+        keep = [i for i, s in enumerate(self.src) if s >= 0]
+        self.exact = [self.exact[i] for i in keep]
+        self.sims = [self.sims[i] for i in keep]
+        self.src = [self.src[i] for i in keep]
+        self._reindex()
+
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".npz")
+        os.close(fd)
+        np.savez(tmp, exact=np.array(self.exact, dtype=np.uint64),
+                 simhash=np.array(self.sims, dtype=np.uint64), src=np.array(self.src, dtype=np.int32))
+        os.replace(tmp, self._arrays_path)
+
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "sources": self.sources,
+                       "links": self.links, "skipped": self.skipped}, f, ensure_ascii=False)
+        os.replace(tmp, self._meta_path)
+
+    def _reindex(self) -> None:
+        self._by_exact, self._by_band = defaultdict(list), defaultdict(list)
+        for row, (key, sig, src) in enumerate(zip(self.exact, self.sims, self.src)):
+            if src >= 0:
+                self._index_row(row, key, sig)
+
+    def _index_row(self, row: int, key: int, sig: int) -> None:
+        self._by_exact[key].append(row)
+        if sig:
+            for band in _bands(sig, self.n_bands):
+                self._by_band[band].append(row)
+
+    # ---------- Signatures ----------
+
+    @property
+    def n_rows(self) -> int:
+        return sum(1 for s in self.src if s >= 0)
+
+    def _signature(self, text: str) -> Tuple[int, int]:
+        words = _WORD.findall((text or "").lower())
+        return exact_key(text), (simhash(words) if self.near and len(words) >= self.min_words else 0)
+
+    def _match(self, key: int, sig: int, source_id: int) -> Tuple[Optional[int], str]:
+        """(ligne canonique, "exact" / "near") d'une autre source, ou (None, "")."""
+        for row in self._by_exact.get(key, ()):
+            if self.src[row] >= 0 and self.src[row] != source_id:
+                return row, "exact"
+        if sig:
+            for band in _bands(sig, self.n_bands):
+                for row in self._by_band.get(band, ()):
+                    if (self.src[row] >= 0 and self.src[row] != source_id
+                            and hamming(sig, self.sims[row]) <= self.max_hamming):
+                        return row, "near"
+        return None, ""
+
+    def _source_id(self, source: str) -> int:
+        if source not in self._source_ids:
+            self._source_ids[source] = len(self.sources)
+            self.sources.append(source)
+        return self._source_ids[source]
+
+    # ---------- Ingestion ----------
+
+    def filter(self, source: str, docs: List[Any]) -> Tuple[List[Any], List[Tuple[Any, str, str]]]:
+        """
+        Sépare les chunks de `source` : (à indexer, doublons) ; un doublon est
+        (doc, source canonique, "exact" / "near"). Rien n'est enregistré : add()
+        après une insertion réussie.
+        """
+        source_id = self._source_ids.get(source, -2)
+        kept, dups = [], []
+        for doc in docs:
+            row, kind = self._match(*self._signature(doc.page_content), source_id)
+            if row is None:
+                kept.append(doc)
+            else:
+                dups.append((doc, self.sources[self.src[row]], kind))
+        return kept, dups
+
+    def add(self, source: str, kept: List[Any], dups: Iterable[Tuple[Any, str, str]] = ()) -> None:
+        """Enregistre les signatures des chunks indexés et les liens des doublons évités."""
+        source_id = self._source_id(source)
+        for doc in kept:
+            key, sig = self._signature(doc.page_content)
+            self.exact.append(key)
+            self.sims.append(sig)
+            self.src.append(source_id)
+            self._index_row(len(self.src) - 1, key, sig)
+        for doc, canonical, kind in dups:
+            links = self.links.setdefault(source, {})
+            links[canonical] = links.get(canonical, 0) + 1
+            stats = self.skipped.setdefault(source, {"exact": 0, "near": 0, "bytes": 0})
+            n_bytes = len(doc.page_content.encode("utf-8"))
+            for counter in (stats, self.run):
+                counter[kind] += 1
+                counter["bytes"] += n_bytes
+
+    def delete_source(self, source: str) -> None:
+        """Oublie les signatures et les liens de `source` (les dépendantes restent : dependents())."""
+        source_id = self._source_ids.get(source)
+        if source_id is not None:
+            self.src = [-1 if s == source_id else s for s in self.src]
+            self._reindex()
+        self.links.pop(source, None)
+        self.skipped.pop(source, None)
+
+    def dependents(self, sources: Iterable[str]) -> List[str]:
+        """Sources dont des chunks évités sont liés (transitivement) à `sources`."""
+        todo, out = list(sources), []
+        seen = set(todo)
+        while todo:
+            canonical = todo.pop()
+            for src, links in self.links.items():
+                if canonical in links and src not in seen:
+                    seen.add(src)
+                    out.append(src)
+                    todo.append(src)
+        return out
+
+    def bootstrap(self, docs: Iterable[Any]) -> int:
+        """Signatures de chunks déjà indexés (ex. docstore BM25), sans filtrage."""
+        n = 0
+        for doc in docs:
+            self.add((doc.metadata or {}).get("source", ""), [doc])
+            n += 1
+        return n
+
+    # ---------- Rapport ----------
+
+    def report(self, dim: int = 768) -> Dict[str, Any]:
+        """Chunks évités (tout l'index et depuis le chargement), vecteurs float32 de `dim` et texte."""
+        total = {"exact": 0, "near": 0, "bytes": 0}
+        for stats in self.skipped.values():
+            for k in total:
+                total[k] += stats.get(k, 0)
+        out: Dict[str, Any] = {"indexed_chunks": self.n_rows, "linked_sources": len(self.links)}
+        for name, counts in (("total", total), ("run", self.run)):
+            vectors = counts["exact"] + counts["near"]
+            out[name] = {"vectors": vectors, "exact": counts["exact"], "near": counts["near"],
+                         "vector_bytes": vectors * dim * 4, "text_bytes": counts["bytes"]}
+        return out
+
+    def summary(self, dim: int = 768) -> str:
+        r = self.report(dim)
+        run, total = r["run"], r["total"]
+        return (f"[DEDUP] skipped {run['vectors']} chunks this run (exact={run['exact']} near={run['near']}) ; "
+                f"index-wide {total['vectors']} vectors / {(total['vector_bytes'] + total['text_bytes']) / 2**20:.1f} MiB "
+                f"saved across {r['linked_sources']} linked sources")
+
+
+if __name__ == "__main__":
+    import sys
+
+    import paths
+
+    if len(sys.argv) >= 2 and sys.argv[1] == "report":
+        idx = DedupIndex.load(paths.dedup_dir)
+        print(json.dumps(idx.report(), indent=2))
+        for src, links in sorted(idx.links.items()):
+            print(f"{os.path.basename(src)} -> " + ", ".join(f"{os.path.basename(c)} ({n})" for c, n in links.items()))
+    else:
+        print("Usage: python chunk_dedup.py report")
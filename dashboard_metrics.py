@@ -0,0 +1,316 @@
+"""
+dashboard_metrics.py — agrégats journaliers du dashboard (Redis, taille bornée)
+
+Remplace la liste `response_times:{date}` (un RPUSH par réponse, sans limite,
+relue en entier par LRANGE à chaque affichage) par un histogramme à buckets
+fixes par jour :
+
+    latency_hist:{date}   HASH  b<i> -> nombre de réponses dans le bucket i,
+                                "count", "sum" (secondes)
+
+- écriture : 3 commandes dans le pipeline déjà ouvert par l'historique de
+  chat (HINCRBY bucket, HINCRBY count, HINCRBYFLOAT sum) + EXPIRE
+- taille fixe (len(BUCKETS) + 2 champs par jour), quelle que soit l'activité
+- lecture : un HGETALL par jour, tous dans un seul pipeline ; p50 / p95 / p99
+  interpolés dans le bucket (erreur bornée par la largeur du bucket)
+
+`responses:{date}` (compteur) est conservé tel quel.
+
+Utilisateurs uniques : HyperLogLog `users_hll:{date}` (PFADD, ~12 Ko max par
+jour, erreur ~0,8 %) au lieu d'un SET des session_id.
+
+Rollup journalier (lu par le dashboard) :
+
+    rollup:{date}   HASH  users, positive, negative, responses,
+                          latency_count, latency_mean, p50, p95, p99, final
+
+Un jour passé est résumé une fois (final=1) puis relu tel quel ; seul le jour
+courant est recalculé. fetch_rollups() lit une plage quelconque (7 / 30 / 90
+jours) en au plus trois allers-retours : HGETALL des rollups, lecture des
+compteurs bruts des jours manquants, écriture des nouveaux rollups.
+
+    python dashboard_metrics.py migrate          # response_times:* et users:* (anciens formats)
+    python dashboard_metrics.py rollup --days 90 # pré-calcule les rollups (cron)
+"""
+
+from __future__ import annotations
+
+import bisect
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import paths
+
+# Bornes supérieures (s) des buckets ; le dernier recueille tout le reste
+BUCKETS: tuple = (
+    0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0, 5.0, 6.0, 8.0, 10.0, 12.5, 15.0,
+    20.0, 25.0, 30.0, 40.0, 50.0, 60.0, 90.0, 120.0, 180.0, 300.0, float("inf"),
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+ROLLUP_FIELDS = ("users", "positive", "negative", "responses", "latency_count", "latency_mean", "p50", "p95", "p99")
+
+
+def hist_key(day: str) -> str:
+    return f"latency_hist:{day}"
+
+
+def users_key(day: str) -> str:
+    return f"users_hll:{day}"
+
+
+def rollup_key(day: str) -> str:
+    return f"rollup:{day}"
+
+
+def today() -> str:
+    return datetime.utcnow().date().isoformat()
+
+
+def last_days(n: int, end: Optional[str] = None) -> List[str]:
+    """Les n derniers jours (ISO), du plus ancien à `end` (défaut : aujourd'hui)."""
+    last = datetime.fromisoformat(end or today()).date()
+    return [(last - timedelta(days=i)).isoformat() for i in range(n - 1, -1, -1)]
+
+
+def _ttl() -> int:
+    return paths.DASHBOARD_RETENTION_DAYS * 86400
+
+
+def bucket_index(seconds: float) -> int:
+    return min(bisect.bisect_left(BUCKETS, max(0.0, float(seconds))), len(BUCKETS) - 1)
+
+
+def record_response(pipe, elapsed: float, day: Optional[str] = None) -> None:
+    """Ajoute une réponse (durée `elapsed` en s) aux agrégats du jour, dans `pipe`."""
+    day = day or today()
+    key = hist_key(day)
+    pipe.hincrby(key, f"b{bucket_index(elapsed)}", 1)
+    pipe.hincrby(key, "count", 1)
+    pipe.hincrbyfloat(key, "sum", float(elapsed))
+    pipe.expire(key, _ttl())
+    pipe.incr(f"responses:{day}")
+
+
+def record_user(client, session_id: str, day: Optional[str] = None) -> None:
+    """Compte `session_id` parmi les utilisateurs uniques du jour (HyperLogLog)."""
+    key = users_key(day or today())
+    pipe = client.pipeline(transaction=False)
+    pipe.pfadd(key, session_id)
+    pipe.expire(key, _ttl())
+    pipe.execute()
+
+
+# ---------- Lecture ----------
+
+def _text(v) -> str:
+    return v.decode() if isinstance(v, bytes) else str(v)
+
+
+def parse_hist(raw: Dict) -> List[int]:
+    """HGETALL -> nombre de réponses par bucket."""
+    counts = [0] * len(BUCKETS)
+    for field, value in (raw or {}).items():
+        field = _text(field)
+        if field.startswith("b"):
+            i = int(field[1:])
+            if 0 <= i < len(counts):
+                counts[i] += int(_text(value))
+    return counts
+
+
+def quantile(counts: Sequence[int], q: float) -> Optional[float]:
+    """Quantile q interpolé linéairement dans son bucket (None si vide)."""
+    total = sum(counts)
+    if total == 0:
+        return None
+    rank = q * total
+    seen = 0
+    for i, n in enumerate(counts):
+        if n and seen + n >= rank:
+            lower = BUCKETS[i - 1] if i > 0 else 0.0
+            upper = BUCKETS[i] if BUCKETS[i] != float("inf") else lower
+            return lower + (upper - lower) * (rank - seen) / n
+        seen += n
+    return BUCKETS[-2]
+
+
+def summarize(raw: Dict, qs: Iterable[float] = QUANTILES) -> Dict[str, Optional[float]]:
+    """{"count", "mean", "p50", "p95", "p99"} d'un histogramme journalier (HGETALL)."""
+    counts = parse_hist(raw)
+    fields = {_text(k): _text(v) for k, v in (raw or {}).items()}
+    n = int(fields.get("count", sum(counts)) or 0)
+    out: Dict[str, Optional[float]] = {
+        "count": n,
+        "mean": float(fields.get("sum", 0.0)) / n if n else None,
+    }
+    for q in qs:
+        out[f"p{int(round(q * 100))}"] = quantile(counts, q)
+    return out
+
+
+def fetch_latency(r, days: Sequence[str]) -> List[Dict[str, Optional[float]]]:
+    """Résumés de latence de plusieurs jours : un seul aller-retour Redis."""
+    pipe = r.pipeline(transaction=False)
+    for day in days:
+        pipe.hgetall(hist_key(day))
+    return [summarize(raw) for raw in pipe.execute()]
+
+
+# ---------- Rollup journalier ----------
+
+def _raw_commands(pipe, day: str) -> None:
+    pipe.pfcount(users_key(day))
+    pipe.scard(f"users:{day}")  # ancien format (SET), avant migration
+    pipe.get(f"feedback:positive:{day}")
+    pipe.get(f"feedback:negative:{day}")
+    pipe.get(f"responses:{day}")
+    pipe.hgetall(hist_key(day))
+
+
+_RAW_PER_DAY = 6
+
+
+def _summary(raw: Sequence) -> Dict[str, Optional[float]]:
+    hll, legacy_users, pos, neg, responses, hist = raw
+    lat = summarize(hist)
+    return {
+        "users": int(hll or 0) or int(legacy_users or 0),
+        "positive": int(pos or 0),
+        "negative": int(neg or 0),
+        "responses": int(responses or 0),
+        "latency_count": lat["count"],
+        "latency_mean": lat["mean"],
+        "p50": lat["p50"],
+        "p95": lat["p95"],
+        "p99": lat["p99"],
+    }
+
+
+def _encode(summary: Dict, final: bool) -> Dict[str, str]:
+    out = {k: "" if summary[k] is None else repr(summary[k]) for k in ROLLUP_FIELDS}
+    out["final"] = "1" if final else "0"
+    return out
+
+
+def _decode(raw: Dict) -> Dict[str, Optional[float]]:
+    fields = {_text(k): _text(v) for k, v in raw.items()}
+    out: Dict[str, Optional[float]] = {}
+    for k in ROLLUP_FIELDS:
+        v = fields.get(k, "")
+        out[k] = None if v == "" else (float(v) if "." in v or "e" in v else int(v))
+    return out
+
+
+def fetch_rollups(r, days: Sequence[str], now: Optional[str] = None) -> List[Dict[str, Optional[float]]]:
+    """
+    Résumés journaliers de `days` (même ordre). Les jours passés sans rollup
+    sont résumés puis enregistrés (final) ; le jour courant est toujours relu.
+    """
+    now = now or today()
+    pipe = r.pipeline(transaction=False)
+    for day in days:
+        pipe.hgetall(rollup_key(day))
+    cached = pipe.execute()
+
+    out: List[Optional[Dict]] = [None] * len(days)
+    stale = []
+    for i, (day, raw) in enumerate(zip(days, cached)):
+        if raw and _text(raw.get("final", raw.get(b"final", "0"))) == "1":
+            out[i] = _decode(raw)
+        else:
+            stale.append(i)
+    if not stale:
+        return out
+
+    pipe = r.pipeline(transaction=False)
+    for i in stale:
+        _raw_commands(pipe, days[i])
+    values = pipe.execute()
+
+    closed = []
+    for n, i in enumerate(stale):
+        out[i] = _summary(values[n * _RAW_PER_DAY:(n + 1) * _RAW_PER_DAY])
+        if days[i] < now:  # journée close : résumé définitif
+            closed.append(i)
+    if closed:
+        pipe = r.pipeline(transaction=False)
+        for i in closed:
+            pipe.hset(rollup_key(days[i]), mapping=_encode(out[i], final=True))
+            pipe.expire(rollup_key(days[i]), _ttl())
+        pipe.execute()
+    return out
+
+
+# ---------- Migration ----------
+
+def migrate_response_times(r, batch: int = 10000) -> int:
+    """Replie les anciennes listes `response_times:{date}` en histogrammes puis les supprime."""
+    moved = 0
+    for key in r.scan_iter(match="response_times:*", count=100):
+        day = _text(key).split(":", 1)[1]
+        counts = [0] * len(BUCKETS)
+        total, n, start = 0.0, 0, 0
+        while True:
+            values = r.lrange(key, start, start + batch - 1)
+            if not values:
+                break
+            for v in values:
+                seconds = float(_text(v))
+                counts[bucket_index(seconds)] += 1
+                total += seconds
+                n += 1
+            start += batch
+        pipe = r.pipeline(transaction=True)
+        for i, c in enumerate(counts):
+            if c:
+                pipe.hincrby(hist_key(day), f"b{i}", c)
+        pipe.hincrby(hist_key(day), "count", n)
+        pipe.hincrbyfloat(hist_key(day), "sum", total)
+        pipe.expire(hist_key(day), _ttl())
+        pipe.delete(key)
+        pipe.delete(rollup_key(day))
+        pipe.execute()
+        moved += n
+    return moved
+
+
+def migrate_user_sets(r, batch: int = 1000) -> int:
+    """Replie les SET `users:{date}` dans les HyperLogLog `users_hll:{date}` puis les supprime."""
+    moved = 0
+    for key in r.scan_iter(match="users:*", count=100):
+        day = _text(key).split(":", 1)[1]
+        members = [_text(m) for m in r.sscan_iter(key, count=batch)]
+        pipe = r.pipeline(transaction=True)
+        for start in range(0, len(members), batch):
+            pipe.pfadd(users_key(day), *members[start:start + batch])
+        pipe.expire(users_key(day), _ttl())
+        pipe.delete(key)
+        pipe.delete(rollup_key(day))
+        pipe.execute()
+        moved += len(members)
+    return moved
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import redis_db
+
+    parser = argparse.ArgumentParser(description="Dashboard daily aggregates (Redis).")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("migrate", help="response_times:* lists -> latency_hist:*, users:* sets -> users_hll:*")
+    rp = sub.add_parser("rollup", help="precompute the rollup:{date} hashes of closed days")
+    rp.add_argument("--days", type=int, default=90)
+    args = parser.parse_args()
+
+    client = redis_db.create_redis_client()
+    if args.cmd == "migrate":
+        n = migrate_response_times(client)
+        print(f"[METRICS] {n} response times folded into latency histograms")
+        n = migrate_user_sets(client)
+        print(f"[METRICS] {n} session ids folded into HyperLogLogs")
+    else:
+        rows = fetch_rollups(client, last_days(args.days))
+        print(f"[METRICS] {len(rows)} daily rollups up to date")
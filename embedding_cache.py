@@ -0,0 +1,147 @@
+"""
+embedding_cache.py — cache des embeddings de requêtes (mpnet)
+
+CachedEmbeddings enveloppe n'importe quel `Embeddings` LangChain :
+
+- niveau 1 : LRU en mémoire (OrderedDict), clé = texte normalisé
+- niveau 2 (optionnel) : Redis, vecteur stocké en float32 brut + TTL
+  (client créé avec decode_responses=False)
+- compteurs l1_hits / l2_hits / misses (stats())
+
+Seules les requêtes (embed_query / embed_queries) passent par le cache ;
+embed_documents (ingestion du corpus) est transmis tel quel pour ne pas
+polluer le LRU avec des chunks vus une seule fois.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Normalisation de la clé : NFKC + espaces compactés (casse conservée)."""
+    return _WS.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings avec cache LRU (+ Redis optionnel) sur les requêtes."""
+
+    def __init__(
+        self,
+        inner: Embeddings,
+        max_entries: int = 2048,
+        redis_client=None,
+        ttl_seconds: int = 7 * 24 * 3600,
+        namespace: str = "default",
+    ):
+        self.inner = inner
+        self.max_entries = max(1, int(max_entries))
+        self.redis = redis_client
+        self.ttl = int(ttl_seconds)
+        self.prefix = f"emb_cache:{namespace}"
+
+        self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+
+    # ---------- Embeddings API ----------
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Encode un lot de requêtes ; seules les requêtes absentes du cache sont calculées."""
+        keys = [normalize_query(t) for t in texts]
+        out: List[Optional[List[float]]] = [self._l1_get(k) for k in keys]
+
+        todo = [i for i, v in enumerate(out) if v is None]
+        if todo and self.redis is not None:
+            found = 0
+            for i, vec in zip(todo, self._l2_get([keys[i] for i in todo])):
+                if vec is not None:
+                    out[i] = vec
+                    self._l1_put(keys[i], vec)
+                    found += 1
+            todo = [i for i, v in enumerate(out) if v is None]
+            with self._lock:
+                self.l2_hits += found
+
+        if todo:
+            # une seule passe d'encodage pour toutes les requêtes inconnues (dédupliquées)
+            uniq = list(dict.fromkeys(keys[i] for i in todo))
+            vectors = dict(zip(uniq, self.inner.embed_documents(uniq)))
+            for i in todo:
+                out[i] = vectors[keys[i]]
+            for k, vec in vectors.items():
+                self._l1_put(k, vec)
+            self._l2_put(vectors)
+            with self._lock:
+                self.misses += len(todo)
+
+        return out  # type: ignore[return-value]
+
+    # ---------- Stats ----------
+
+    def stats(self) -> dict:
+        total = self.l1_hits + self.l2_hits + self.misses
+        return {
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.l1_hits + self.l2_hits) / total, 4) if total else 0.0,
+            "l1_entries": len(self._lru),
+        }
+
+    # ---------- Interne ----------
+
+    def _l1_get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vec = self._lru.get(key)
+            if vec is not None:
+                self._lru.move_to_end(key)
+                self.l1_hits += 1
+            return vec
+
+    def _l1_put(self, key: str, vec: List[float]):
+        with self._lock:
+            self._lru[key] = vec
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _rkey(self, key: str) -> str:
+        return f"{self.prefix}:{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+
+    def _l2_get(self, keys: List[str]) -> List[Optional[List[float]]]:
+        try:
+            raw = self.redis.mget([self._rkey(k) for k in keys])
+        except Exception as e:
+            print(f"[EMB-CACHE][WARN] redis get failed: {e}")
+            return [None] * len(keys)
+        return [np.frombuffer(b, dtype=np.float32).tolist() if b else None for b in raw]
+
+    def _l2_put(self, vectors: dict):
+        if self.redis is None or not vectors:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for k, vec in vectors.items():
+                pipe.set(self._rkey(k), np.asarray(vec, dtype=np.float32).tobytes(), ex=self.ttl)
+            pipe.execute()
+        except Exception as e:
+            print(f"[EMB-CACHE][WARN] redis set failed: {e}")
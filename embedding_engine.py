@@ -0,0 +1,189 @@
+"""
+embedding_engine.py — moteur d'embedding mpnet pour l'ingestion (CPU)
+
+- chunks triés par longueur puis encodés par lots (EMBED_BATCH_SIZE) :
+  moins de padding par lot
+- backends CPU : "torch" (fp32), "int8" (quantization dynamique des Linear),
+  "onnx" (sentence-transformers + optimum/onnxruntime, optionnel)
+- insert_documents() écrit dans Milvus par paquets fixes (MILVUS_INSERT_BATCH) :
+  la mémoire crête dépend de la taille du paquet, plus de celle du corpus
+- stats chunks/s (embedding seul et embedding + insert) pour comparer les backends
+
+Implémente l'interface `Embeddings` LangChain : peut servir d'embedding_function
+au vectorstore Milvus (retriever.load_vectorstore).
+
+Benchmark :
+    python embedding_engine.py bench [n_chunks]   # compare torch / int8 / onnx
+"""
+
+from __future__ import annotations
+
+import os
+import pickle
+import sys
+import time
+from typing import Any, List
+
+from langchain_core.embeddings import Embeddings
+
+import paths
+
+BACKENDS = ("torch", "int8", "onnx")
+# Précision des poids par backend (fait partie de l'espace de clés du cache)
+_PRECISION = {"torch": "fp32", "int8": "qint8", "onnx": "fp32"}
+
+
+def cache_namespace(model_path: str, backend: str) -> str:
+    """
+    Espace de clés du cache d'embeddings (embedding_cache.CachedEmbeddings) :
+    modèle + backend effectif + précision. Les vecteurs fp32 et int8 d'un même
+    modèle diffèrent : ils ne doivent pas se servir mutuellement depuis Redis.
+    """
+    return f"{os.path.basename(os.path.normpath(model_path))}:{backend}-{_PRECISION[backend]}"
+
+
+def _load_model(model_path: str, backend: str):
+    """Charge le modèle ; renvoie (model, backend effectivement utilisé)."""
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "onnx":
+        try:
+            return SentenceTransformer(model_path, device="cpu", backend="onnx"), "onnx"
+        except Exception as e:  # optimum / onnxruntime absents, export impossible…
+            print(f"[EMBED][WARN] ONNX backend unavailable ({e}) — falling back to torch")
+            backend = "torch"
+
+    model = SentenceTransformer(model_path, device="cpu")
+    if backend == "int8":
+        import torch
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model, backend
+
+
+class EmbeddingEngine(Embeddings):
+    """Encodage par lots triés par longueur + insertion Milvus par paquets."""
+
+    def __init__(
+        self,
+        model_path: str = paths.bert_model_path,
+        backend: str = "torch",
+        batch_size: int = 64,
+        insert_batch: int = 512,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown embedding backend '{backend}' (expected one of {BACKENDS}).")
+        self.model_path = model_path
+        self.batch_size = max(1, int(batch_size))
+        self.insert_batch = max(1, int(insert_batch))
+        self.model, self.backend = _load_model(model_path, backend)
+        self.cache_namespace = cache_namespace(model_path, self.backend)
+
+        self.n_chunks = 0
+        self.embed_seconds = 0.0
+        self.insert_seconds = 0.0
+
+    # ---------- Embeddings API ----------
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # tri par longueur décroissante -> lots homogènes, puis ordre d'origine restauré
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        start = time.perf_counter()
+        vectors = self.model.encode(
+            [texts[i] for i in order],
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        self.embed_seconds += time.perf_counter() - start
+        self.n_chunks += len(texts)
+
+        out: List[Any] = [None] * len(texts)
+        for pos, i in enumerate(order):
+            out[i] = vectors[pos].tolist()
+        return out
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.model.encode(text, convert_to_numpy=True, show_progress_bar=False).tolist()
+
+    # ---------- Ingestion ----------
+
+    def insert_documents(self, vectorstore, docs: List[Any], progress=None) -> List:
+        """
+        Embedde et insère `docs` par paquets de `insert_batch` (triés par longueur).
+        Renvoie les clés primaires Milvus alignées sur `docs` (ordre d'entrée).
+        `progress(stage, n)` ("embedded" / "inserted") est appelé après chaque paquet.
+        """
+        order = sorted(range(len(docs)), key=lambda i: len(docs[i].page_content), reverse=True)
+        ids: List[Any] = [None] * len(docs)
+        for i in range(0, len(order), self.insert_batch):
+            idx = order[i:i + self.insert_batch]
+            texts = [docs[j].page_content for j in idx]
+            vectors = self.embed_documents(texts)
+            if progress is not None:
+                progress("embedded", len(texts))
+            start = time.perf_counter()
+            pks = vectorstore.add_embeddings(
+                texts=texts,
+                embeddings=vectors,
+                metadatas=[docs[j].metadata for j in idx],
+                batch_size=self.insert_batch,
+            ) or []
+            self.insert_seconds += time.perf_counter() - start
+            if progress is not None:
+                progress("inserted", len(pks))
+            for j, pk in zip(idx, pks):
+                ids[j] = pk
+        return [pk for pk in ids if pk is not None]
+
+    # ---------- Stats ----------
+
+    def stats(self) -> dict:
+        total = self.embed_seconds + self.insert_seconds
+        return {
+            "backend": self.backend,
+            "chunks": self.n_chunks,
+            "embed_seconds": round(self.embed_seconds, 3),
+            "insert_seconds": round(self.insert_seconds, 3),
+            "embed_chunks_per_sec": round(self.n_chunks / self.embed_seconds, 1) if self.embed_seconds else 0.0,
+            "chunks_per_sec": round(self.n_chunks / total, 1) if total else 0.0,
+        }
+
+    def report(self) -> str:
+        s = self.stats()
+        return (f"[EMBED] backend={s['backend']} chunks={s['chunks']} "
+                f"embed={s['embed_chunks_per_sec']} chunks/s "
+                f"end-to-end={s['chunks_per_sec']} chunks/s")
+
+
+def get_engine() -> EmbeddingEngine:
+    """Moteur configuré via paths (EMBED_BACKEND, EMBED_BATCH_SIZE, MILVUS_INSERT_BATCH)."""
+    return EmbeddingEngine(
+        model_path=paths.bert_model_path,
+        backend=paths.EMBED_BACKEND,
+        batch_size=paths.EMBED_BATCH_SIZE,
+        insert_batch=paths.MILVUS_INSERT_BATCH,
+    )
+
+
+def _bench(n_chunks: int = 500):
+    """Compare les backends sur les chunks de preprocessed_data/chunks/all_splits.pkl."""
+    with open(os.path.join(paths.chunks_dir_path, "all_splits.pkl"), "rb") as f:
+        texts = [d.page_content for d in pickle.load(f)][:n_chunks]
+    print(f"Benchmark on {len(texts)} chunks (batch_size={paths.EMBED_BATCH_SIZE})")
+    for backend in BACKENDS:
+        engine = EmbeddingEngine(backend=backend, batch_size=paths.EMBED_BATCH_SIZE)
+        if engine.backend != backend:
+            continue
+        engine.embed_documents(texts[:8])  # warm-up
+        engine.n_chunks, engine.embed_seconds = 0, 0.0
+        engine.embed_documents(texts)
+        print(engine.report())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        _bench(int(sys.argv[2]) if len(sys.argv) >= 3 else 500)
+    else:
+        print("Usage: python embedding_engine.py bench [n_chunks]")
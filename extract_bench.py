@@ -0,0 +1,199 @@
+"""
+extract_bench.py — micro-benchmark de l'extraction PDF (pages/s)
+
+Compare, sur les mêmes pages :
+
+- legacy : l'ancienne extraction (get_text("text") + get_text("dict") avec
+  images, tri Python, `+=` par span) — la référence "avant"
+- layout : pdf_layout.page_lines(mode="layout"), une analyse par page
+- fast   : pdf_layout.page_lines(mode="fast"), ordre natif PyMuPDF
+
+Pour chaque mode : pages/s (meilleure de `--repeat` passes), accélération par
+rapport à legacy et part des pages au texte identique à legacy (layout doit
+rester à 100 %).
+
+    python extract_bench.py                      # PDF de paths.data_path
+    python extract_bench.py a.pdf b.pdf --repeat 5
+    python extract_bench.py --synthetic 200      # PDF généré (sans corpus)
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import fitz  # PyMuPDF
+
+import pdf_layout
+
+MODES = ("legacy", "layout", "fast")
+
+
+def legacy_page_lines(page, space_multiplier=0.5):
+    """Extraction d'origine (deux analyses de la page, concaténations `+=`), pour comparaison."""
+    plain_txt = page.get_text("text")
+    if pdf_layout.is_skippable_page(plain_txt):
+        return None
+    page_dict = page.get_text("dict")
+    rows = []
+    size_chars: Dict[float, int] = {}
+    blocks = sorted(page_dict.get("blocks", []), key=lambda b: b['bbox'][1])
+    for block in blocks:
+        lines = sorted(block.get("lines", []), key=lambda l: l['bbox'][1])
+        for line in lines:
+            spans = sorted(line.get("spans", []), key=lambda s: s['bbox'][0])
+            line_text = ""
+            cursor_x = None
+            size, bold = 0.0, True
+            for span in spans:
+                x0, _, x1, _ = span['bbox']
+                txt = span.get('text', '')
+                if cursor_x is not None:
+                    gap = x0 - cursor_x
+                    n_spaces = max(1, int(gap // (span['size'] * space_multiplier)))
+                    line_text += ' ' * n_spaces
+                line_text += txt
+                cursor_x = x1
+                if txt.strip():
+                    size = max(size, span['size'])
+                    bold = bold and bool(span.get('flags', 0) & 16)
+                    key = round(span['size'] * 2) / 2
+                    size_chars[key] = size_chars.get(key, 0) + len(txt)
+            rows.append((line_text.rstrip(), size, bold and size > 0, len(lines)))
+        rows.append(None)
+    body_size = max(size_chars, key=size_chars.get) if size_chars else 0.0
+    full_lines, headings = [], []
+    for row in rows:
+        if row is None:
+            full_lines.append("")
+            continue
+        text, size, bold, block_lines = row
+        if pdf_layout._is_heading(text, size, bold, block_lines, body_size):
+            headings.append(len(full_lines))
+        full_lines.append(text)
+    return full_lines, headings
+
+
+def _canonical(res):
+    """Texte (blancs de fin de bloc fusionnés) et titres d'une page : base de comparaison."""
+    if res is None:
+        return None
+    lines, headings = res
+    return pdf_layout.join_lines(lines), [lines[i] for i in headings]
+
+
+def _extractor(mode: str) -> Callable:
+    if mode == "legacy":
+        return legacy_page_lines
+    return lambda page: pdf_layout.page_lines(page, mode=mode)
+
+
+def synthetic_pdf(n_pages: int) -> bytes:
+    """PDF de test : titres, paragraphes, colonnes alignées et une image par page."""
+    doc = fitz.open()
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 256, 256), False)
+    pix.clear_with(200)
+    for p in range(n_pages):
+        page = doc.new_page()
+        page.insert_text((72, 60), f"{p + 1}. Section title", fontsize=16)
+        y = 90
+        for i in range(38):
+            page.insert_text((72, y), f"Line {i} of page {p + 1}: body text for the extraction benchmark.", fontsize=9)
+            if i % 4 == 0:
+                page.insert_text((420, y), f"0x{i:04X}", fontsize=9)
+            y += 12
+        page.insert_image(fitz.Rect(400, 620, 540, 760), pixmap=pix)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _open_docs(files: List[str], synthetic: int):
+    if synthetic:
+        return [("synthetic", fitz.open(stream=synthetic_pdf(synthetic), filetype="pdf"))]
+    docs = []
+    for f in files:
+        doc = pdf_layout.load_doc(f)
+        if doc is not None:
+            docs.append((os.path.basename(f), doc))
+    return docs
+
+
+def run_mode(docs, mode: str, repeat: int):
+    """(meilleur temps en s, nb de pages, sorties par page)."""
+    extract = _extractor(mode)
+    best, outputs = float("inf"), []
+    for _ in range(max(1, repeat)):
+        outputs = []
+        start = time.perf_counter()
+        for _, doc in docs:
+            for pno in range(doc.page_count):
+                outputs.append(extract(doc.load_page(pno)))
+        best = min(best, time.perf_counter() - start)
+    return best, len(outputs), outputs
+
+
+def benchmark(docs, modes=MODES, repeat: int = 3) -> List[dict]:
+    results, reference, legacy_s = [], None, None
+    for mode in modes:
+        seconds, n_pages, outputs = run_mode(docs, mode, repeat)
+        if mode == "legacy":
+            reference, legacy_s = outputs, seconds
+        row = {"mode": mode, "pages": n_pages, "seconds": round(seconds, 4),
+               "pages_per_s": round(n_pages / seconds, 1) if seconds else 0.0}
+        if reference is not None:
+            row["speedup"] = round(legacy_s / seconds, 2) if seconds else 0.0
+            same = sum(_canonical(a) == _canonical(b) for a, b in zip(outputs, reference))
+            row["identical_pages"] = round(same / max(1, n_pages), 4)
+        results.append(row)
+    return results
+
+
+def print_table(results: List[dict], out=sys.stderr) -> None:
+    print(f"{'mode':<10}{'pages':>8}{'seconds':>10}{'pages/s':>10}{'speedup':>9}{'identical':>11}", file=out)
+    for r in results:
+        print(f"{r['mode']:<10}{r['pages']:>8}{r['seconds']:>10.3f}{r['pages_per_s']:>10.1f}"
+              f"{r.get('speedup', 1.0):>8.2f}x{r.get('identical_pages', 1.0):>10.1%}", file=out)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="PDF extraction micro-benchmark (pages/s).")
+    parser.add_argument("files", nargs="*", help="PDF files (default: all PDFs in paths.data_path)")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated: legacy, layout, fast")
+    parser.add_argument("--repeat", type=int, default=3, help="passes per mode (best one is kept)")
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark a generated PDF of N pages instead")
+    parser.add_argument("--out", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    files = args.files
+    if not files and not args.synthetic:
+        import paths
+        files = sorted(glob.glob(os.path.join(paths.data_path, "*.pdf")))
+    docs = _open_docs(files, args.synthetic)
+    if not docs:
+        print("No PDF to benchmark — pass files or --synthetic N.", file=sys.stderr)
+        return 1
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes {sorted(unknown)}")
+    results = benchmark(docs, modes, args.repeat)
+    for _, doc in docs:
+        doc.close()
+    print_table(results)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"files": [name for name, _ in docs], "results": results}, f, indent=2)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,399 @@
+"""
+faiss_store.py — index vectoriel FAISS en processus (alternative à Milvus)
+
+Pour les installations mono-nœud / air-gapped (docs/AIRGAPPED.md) :
+VECTOR_BACKEND=faiss remplace la collection Milvus (gRPC, etcd, minio) par un
+index FAISS chargé dans le processus, derrière la même interface LangChain
+(retriever.load_vectorstore / get_retriever, add_embeddings, delete).
+
+- index : HNSW (IndexHNSWFlat) ou IVF_PQ (IndexIVFPQ), produit scalaire sur
+  vecteurs normalisés (= cosinus, comme la collection Milvus) ; ids int64
+  stables (IndexIDMap2) exposés en metadata["pk"] comme l'auto-id Milvus
+- IVF_PQ doit être entraîné : en dessous de `train_size` vecteurs, l'index
+  reste exact (IndexFlatIP) puis est converti au premier ajout qui dépasse
+- suppressions par id ou par source ; HNSW ne supportant pas remove_ids, les
+  ids supprimés sont exclus à la recherche (IDSelector) et l'index est
+  reconstruit au persist() au-delà de `compact_ratio` de tombstones
+- persistance atomique : chaque persist() écrit une génération complète
+  (index.faiss, docs.pkl, meta.json) dans un nouveau dossier, puis bascule le
+  pointeur CURRENT (os.replace) ; un lecteur voit l'ancienne ou la nouvelle
+- chargement memory-mapped (démarrage à froid sans relire l'index) ; l'index
+  est rechargé en mémoire avant la première écriture
+- un autre processus (preprocess.py sync) qui publie une génération est vu au
+  plus `reload_check_s` plus tard
+
+Le paramètre de recherche (ef HNSW / nprobe IVF) vient du profil
+index_config ; une surcharge par requête passe par `param` comme pour Milvus.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from functools import wraps
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+import paths
+from index_config import get_profile
+
+INDEX_TYPES = ("HNSW", "IVF_PQ")
+_FLAT = "FLAT"  # IVF_PQ pas encore entraîné
+
+
+def _locked(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _as_matrix(vectors) -> np.ndarray:
+    x = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+    if x.ndim == 1:
+        x = x.reshape(1, -1)
+    faiss.normalize_L2(x)
+    return x
+
+
+class FaissVectorStore(VectorStore):
+    """Vectorstore FAISS persistant (un dossier, générations atomiques)."""
+
+    schema_free = True  # pas de schéma figé : schema_normalizer n'a rien à aligner
+
+    def __init__(
+        self,
+        embedding: Any,
+        path: str,
+        index_type: str = "HNSW",
+        hnsw_m: int = 32,
+        ef_construction: int = 200,
+        nlist: int = 1024,
+        pq_m: int = 16,
+        pq_nbits: int = 8,
+        mmap: bool = True,
+        compact_ratio: float = 0.2,
+        reload_check_s: float = 2.0,
+    ):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported FAISS index type '{index_type}' (expected one of {INDEX_TYPES}).")
+        self.embedding = embedding
+        self.path = path
+        self.index_type = index_type
+        self.hnsw_m, self.ef_construction = int(hnsw_m), int(ef_construction)
+        self.nlist, self.pq_m, self.pq_nbits = int(nlist), int(pq_m), int(pq_nbits)
+        self.mmap = mmap
+        self.compact_ratio = float(compact_ratio)
+        self.reload_check_s = float(reload_check_s)
+
+        profile = get_profile()
+        self.search_params = {"metric_type": "COSINE", "params": {profile.search_key: profile.search_value("accurate")}}
+
+        self.index: Any = None
+        self.kind: Optional[str] = None        # "HNSW", "IVF_PQ" ou "FLAT"
+        self.dim: Optional[int] = None
+        self.docs: Dict[int, Tuple[str, dict]] = {}
+        self.by_source: Dict[str, set] = {}
+        self.tombstones: set = set()
+        self.next_id = 1
+        self.generation = 0
+        self._mapped = False
+        self._dirty = False
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+
+    # ---------- Propriétés ----------
+
+    @property
+    def embeddings(self) -> Any:
+        return self.embedding
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.docs)
+
+    @property
+    def train_size(self) -> int:
+        """Vecteurs nécessaires pour entraîner IVF_PQ (39 par centroïde, règle FAISS)."""
+        return 39 * max(self.nlist, 2 ** self.pq_nbits)
+
+    # ---------- Fichiers ----------
+
+    @property
+    def _current_path(self) -> str:
+        return os.path.join(self.path, "CURRENT")
+
+    def _read_current(self) -> Optional[str]:
+        try:
+            with open(self._current_path, "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    @_locked
+    def load(self) -> "FaissVectorStore":
+        """Charge la génération courante (si elle existe)."""
+        name = self._read_current()
+        if name is None:
+            return self
+        gen_dir = os.path.join(self.path, name)
+        with open(os.path.join(gen_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(gen_dir, "docs.pkl"), "rb") as f:
+            self.docs = pickle.load(f)
+        index_path = os.path.join(gen_dir, "index.faiss")
+        flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_MMAP if self.mmap else 0
+        self.index = faiss.read_index(index_path, flags) if os.path.exists(index_path) else None
+        self._mapped = bool(flags) and self.index is not None
+        self.kind, self.dim = meta["kind"], meta["dim"]
+        self.next_id = int(meta["next_id"])
+        self.generation = int(meta["generation"])
+        self.tombstones = set(meta.get("tombstones", []))
+        self.by_source = {}
+        for pk, (_, md) in self.docs.items():
+            self.by_source.setdefault(md.get("source", ""), set()).add(pk)
+        self._dirty = False
+        self._checked_at = time.monotonic()
+        return self
+
+    @_locked
+    def persist(self) -> None:
+        """Écrit une nouvelle génération puis bascule CURRENT (atomique)."""
+        if not self._dirty:
+            return
+        if self.index is not None and self.tombstones and len(self.tombstones) > self.compact_ratio * max(1, self.index.ntotal):
+            self._rebuild(self.kind)
+        os.makedirs(self.path, exist_ok=True)
+        generation = self.generation + 1
+        name = f"gen-{generation:06d}"
+        tmp = tempfile.mkdtemp(dir=self.path, prefix=".tmp-")
+        try:
+            if self.index is not None:
+                faiss.write_index(self.index, os.path.join(tmp, "index.faiss"))
+            with open(os.path.join(tmp, "docs.pkl"), "wb") as f:
+                pickle.dump(self.docs, f, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"kind": self.kind, "dim": self.dim, "next_id": self.next_id,
+                           "generation": generation, "tombstones": sorted(self.tombstones)}, f)
+            os.rename(tmp, os.path.join(self.path, name))
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        fd, ptr = tempfile.mkstemp(dir=self.path, prefix=".current-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(ptr, self._current_path)
+        self.generation = generation
+        self._dirty = False
+        for old in os.listdir(self.path):
+            if old.startswith("gen-") and old != name:
+                shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+
+    def reload_if_changed(self) -> bool:
+        """Recharge si un autre processus a publié une génération (modifs locales non sauvées : jamais)."""
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_check_s:
+            return False
+        self._checked_at = now
+        name = self._read_current()
+        with self._lock:
+            if name is None or self._dirty or name == f"gen-{self.generation:06d}":
+                return False
+            self.load()
+        return True
+
+    # ---------- Index ----------
+
+    def _new_index(self, kind: str, dim: int):
+        if kind == "HNSW":
+            index = faiss.index_factory(dim, f"IDMap2,HNSW{self.hnsw_m},Flat", faiss.METRIC_INNER_PRODUCT)
+            faiss.downcast_index(index.index).hnsw.efConstruction = self.ef_construction
+            return index
+        if kind == "IVF_PQ":
+            return faiss.index_factory(dim, f"IDMap2,IVF{self.nlist},PQ{self.pq_m}x{self.pq_nbits}", faiss.METRIC_INNER_PRODUCT)
+        return faiss.index_factory(dim, "IDMap2,Flat", faiss.METRIC_INNER_PRODUCT)
+
+    def _writable(self) -> None:
+        """Un index memory-mapped est en lecture seule : copie en mémoire avant d'écrire."""
+        if self._mapped:
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self._mapped = False
+
+    def _live_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        ids = np.array(sorted(pk for pk in self.docs if pk not in self.tombstones), dtype=np.int64)
+        vecs = np.vstack([self.index.reconstruct(int(pk)) for pk in ids]) if len(ids) else np.zeros((0, self.dim), np.float32)
+        return ids, np.ascontiguousarray(vecs, dtype=np.float32)
+
+    def _rebuild(self, kind: str) -> None:
+        """Reconstruit l'index sans les tombstones (HNSW) ou entraîne IVF_PQ."""
+        ids, vecs = self._live_vectors()
+        index = self._new_index(kind, self.dim)
+        if kind == "IVF_PQ":
+            index.train(vecs)
+        if len(ids):
+            index.add_with_ids(vecs, ids)
+        self.index, self.kind, self._mapped = index, kind, False
+        self.tombstones.clear()
+
+    # ---------- Écriture ----------
+
+    @_locked
+    def add_embeddings(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> List[int]:
+        """Ajoute des vecteurs déjà calculés ; renvoie les pk (ordre d'entrée)."""
+        if not texts:
+            return []
+        x = _as_matrix(embeddings)
+        if self.index is None:
+            self.dim = x.shape[1]
+            self.kind = "HNSW" if self.index_type == "HNSW" else _FLAT
+            self.index = self._new_index(self.kind, self.dim)
+        self._writable()
+        ids = np.arange(self.next_id, self.next_id + len(texts), dtype=np.int64)
+        self.index.add_with_ids(x, ids)
+        self.next_id += len(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        for pk, text, md in zip(ids.tolist(), texts, metadatas):
+            md = dict(md or {})
+            self.docs[pk] = (text, md)
+            self.by_source.setdefault(md.get("source", ""), set()).add(pk)
+        if self.kind == _FLAT and self.index.ntotal >= self.train_size:
+            self._rebuild("IVF_PQ")
+        self._dirty = True
+        return ids.tolist()
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[int]:
+        texts = list(texts)
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), metadatas)
+
+    @_locked
+    def delete(self, ids: Optional[List[Any]] = None, **kwargs: Any) -> bool:
+        """Supprime par pk (les ids inconnus sont ignorés)."""
+        pks = [int(i) for i in ids or [] if int(i) in self.docs]
+        if not pks:
+            return True
+        self._writable()
+        for pk in pks:
+            _, md = self.docs.pop(pk)
+            self.by_source.get(md.get("source", ""), set()).discard(pk)
+        if self.kind == "HNSW":
+            self.tombstones.update(pks)
+        else:
+            self.index.remove_ids(np.array(pks, dtype=np.int64))
+        self._dirty = True
+        return True
+
+    @_locked
+    def delete_source(self, source: str) -> int:
+        pks = list(self.by_source.pop(source, ()))
+        self.delete(pks)
+        return len(pks)
+
+    # ---------- Recherche ----------
+
+    def _search_params(self, value: int):
+        sel = None
+        if self.tombstones:
+            sel = faiss.IDSelectorNot(faiss.IDSelectorBatch(np.array(sorted(self.tombstones), dtype=np.int64)))
+        if self.kind == "HNSW":
+            return faiss.SearchParametersHNSW(efSearch=int(value), sel=sel)
+        if self.kind == "IVF_PQ":
+            return faiss.SearchParametersIVF(nprobe=int(value), sel=sel)
+        return faiss.SearchParameters(sel=sel) if sel is not None else None
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, param: Optional[dict] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        self.reload_if_changed()
+        params = (param or self.search_params).get("params", {})
+        value = params.get("ef") or params.get("nprobe") or 64
+        with self._lock:
+            if self.index is None or not self.docs:
+                return []
+            scores, ids = self.index.search(_as_matrix(embedding), int(k), params=self._search_params(value))
+            out = []
+            for score, pk in zip(scores[0].tolist(), ids[0].tolist()):
+                if pk < 0 or pk not in self.docs:
+                    continue
+                text, md = self.docs[pk]
+                out.append((Document(page_content=text, metadata={**md, "pk": pk}), float(score)))
+        return out
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [d for d, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1.0) / 2.0  # cosinus [-1, 1] -> [0, 1]
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Any, metadatas: Optional[List[dict]] = None,
+                   path: Optional[str] = None, **kwargs: Any) -> "FaissVectorStore":
+        store = cls(embedding, path or paths.FAISS_DIR, **kwargs)
+        store.add_texts(texts, metadatas)
+        return store
+
+
+def load_faiss_store(embedding_model: Any, path: Optional[str] = None) -> FaissVectorStore:
+    """Vectorstore FAISS configuré via paths (FAISS_*)."""
+    return FaissVectorStore(
+        embedding_model,
+        path or paths.FAISS_DIR,
+        index_type=paths.FAISS_INDEX_TYPE,
+        hnsw_m=paths.FAISS_HNSW_M,
+        ef_construction=paths.FAISS_HNSW_EF_CONSTRUCTION,
+        nlist=paths.FAISS_IVF_NLIST,
+        pq_m=paths.FAISS_PQ_M,
+        pq_nbits=paths.FAISS_PQ_NBITS,
+        mmap=paths.FAISS_MMAP,
+    ).load()
+
+
+def import_legacy(store: FaissVectorStore, index_path: str, docstore_path: str) -> int:
+    """Reprend l'ancien couple LangChain index.faiss / index.pkl (vecteurs et textes, sans ré-embedding)."""
+    legacy = faiss.read_index(index_path)
+    with open(docstore_path, "rb") as f:
+        docstore, index_to_id = pickle.load(f)
+    vectors = legacy.reconstruct_n(0, legacy.ntotal)
+    docs = [docstore.search(index_to_id[i]) for i in range(legacy.ntotal)]
+    store.add_embeddings([d.page_content for d in docs], vectors, [d.metadata for d in docs])
+    store.persist()
+    return len(docs)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ("stats", "import-legacy"):
+        print("Usage:")
+        print("  python faiss_store.py stats            # taille de l'index FAISS (paths.FAISS_DIR)")
+        print("  python faiss_store.py import-legacy    # importe preprocessed_data/index.faiss + index.pkl")
+        sys.exit(0)
+
+    store = load_faiss_store(embedding_model=None)
+    if sys.argv[1] == "import-legacy":
+        n = import_legacy(store, os.path.join(paths.preprocessed_data, "index.faiss"),
+                          os.path.join(paths.preprocessed_data, "index.pkl"))
+        print(f"[FAISS] imported {n} chunks into {paths.FAISS_DIR}")
+    print(json.dumps({"path": store.path, "kind": store.kind, "dim": store.dim, "chunks": store.ntotal,
+                      "tombstones": len(store.tombstones), "generation": store.generation}))
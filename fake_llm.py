@@ -0,0 +1,66 @@
+"""
+fake_llm.py — LLM factice déterministe (tests de charge sans modèle GGUF)
+
+Remplace ChatLlamaCpp quand LLM_FAKE=1 (generator.get_model) : même
+interface LangChain (invoke / stream / astream), réponse déterministe
+(dérivée de la question) émise à LLM_FAKE_TOKENS_PER_S tokens/s.
+
+Sert à mesurer le coût de l'ordonnanceur, de la recherche et de Redis sur un
+portable (load_test.py), la génération étant simulée à débit connu.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_WORDS = (
+    "the", "device", "configuration", "must", "be", "checked", "before", "the",
+    "update", "according", "to", "section", "of", "the", "guide", "and", "then",
+    "restart", "service", "with", "admin", "rights",
+)
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model factice : `n_tokens` mots à `tokens_per_s` (0 = instantané)."""
+
+    tokens_per_s: float = 20.0
+    n_tokens: int = 64
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-llama"
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        question = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        seed = int(hashlib.sha1(str(question).encode("utf-8")).hexdigest(), 16)
+        return [("" if i == 0 else " ") + _WORDS[(seed >> (i % 64) ^ i) % len(_WORDS)]
+                for i in range(max(1, self.n_tokens))]
+
+    @property
+    def _delay(self) -> float:
+        return 1.0 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens(messages)
+        time.sleep(self._delay * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for tok in self._tokens(messages):
+            time.sleep(self._delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=tok))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        for tok in self._tokens(messages):
+            await asyncio.sleep(self._delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=tok))
@@ -5,51 +5,58 @@ import paths
 import redis_db
 import os
 import asyncio
-from langchain_huggingface import HuggingFaceEmbeddings
 import json
 import preprocess
-from langchain_core.documents import Document
-
-# Import RecursiveCharacterTextSplitter (nouvelle API LangChain)
-try:
-    from langchain_text_splitters import RecursiveCharacterTextSplitter
-except ImportError:
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
-
-import asyncio, shutil
+import chat_scheduler
+import answer_cache
+import metrics
+import llm_workers
+import schema_normalizer
+from embedding_cache import CachedEmbeddings
+from embedding_engine import get_engine
+from index_manifest import IndexManifest
+from ingest_jobs import IngestJobManager
+from lexical_index import LexicalIndex
+from reranker import get_reranker
+
+import asyncio, shutil, threading, time
 from uuid import uuid4
-from typing import Literal
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
 import re
-from fastapi.responses import JSONResponse
-from langchain_core.runnables import RunnablePassthrough
-from retriever import parse_retriever_input
-from pymilvus import Collection, DataType
-from collections import Counter
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from collections import Counter, defaultdict
 
 
 
 app = FastAPI()
+metrics.instrument_app(app)
 MAX_PDF_MB = 25
 
 
-vectorstore_lock = asyncio.Lock()          # protects concurrent writes
+vectorstore_lock = threading.Lock()        # protects manifest / BM25 writes (ingestion threads)
 
 
-# Global chat queue, worker tasks, and a lock to serialize model calls
-chat_queue = asyncio.Queue()
-worker_tasks = []
-model_lock = asyncio.Lock()  # Ensures only one model call is active at a time
+# Global chat scheduler (batching + generation slots), created with the models
+scheduler = None
+# Generation worker pool (paths.LLM_WORKERS > 0), None = models in this process
+llm_pool = None
+# Background ingestion of uploaded PDFs (see ingest_jobs.py)
+ingest_jobs = None
 
 # ===== LAZY LOADING: Models are loaded on first use, not at startup =====
 # This prevents file locking issues in Docker with mounted volumes
 embedding_model = None
+embedding_engine = None   # batched mpnet engine (queries via cache, /upload inserts)
 vectorstore = None
 generator_model = None
 generator_chain = None
+generator_chains = []   # one chain per llama.cpp slot (paths.CHAT_CONCURRENCY)
 lc_retriever = None
-retriever_chain = None
 redis_client = None
+semantic_cache = None
+lexical = None   # BM25 index (lexical_index.LexicalIndex) for "words" / "hybrid" search
+reranker = None  # optional cross-encoder (paths.RERANK_ENABLED)
 
 # Lock to ensure models are initialized only once
 _models_init_lock = asyncio.Lock()
@@ -61,8 +68,9 @@ async def _ensure_models_loaded():
     Lazy initialization of models on first API call.
     This avoids macOS Docker volume file locking issues at container startup.
     """
-    global embedding_model, vectorstore, generator_model, generator_chain
-    global lc_retriever, retriever_chain, redis_client, _models_initialized
+    global embedding_model, embedding_engine, vectorstore, generator_model, generator_chain, generator_chains
+    global lc_retriever, redis_client, semantic_cache, scheduler, lexical, reranker, llm_pool
+    global ingest_jobs, _models_initialized
 
     async with _models_init_lock:
         if _models_initialized:
@@ -70,25 +78,78 @@ async def _ensure_models_loaded():
 
         print("🔄 Initializing models (lazy loading)...")
 
-        # Load embedding model
-        embedding_model = HuggingFaceEmbeddings(model_name=paths.bert_model_path)
+        # Load embedding model, wrapped in the query-embedding cache
+        # (shared by /retrieve and /chat, transparent for the retriever)
+        embedding_engine = get_engine()
+        embedding_model = CachedEmbeddings(
+            embedding_engine,
+            max_entries=paths.EMBED_CACHE_SIZE,
+            redis_client=redis_db.create_redis_client(decode_responses=False) if paths.EMBED_CACHE_REDIS else None,
+            ttl_seconds=paths.EMBED_CACHE_TTL_S,
+            namespace=embedding_engine.cache_namespace,
+        )
 
         # Load vectorstore
         vectorstore = rt.load_vectorstore(embedding_model)
 
-        # Load generator model
-        generator_model = generator.get_model()
-        generator_chain = generator.get_chain_generator(generator_model)
+        # Load BM25 index (built by preprocess.py, updated by /upload)
+        lexical = LexicalIndex.load(paths.bm25_dir)
+
+        # Optional cross-encoder reranking of the retrieved candidates
+        reranker = get_reranker()
+
+        # Load generator model(s): each slot owns its own llama.cpp context,
+        # the GGUF weights themselves are memory-mapped and shared.
+        # With LLM_WORKERS > 0 the models live in dedicated processes instead.
+        llm_pool = await asyncio.to_thread(llm_workers.get_worker_pool)
+        if llm_pool is not None:
+            generator.load_tokenizer_budget()
+            generator_chains = llm_pool.chains()
+            generator_chain = generator_chains[0]
+        else:
+            generator_model = generator.get_model()
+            generator_chain = generator.get_chain_generator(generator_model)
+            generator_chains = [generator_chain] + [
+                generator.get_chain_generator(generator.get_model())
+                for _ in range(max(1, paths.CHAT_CONCURRENCY) - 1)
+            ]
 
         # Create retriever
         lc_retriever = rt.get_retriever(vectorstore, k=2)
-        retriever_chain = RunnablePassthrough.assign(
-            context=parse_retriever_input | lc_retriever
-        ).assign(answer=generator_chain)
 
         # Redis client
         redis_client = redis_db.create_redis_client()
 
+        # Semantic answer cache (binary Redis client: float32 vectors)
+        if paths.ANSWER_CACHE_ENABLED:
+            semantic_cache = answer_cache.SemanticAnswerCache(
+                redis_db.create_redis_client(decode_responses=False),
+                threshold=paths.ANSWER_CACHE_THRESHOLD,
+                ttl_seconds=paths.ANSWER_CACHE_TTL_S,
+                max_entries=paths.ANSWER_CACHE_MAX_ENTRIES,
+            )
+
+        # Chat scheduler
+        scheduler = chat_scheduler.ChatScheduler(
+            lc_retriever,
+            generator_chains,
+            max_batch=paths.CHAT_MAX_BATCH,
+            batch_window_ms=paths.CHAT_BATCH_WINDOW_MS,
+            max_queue=paths.CHAT_MAX_QUEUE,
+            timeout_s=paths.CHAT_TIMEOUT_S,
+            cache=semantic_cache,
+            retrieval_mode=paths.CHAT_RETRIEVAL_MODE,
+            lexical=lexical,
+            reranker=reranker,
+        )
+        scheduler.start()
+        metrics.track_scheduler(scheduler)
+
+        # Upload ingestion jobs (thread pool, off the event loop)
+        ingest_jobs = IngestJobManager(
+            _ingest_pdf, max_workers=paths.INGEST_WORKERS, max_jobs=paths.INGEST_MAX_JOBS
+        )
+
         _models_initialized = True
         print("✅ Models initialized successfully!")
 
@@ -98,37 +159,14 @@ def sanitize_filename(name: str) -> str:
     name = os.path.basename(name)
     return re.sub(r'[^A-Za-z0-9._-]+', '_', name)
 
-@app.on_event("startup")
-async def startup_event():
-    global worker_tasks
-    num_workers = 1  # Adjust the number of workers as needed
-    for _ in range(num_workers):
-        task = asyncio.create_task(chat_worker())
-        worker_tasks.append(task)
-
-
 @app.on_event("shutdown")
 async def shutdown_event():
-    for task in worker_tasks:
-        task.cancel()
-    await asyncio.gather(*worker_tasks, return_exceptions=True)
-
-
-async def chat_worker():
-    """Worker that continuously processes chat requests from the queue."""
-    while True:
-        session_id, user_input, future = await chat_queue.get()
-        try:
-            chat_hist = generator.get_chat_hist_instance(session_id)
-            # Serialize access to the generator chain to avoid connection issues
-            async with model_lock:
-                chat_hist , duration = await generator.generate_chat_st(user_input, retriever_chain, chat_hist)
-            result = ( chat_hist.messages[-1].content , duration )
-            future.set_result(result)
-        except Exception as e:
-            future.set_exception(e)
-        finally:
-            chat_queue.task_done()
+    if scheduler is not None:
+        await scheduler.stop()
+    if llm_pool is not None:
+        await asyncio.to_thread(llm_pool.stop)
+    if ingest_jobs is not None:
+        ingest_jobs.shutdown()
 
 
 @app.get("/")
@@ -138,7 +176,10 @@ async def home():
 
 class RetrievePayload(BaseModel):
     query: str
-    mode: Literal["vector", "words"] | None = None  # pour validation/évolution future
+    mode: Literal["vector", "words", "hybrid"] | None = None  # None = "vector"
+    # Recherche Milvus (index_config.py) : profil et surcharge ef / nprobe pour cette requête
+    profile: Literal["fast", "accurate"] = paths.RETRIEVE_SEARCH_PROFILE
+    ef: int | None = Field(default=None, ge=1, le=paths.MILVUS_SEARCH_MAX)
 
 
 
@@ -166,11 +207,39 @@ def _count_hits_by_source(paths, metas):
     return Counter(keys)
 
 
+def _page_anchors_by_source(paths, metas):
+    """
+    Ancres de page des chunks trouvés, par document, dans l'ordre de pertinence :
+    {"page", "page_end", "heading"} (une par page de début ; chunks sans page ignorés).
+    """
+    anchors = defaultdict(list)
+    seen = set()
+    for p, m in zip(paths or [], metas or []):
+        m = m or {}
+        key = m.get("source") or p
+        try:
+            page = int(m["page_start"])
+            page_end = int(m.get("page_end") or page)
+        except (KeyError, TypeError, ValueError):
+            continue
+        if (key, page) in seen:
+            continue
+        seen.add((key, page))
+        anchors[key].append({"page": page, "page_end": page_end, "heading": m.get("heading") or ""})
+    return anchors
+
+
 
 @app.post("/retrieve")
 async def retrieve_documents(payload: RetrievePayload):
+    global lexical
     await _ensure_models_loaded()  # Lazy load models on first call
 
+    # Index BM25 reconstruit hors process (preprocess.py sync) -> rechargement
+    if payload.mode in ("words", "hybrid"):
+        lexical = lexical.reload_if_changed()
+        scheduler.lexical = lexical
+
     # On récupère plus de chunks que nécessaire, puis on déduplique
     UNIQUE_K = 5
     OVERFETCH = 5  # 5x plus de chunks pour obtenir au moins UNIQUE_K docs uniques
@@ -178,10 +247,16 @@ async def retrieve_documents(payload: RetrievePayload):
         query=payload.query,
         retriever=lc_retriever,
         k=UNIQUE_K * OVERFETCH,
+        mode=payload.mode or "vector",
+        lexical=lexical,
+        reranker=reranker,
+        profile=payload.profile,
+        ef=payload.ef,
     )
 
     # Déduplication par document (source)
     hit_counts = _count_hits_by_source(paths, metas)
+    anchors = _page_anchors_by_source(paths, metas)
     paths, metas = _dedupe_by_source(paths, metas)
 
     # On tronque aux N docs uniques demandés
@@ -195,23 +270,128 @@ async def retrieve_documents(payload: RetrievePayload):
         "documents": paths,
         "metadatas": metas,
         "hits": hits,          # <- ton UI peut l'afficher "(n hits)" à côté du nom
+        "anchors": [anchors.get(m.get("source") or p, []) for p, m in zip(paths, metas)],  # pages des hits
     }
 
 
 
 @app.post("/chat")
-async def chat(user_input: str, session_id: str):
+async def chat(user_input: str, session_id: str, timeout: float | None = None):
     await _ensure_models_loaded()  # Lazy load models on first call
 
-    # Create a future to hold the result of this chat request
-    loop = asyncio.get_running_loop()
-    future = loop.create_future()
-    # Put the task into the queue
-    await chat_queue.put((session_id, user_input, future))
-    # Wait for the worker to process the task and return the result
-    response , duration = await future
+    # Enqueue into the scheduler (429 if the queue is full)
+    try:
+        req = scheduler.submit(session_id, user_input, timeout=timeout)
+    except chat_scheduler.QueueFullError as e:
+        return JSONResponse(
+            status_code=429,
+            content={"error": str(e)},
+            headers={"Retry-After": "5"},
+        )
+
+    # Wait for the result within the request deadline (503 otherwise)
+    try:
+        response , duration = await scheduler.wait(req)
+    except chat_scheduler.DeadlineExceededError as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
     return {"response": response , "duration" : duration}
 
+def _sse(event: str, data) -> str:
+    """Formate une trame Server-Sent Events (payload JSON)."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(user_input: str, session_id: str, timeout: float | None = None):
+    """
+    Même traitement que /chat mais en SSE :
+      - `event: token`  {"text": ...} pour chaque fragment généré
+      - `event: final`  {"response", "sources", "duration", "ttft"}
+      - `event: error`  {"error", "status"} (503 : échéance dépassée, 500 : erreur de génération)
+    """
+    await _ensure_models_loaded()  # Lazy load models on first call
+
+    try:
+        req = scheduler.submit(session_id, user_input, timeout=timeout, stream=True)
+    except chat_scheduler.QueueFullError as e:
+        return JSONResponse(
+            status_code=429,
+            content={"error": str(e)},
+            headers={"Retry-After": "5"},
+        )
+
+    async def event_stream():
+        try:
+            while True:
+                remaining = max(0.0, req.deadline - time.monotonic())
+                try:
+                    token = await asyncio.wait_for(req.tokens.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    yield _sse("error", {"error": "Chat request deadline exceeded.", "status": 503})
+                    return
+                if token is None:  # fin du flux
+                    break
+                yield _sse("token", {"text": token})
+
+            try:
+                final = await req.future
+            except Exception as e:
+                status = 503 if isinstance(e, chat_scheduler.DeadlineExceededError) else 500
+                yield _sse("error", {"error": str(e), "status": status})
+                return
+            yield _sse("final", final)
+        finally:
+            # Client déconnecté ou échéance : le scheduler abandonne la requête
+            if not req.future.done():
+                req.future.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (monitoring/prometheus.yml)."""
+    if not metrics.PROMETHEUS_AVAILABLE:
+        return JSONResponse(status_code=503, content={"error": "prometheus_client is not installed."})
+    return Response(content=metrics.generate_latest(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    Compteurs du cache sémantique (hits / misses / near misses) pour régler le seuil,
+    du cache d'embeddings de requêtes (clé "embeddings"), des scores du
+    reranker (clé "rerank", None si désactivé) et des états KV llama.cpp
+    (clé "prompt", une entrée par instance).
+    """
+    await _ensure_models_loaded()  # Lazy load models on first call
+    answers = {"enabled": False}
+    if semantic_cache is not None:
+        answers = {"enabled": True, **semantic_cache.stats()}
+    return {
+        **answers,
+        "embeddings": embedding_model.stats(),
+        "rerank": reranker.stats() if reranker is not None else None,
+        "prompt": [c.stats() for c in generator.prompt_caches],
+    }
+
+
+@app.get("/workers")
+async def workers_health():
+    """
+    État du pool de génération (LLM_WORKERS > 0) : processus vivants, prêts,
+    occupés, redémarrages. `enabled=False` si les modèles sont dans l'API.
+    """
+    await _ensure_models_loaded()  # Lazy load models on first call
+    if llm_pool is None:
+        return {"enabled": False, "slots": len(generator_chains)}
+    health = llm_pool.health()
+    status = 200 if health["healthy"] else 503
+    return JSONResponse({"enabled": True, **health}, status_code=status)
+
 # =====================================================================
 
 @app.get("/chat/history")
@@ -249,116 +429,167 @@ def looks_like_pdf(data: bytes) -> bool:
     return head.startswith(b"%PDF-")
 
 
-def normalize_docs_for_existing_schema(vectorstore, collection_name, docs):
+def _ingest_pdf(tmp_path: str, progress) -> None:
     """
-    Aligne docs.metadata sur le schéma EXISTANT de la collection Milvus :
-    - garde UNIQUEMENT les champs déjà présents dans la collection
-    - remplit les champs manquants avec une valeur par défaut selon dtype
+    Ingestion d'un PDF enregistré dans upload_dir (thread d'ingestion_jobs) :
+    extraction et split page par page -> embedding + insertion -> manifeste, BM25, cache.
     """
-    col = Collection(collection_name)
-    # text/vector fields tels que déclarés dans ton vectorstore LangChain
-    text_field = getattr(vectorstore, "text_field", "text")
-    vector_field = getattr(vectorstore, "vector_field", "vector")
-    ignore = {text_field, vector_field, "id", "pk"}
-
-    # map nom_de_champ -> dtype
-    schema_map = {f.name: f.dtype for f in col.schema.fields}
-    required = [name for name in schema_map.keys() if name not in ignore]
-
-    def default_for(dtype):
-        if dtype == DataType.VARCHAR:
-            return ""
-        if dtype in (DataType.INT8, DataType.INT16, DataType.INT32, DataType.INT64):
-            return 0
-        if dtype in (DataType.FLOAT, DataType.DOUBLE):
-            return 0.0
-        if dtype == DataType.BOOL:
-            return False
-        if dtype == DataType.JSON:
-            return {}
-        return ""
-
-    def cast_to_dtype(val, dtype):
+    safe_name = progress.filename  # tmp_path est unique par upload (_upload_path)
+    # collection d'avant le découpage par page : les ancres de page seraient perdues
+    preprocess.require_chunk_fields(vectorstore, paths.MILVUS_COLLECTION)
+
+    # 3-4) Extraction + split page par page (page_start / page_end / heading)
+    progress.status = "extracting"
+    source = os.path.join(paths.data_path, safe_name)
+    docs = preprocess.get_page_chunks(tmp_path, source=source, on_page=progress.on_page)
+    if not docs:
+        raise ValueError("Unable to extract text from PDF.")
+
+    # 4bis) Chunks déjà indexés pour un autre document : liés, pas embeddés
+    #       (premier filtre hors verrou, refait sous vectorstore_lock avant l'enregistrement)
+    dups = []
+    dedup = preprocess.load_dedup_index(lexical)
+    if dedup is not None:
+        dedup.delete_source(source)  # version précédente du même fichier
+        docs, dups = dedup.filter(source, docs)
+        if dups:
+            print(f"[DEDUP] {safe_name}: {len(dups)} duplicate chunks linked, not embedded")
+    progress.chunks = len(docs)
+
+    # 5) Embedding + append ; une version précédente du même fichier (connue du
+    #    manifeste) est remplacée, pas dupliquée
+    progress.status = "embedding"
+    docs = schema_normalizer.normalize_docs(vectorstore, paths.MILVUS_COLLECTION, docs)
+    ids = embedding_engine.insert_documents(vectorstore, docs, progress=progress.on_batch) if docs else []
+    metrics.UPLOAD_CHUNKS.inc(len(docs))
+    with vectorstore_lock:
         try:
-            if dtype == DataType.VARCHAR:
-                return "" if val is None else str(val)
-            if dtype in (DataType.INT8, DataType.INT16, DataType.INT32, DataType.INT64):
-                return 0 if val in (None, "") else int(val)
-            if dtype in (DataType.FLOAT, DataType.DOUBLE):
-                return 0.0 if val in (None, "") else float(val)
-            if dtype == DataType.BOOL:
-                if isinstance(val, str):
-                    return val.strip().lower() in ("true", "1", "yes", "y", "t")
-                return bool(val)
-            if dtype == DataType.JSON:
-                return val if isinstance(val, (dict, list)) else {}
-        except Exception:
-            return default_for(dtype)
-        return val
-
-    norm = []
-    for d in docs:
-        md = d.metadata or {}
-        new_md = {}
-        for name in required:
-            dtype = schema_map[name]
-            if name in md:
-                new_md[name] = cast_to_dtype(md.get(name), dtype)
-            else:
-                new_md[name] = default_for(dtype)
-        d.metadata = new_md
-        norm.append(d)
-    return norm
-
-
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    await _ensure_models_loaded()  # Lazy load models on first call
+            manifest = IndexManifest.load(paths.manifest_path)
+            old_ids = manifest.chunk_ids(source)
+            if old_ids:
+                vectorstore.delete(ids=old_ids)
+            if dedup is not None:
+                # relu sous le verrou (ingestions concurrentes) ; les fichiers liés à
+                # l'ancienne version sont retirés du manifeste : ré-ingérés au prochain `sync`
+                dedup = preprocess.load_dedup_index(lexical)
+                for dep in dedup.dependents([source]):
+                    manifest.forget(dep)
+                dedup.delete_source(source)
+                # second filtre : chunks devenus doublons d'un document indexé pendant
+                # notre embedding, leurs lignes tout juste insérées sont retirées
+                kept, late = dedup.filter(source, docs)
+                if late:
+                    keep = {id(d) for d in kept}
+                    vectorstore.delete(ids=[i for d, i in zip(docs, ids) if id(d) not in keep])
+                    ids = [i for d, i in zip(docs, ids) if id(d) in keep]
+                    docs, dups = kept, dups + late
+                    print(f"[DEDUP] {safe_name}: {len(late)} chunks indexed concurrently elsewhere, removed")
+                dedup.add(source, docs, dups)
+                dedup.save()
+            manifest.record(source, tmp_path, ids)
+            preprocess.persist_vectorstore(vectorstore)  # VECTOR_BACKEND=faiss : index écrit avant le manifeste
+            manifest.save()
+        except Exception as e:
+            print(f"Warning: manifest update failed for {safe_name}: {e}")
+        try:
+            lexical.delete_source(source)
+            lexical.add_documents(docs, ids)
+            lexical.save()
+        except Exception as e:
+            print(f"Warning: BM25 index update failed for {safe_name}: {e}")
 
-    # 1) Validations de base (mimetype + taille)
-    if file.content_type not in {"application/pdf"}:
-        return JSONResponse(status_code=400, content={"error": "Only PDF files are accepted."})
+    # 5bis) Les réponses en cache citant ce document sont périmées
+    if semantic_cache is not None:
+        try:
+            semantic_cache.invalidate_source(source)
+        except Exception as e:
+            print(f"Warning: cache invalidation failed for {safe_name}: {e}")
+
+    # 6) Déplacement vers le corpus "data/"
+    try:
+        shutil.move(tmp_path, os.path.join(paths.data_path, safe_name))
+        os.rmdir(os.path.dirname(tmp_path))
+    except Exception as e:
+        print(f"Warning: could not move file {safe_name}: {e}")
 
-    data = await file.read()
 
+def _check_pdf(file: UploadFile, data: bytes):
+    """Renvoie (status HTTP, message) si le fichier est refusé, sinon None."""
+    if file.content_type not in {"application/pdf"}:
+        return 400, "Only PDF files are accepted."
     if len(data) > MAX_PDF_MB * 1024 * 1024:
-        return JSONResponse(status_code=400, content={"error": f"File too large (> {MAX_PDF_MB} MB)."})
-
-    # 1bis) Vérification contenu PDF (tolérante)
+        return 400, f"File too large (> {MAX_PDF_MB} MB)."
+    # Vérification contenu PDF (tolérante)
     if not looks_like_pdf(data):
-        return JSONResponse(
-            status_code=415,
-            content={"error": "Invalid PDF file (missing '%PDF-' header near start)."}
-        )
+        return 415, "Invalid PDF file (missing '%PDF-' header near start)."
+    return None
 
-    safe_name = sanitize_filename(file.filename)
 
-    # 2) Enregistrement temporaire
-    tmp_path = os.path.join(paths.upload_dir_path, safe_name)
-    with open(tmp_path, "wb") as f:
-        f.write(data)
+@app.post("/upload", status_code=202)
+async def upload_file(
+    file: Optional[UploadFile] = File(None),
+    files: Optional[List[UploadFile]] = File(None),
+):
+    """
+    Valide et enregistre un ou plusieurs PDF (`file` et/ou `files`), puis
+    lance leur ingestion en tâche de fond. Répond 202 avec `job_id` :
+    la progression se lit sur GET /upload/{job_id}.
+    """
+    await _ensure_models_loaded()  # Lazy load models on first call
+
+    uploads = ([file] if file is not None else []) + list(files or [])
+    if not uploads:
+        return JSONResponse(status_code=400, content={"error": "No file provided."})
+
+    # 1) Validations de base (mimetype + taille + en-tête) puis 2) enregistrement temporaire
+    accepted, rejected = [], []
+    for up in uploads:
+        data = await up.read()
+        refused = _check_pdf(up, data)
+        safe_name = sanitize_filename(up.filename)
+        if refused is None and any(name == safe_name for _, name in accepted):
+            refused = 400, "Duplicate file name in this request."
+        if refused is not None:
+            rejected.append({"filename": up.filename, "status": refused[0], "error": refused[1]})
+            continue
+        tmp_path = _upload_path(safe_name)
+        await asyncio.to_thread(_write_file, tmp_path, data)
+        accepted.append((tmp_path, safe_name))
+
+    if not accepted:
+        first = rejected[0]
+        return JSONResponse(status_code=first["status"], content={"error": first["error"], "rejected": rejected})
+
+    # 3..6) Ingestion en tâche de fond
+    job = ingest_jobs.submit(accepted)
+    return {
+        "message": "Upload accepted, indexing in background.",
+        "job_id": job.job_id,
+        "filenames": [name for _, name in accepted],
+        "rejected": rejected,
+    }
 
-    # 3) Extraction texte + meta
-    text, meta = preprocess.get_text(tmp_path)
-    if not text:
-        return JSONResponse(status_code=400, content={"error": "Unable to extract text from PDF."})
 
-    meta_clean = {k: v for k, v in (meta or {}).items() if v}
-    meta_clean["source"] = os.path.join(paths.data_path, safe_name)
+def _upload_path(safe_name: str) -> str:
+    """
+    Chemin temporaire propre à cet upload (uploads/.incoming/<uuid>/<nom>) : deux
+    fichiers de même nom, dans une requête ou des travaux concurrents, ne
+    s'écrasent pas ; hors de la liste des PDF lue par `preprocess.py add_doc`.
+    """
+    return os.path.join(paths.upload_dir_path, ".incoming", uuid4().hex, safe_name)
 
-    # 4) Split (chunking harmonisé)
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1200, chunk_overlap=150)
-    docs = splitter.split_documents([Document(page_content=text, metadata=meta_clean)])
 
-    # 5) Embedding + append (protégé par lock)
-    async with vectorstore_lock:
-        docs = normalize_docs_for_existing_schema(vectorstore, paths.MILVUS_COLLECTION, docs)
-        vectorstore.add_documents(docs)
+def _write_file(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
 
-    # 6) Déplacement vers le corpus "data/"
-    try:
-        shutil.move(tmp_path, os.path.join(paths.data_path, safe_name))
-    except Exception as e:
-        print(f"Warning: could not move file {safe_name}: {e}")
 
-    return {"message": "File uploaded and indexed.", "filename": safe_name}
+@app.get("/upload/{job_id}")
+async def upload_status(job_id: str):
+    """Progression d'un travail d'ingestion : pages extraites, chunks embeddés, lignes insérées."""
+    await _ensure_models_loaded()  # Lazy load models on first call
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown upload job '{job_id}'."})
+    return job.to_dict()
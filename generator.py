@@ -1,7 +1,11 @@
+import dashboard_metrics
+import metrics
 import paths
+from prompt_budget import PromptBudget, TokenCounter
+from prompt_cache import install_prompt_cache, model_fingerprint, spill_dir
 import redis_db
 from langchain_community.chat_models import ChatLlamaCpp
-from langchain_core.messages import HumanMessage, SystemMessage, trim_messages
+from langchain_core.messages import HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 # Import create_stuff_documents_chain (nouvelle API LangChain)
@@ -14,8 +18,7 @@ except ImportError:
         # Fallback - on définira une version simplifiée si nécessaire
         create_stuff_documents_chain = None
 
-import asyncio, time
-from datetime import datetime
+import time
 import os
 from typing import List, Optional
 
@@ -76,7 +79,8 @@ class SourceRenderer:
         except Exception:
             return path
 
-    def render(self) -> str:
+    def labels(self) -> List[str]:
+        """Libellés dédupliqués des sources (sans mise en forme Markdown de liste)."""
         seen = set()
         items: List[str] = []
 
@@ -118,6 +122,10 @@ class SourceRenderer:
             if self.MAX_SOURCES and len(items) >= self.MAX_SOURCES:
                 break
 
+        return items
+
+    def render(self) -> str:
+        items = self.labels()
         if not items:
             return ""
 
@@ -127,36 +135,109 @@ class SourceRenderer:
         return "\n".join(lines)
 
 
-def get_model():
-    """Creates and returns the LlamaCpp model."""
+# Gabarit fixe en tête de prompt (préfixe partagé par toutes les sessions) ;
+# le contexte récupéré change à chaque tour : il vient APRÈS l'historique et la
+# question, pour que l'état KV du tour précédent reste réutilisable jusqu'à sa
+# question (la réponse précédente est réévaluée, cf. prompt_cache.py)
+SYSTEM_TEMPLATE = """
+        Answer the user's questions based on the context given after the last question. 
+        If the context doesn't contain relevant information, just say "I don't know".
+    """
+
+CONTEXT_TEMPLATE = """
+        <context>
+        {context}
+        </context>
+    """
+
+# Budget de tokens du prompt, initialisé avec le tokenizer du premier modèle chargé
+_prompt_budget = None
+# Caches d'états KV (un par instance llama.cpp)
+prompt_caches = []
+
+
+def get_model(n_threads=None, instance=None):
+    """
+    Creates and returns the LlamaCpp model (fake_llm.FakeChatModel if LLM_FAKE=1).
+    `instance` nomme son dossier de débordement du cache KV (ex. "worker2" dans
+    llm_workers.py ; par défaut "slotN" dans ce processus).
+    """
+    global _prompt_budget
+    if paths.LLM_FAKE:
+        from fake_llm import FakeChatModel
+        return FakeChatModel(tokens_per_s=paths.LLM_FAKE_TOKENS_PER_S, n_tokens=paths.LLM_FAKE_TOKENS)
     llm_langchain = ChatLlamaCpp(
         model_path=paths.generator_model_path,
-        n_ctx=50000,
+        n_ctx=paths.LLM_N_CTX,
         temperature=0.01,
-        max_tokens=512,
+        max_tokens=paths.LLM_MAX_TOKENS,
         top_p=1,
-        n_threads=2
+        n_threads=n_threads or paths.LLM_N_THREADS,
+        use_mmap=True,
     )
+    if _prompt_budget is None or _prompt_budget.counter.tokenize is None:
+        _prompt_budget = _make_budget(TokenCounter.from_llm(llm_langchain))
+    if paths.PROMPT_CACHE_ENABLED:
+        disk_dir = paths.PROMPT_CACHE_DISK_DIR
+        if disk_dir:
+            fingerprint = model_fingerprint(paths.generator_model_path, paths.LLM_N_CTX)
+            disk_dir = spill_dir(disk_dir, fingerprint, instance or f"slot{len(prompt_caches)}")
+        # PROMPT_CACHE_DISK_MB est le total, réparti entre les instances llama.cpp
+        n_instances = paths.LLM_WORKERS if paths.LLM_WORKERS > 0 else max(1, paths.CHAT_CONCURRENCY)
+        cache = install_prompt_cache(
+            llm_langchain,
+            capacity_bytes=paths.PROMPT_CACHE_RAM_MB << 20,
+            disk_dir=disk_dir or None,
+            disk_capacity_bytes=(paths.PROMPT_CACHE_DISK_MB << 20) // n_instances,
+        )
+        if cache is not None:
+            prompt_caches.append(cache)
     return llm_langchain
 
 
+def _make_budget(counter):
+    return PromptBudget(
+        counter,
+        n_ctx=paths.LLM_N_CTX,
+        max_new_tokens=paths.LLM_MAX_TOKENS,
+        context_tokens=paths.PROMPT_CONTEXT_TOKENS,
+        template=SYSTEM_TEMPLATE + CONTEXT_TEMPLATE.replace("{context}", ""),
+    )
 
 
-def get_chain_generator(generator):
-    """Creates the retrieval and response generation pipeline."""
-    SYSTEM_TEMPLATE = """
-        Answer the user's questions based on the below context. 
-        If the context doesn't contain relevant information, just say "I don't know".
-
-        <context>
-        {context}
-        </context>
+def load_tokenizer_budget():
+    """
+    Budget de tokens sans charger les poids (vocabulaire seul) : utilisé quand
+    la génération tourne dans les workers (llm_workers.py).
     """
+    global _prompt_budget
+    try:
+        from llama_cpp import Llama
+        vocab = Llama(model_path=paths.generator_model_path, vocab_only=True, verbose=False)
+    except Exception as e:
+        print(f"[BUDGET][WARN] tokenizer unavailable ({e}) — estimating ~4 chars/token")
+        return get_prompt_budget()
+    _prompt_budget = _make_budget(TokenCounter.from_llm(vocab))
+    return _prompt_budget
+
+
+def get_prompt_budget():
+    """Budget courant (estimation ~4 caractères/token tant qu'aucun modèle n'est chargé)."""
+    global _prompt_budget
+    if _prompt_budget is None:
+        _prompt_budget = _make_budget(TokenCounter())
+    return _prompt_budget
+
+
 
+
+def get_chain_generator(generator):
+    """Creates the retrieval and response generation pipeline."""
     question_answering_prompt = ChatPromptTemplate.from_messages(
         [
             ("system", SYSTEM_TEMPLATE),
             MessagesPlaceholder(variable_name="messages"),
+            ("system", CONTEXT_TEMPLATE),
         ]
     )
 
@@ -168,60 +249,120 @@ def get_chain_generator(generator):
 
 def get_chat_hist_instance(session_id):
     """Fetches chat history from Redis for the given session."""
-    return redis_db.get_chat_history(redis_client, session_id)
+    return redis_db.get_chat_history(
+        redis_client,
+        session_id,
+        ttl_seconds=paths.CHAT_HISTORY_TTL_S or None,
+        max_messages=paths.CHAT_HISTORY_MAX_MESSAGES or None,
+        summarizer=summarize_dropped_turns if paths.CHAT_HISTORY_SUMMARY else None,
+    )
+
+
+def summarize_dropped_turns(previous, dropped, max_chars=1500):
+    """
+    Résumé extractif (sans appel au LLM) des tours retirés de l'historique :
+    les questions posées, les plus récentes conservées dans `max_chars`.
+    """
+    lines = previous.splitlines() if previous else []
+    for msg in dropped:
+        text = (msg.content or "").strip()
+        if isinstance(msg, HumanMessage) and text:
+            lines.append("- " + text.splitlines()[0][:200])
+    while len("\n".join(lines)) > max_chars and len(lines) > 1:
+        lines.pop(0)
+    return "\n".join(lines)
 
 
 
 
-async def generate_chat_st(user_input, generator_chain, chat_history_instance):
+SYSTEM_PROMPT_CONTENT = (
+    "You are a highly helpful assistant, and your name is llama_chat. "
+    "Your answers will be concise and direct. "
+    "If the provided context lacks relevant information, you may answer without it."
+)
+
+
+def _prepare_history(user_input, chat_history_instance, context):
     """
-    Génère la réponse + section 'Sources' basée sur les métadonnées des Documents.
+    Ajoute le system (une seule fois) + le message utilisateur, puis applique
+    le budget de tokens : renvoie (historique, contexte) qui tiennent dans n_ctx.
     """
-    system_prompt_content = (
-        "You are a highly helpful assistant, and your name is llama_chat. "
-        "Your answers will be concise and direct. "
-        "If the provided context lacks relevant information, you may answer without it."
-    )
-
-    # 1) System unique
-    if not any(isinstance(msg, SystemMessage) for msg in chat_history_instance.messages):
-        chat_history_instance.add_message(SystemMessage(content=system_prompt_content))
+    # 1) System unique (stocké à part, hors de la liste des tours)
+    chat_history_instance.set_system_message(SYSTEM_PROMPT_CONTENT)
 
     # 2) Message utilisateur
     chat_history_instance.add_message(HumanMessage(content=user_input))
 
-    # 3) Trim de l'historique (~4000 caractères)
-    history = trim_messages(
-        chat_history_instance.messages,
-        strategy="last",
-        start_on="human",
-        end_on=("human", "tool"),
-        token_counter=len,
-        include_system=True,
-        max_tokens=4000,
-    )
+    # 3) Contexte puis historique (derniers tours de CHAT_HISTORY_WINDOW) dans le budget
+    budget = get_prompt_budget()
+    context, context_used = budget.fit_documents(context)
+    history = budget.trim_history(chat_history_instance.window(paths.CHAT_HISTORY_WINDOW), context_used)
+    return history, context
 
-    # 4) Appel du chain (ici: retriever_chain)
-    start = time.time()
-    pack = await asyncio.ensure_future(generator_chain.ainvoke({"messages": history}))
-    elapsed = time.time() - start
-
-    # Réponse LLM
-    response = pack.get("answer") if isinstance(pack, dict) else str(pack)
 
+def _finalize_answer(chat_history_instance, response, docs, elapsed):
+    """Ajoute la section 'Sources', persiste la réponse et les métriques ; renvoie le texte final."""
     # 5) Construction de la section 'Sources'
-    docs = pack.get("context", []) if isinstance(pack, dict) else []
     sources_block = SourceRenderer(docs).render()
     final_text = response + sources_block if sources_block else response
 
     # 6) Persistance via la classe unifiée (inclut duration)
-    chat_history_instance.add_ai_message(final_text, duration=elapsed)
+    #    + 7) métriques dashboard, dans le même pipeline Redis
+    chat_history_instance.add_ai_message(
+        final_text, duration=elapsed, also=lambda pipe: _record_response_metrics(pipe, elapsed)
+    )
+
+    return final_text
+
+
+def _record_response_metrics(pipe, elapsed):
+    # histogramme journalier à taille fixe (lu par streamlit_pages/dashboard.py)
+    dashboard_metrics.record_response(pipe, elapsed)
+
+
+def record_cached_answer(user_input, chat_history_instance, final_text, elapsed):
+    """Persiste un tour servi par le cache sémantique (aucune génération)."""
+    chat_history_instance.set_system_message(SYSTEM_PROMPT_CONTENT)
+    chat_history_instance.add_message(HumanMessage(content=user_input))
+    chat_history_instance.add_ai_message(
+        final_text, duration=elapsed, also=lambda pipe: _record_response_metrics(pipe, elapsed)
+    )
 
-    # 7) Métriques dashboard
-    date_str = datetime.utcnow().date().isoformat()
-    chat_history_instance.redis_client.rpush(f"response_times:{date_str}", elapsed)
-    chat_history_instance.redis_client.incr(f"responses:{date_str}")
 
-    return chat_history_instance, elapsed
+async def _astream_text(generator_chain, inputs):
+    """Fragments de texte non vides émis par la chaîne (str ou messages)."""
+    async for chunk in generator_chain.astream(inputs):
+        text = chunk if isinstance(chunk, str) else getattr(chunk, "content", str(chunk))
+        if text:
+            yield text
 
 
+async def stream_chat_st(user_input, generator_chain, chat_history_instance, context):
+    """
+    Génère la réponse en flux (chaîne de génération seule + contexte déjà
+    récupéré). Produit des tuples :
+      - ("token", str) à chaque fragment émis par ChatLlamaCpp
+      - ("final", {"response", "sources", "duration", "ttft"}) une fois la
+        réponse complète persistée dans Redis
+    """
+    with metrics.timed(metrics.PROMPT_BUILD_SECONDS):
+        history, context = _prepare_history(user_input, chat_history_instance, context)
+
+    start = time.time()
+    ttft = None
+    parts = []
+    async for text in _astream_text(generator_chain, {"messages": history, "context": context}):
+        if ttft is None:
+            ttft = time.time() - start
+        parts.append(text)
+        yield "token", text
+    elapsed = time.time() - start
+    metrics.observe_generation(ttft, len(parts), elapsed)
+
+    final_text = _finalize_answer(chat_history_instance, "".join(parts), context, elapsed)
+    yield "final", {
+        "response": final_text,
+        "sources": SourceRenderer(context).labels(),
+        "duration": elapsed,
+        "ttft": ttft if ttft is not None else elapsed,
+    }
@@ -0,0 +1,144 @@
+"""
+index_config.py — paramètres d'index / de recherche Milvus (source unique)
+
+Remplace les valeurs en dur de retriever.load_vectorstore et
+preprocess.get_vectorizer (HNSW M=16, efConstruction=200, ef=128).
+
+Un profil d'index = type d'index + paramètres de construction + paramètre de
+recherche par profil de requête :
+
+    {"index_type": "HNSW", "metric_type": "COSINE",
+     "build": {"M": 16, "efConstruction": 200},
+     "search": {"fast": 48, "accurate": 128}}
+
+- "fast" : exploration de documents (/retrieve), latence avant tout
+- "accurate" : contexte du chat (valeur par défaut du vectorstore)
+
+Le paramètre de recherche dépend du type d'index : `ef` pour HNSW, `nprobe`
+pour IVF_FLAT / IVF_SQ8. Une surcharge par requête (`ef`) s'applique au
+paramètre du type courant.
+
+Le profil est lu dans paths.INDEX_PROFILE_PATH (écrit par
+`python index_tuning.py sweep`) ; à défaut, les variables MILVUS_INDEX_* /
+MILVUS_SEARCH_* (paths.py). Changer `index_type` ou `build` exige de
+reconstruire l'index (`python index_tuning.py apply`), pas de ré-embedder.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Optional
+
+import paths
+
+# type d'index -> (paramètre de recherche, paramètres de construction)
+INDEX_TYPES: Dict[str, tuple] = {
+    "HNSW": ("ef", ("M", "efConstruction")),
+    "IVF_FLAT": ("nprobe", ("nlist",)),
+    "IVF_SQ8": ("nprobe", ("nlist",)),
+}
+SEARCH_PROFILES = ("fast", "accurate")
+
+
+@dataclass
+class IndexProfile:
+    index_type: str = "HNSW"
+    metric_type: str = "COSINE"
+    build: Dict[str, int] = field(default_factory=lambda: {"M": 16, "efConstruction": 200})
+    search: Dict[str, int] = field(default_factory=lambda: {"fast": 48, "accurate": 128})
+
+    def __post_init__(self):
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type '{self.index_type}' (expected one of {tuple(INDEX_TYPES)}).")
+        missing = [p for p in INDEX_TYPES[self.index_type][1] if p not in self.build]
+        if missing:
+            raise ValueError(f"{self.index_type} needs build params {missing}.")
+        missing = [p for p in SEARCH_PROFILES if p not in self.search]
+        if missing:
+            raise ValueError(f"Missing search profiles {missing}.")
+
+    @property
+    def search_key(self) -> str:
+        """'ef' (HNSW) ou 'nprobe' (IVF)."""
+        return INDEX_TYPES[self.index_type][0]
+
+    def index_params(self) -> Dict[str, Any]:
+        return {"index_type": self.index_type, "metric_type": self.metric_type, "params": dict(self.build)}
+
+    def search_value(self, profile: Optional[str] = None, ef: Optional[int] = None, k: int = 0) -> int:
+        """Valeur du paramètre de recherche : surcharge `ef`, sinon celle du profil.
+
+        Pour HNSW, Milvus exige ef >= k : la valeur est relevée au besoin.
+        """
+        profile = profile or "accurate"
+        if profile not in self.search:
+            raise ValueError(f"Unknown search profile '{profile}' (expected one of {tuple(self.search)}).")
+        value = int(ef) if ef is not None else int(self.search[profile])
+        if value < 1:
+            raise ValueError(f"{self.search_key} must be >= 1 (got {value}).")
+        if self.search_key == "ef":
+            value = max(value, int(k))
+        return min(value, paths.MILVUS_SEARCH_MAX)
+
+    def search_params(self, profile: Optional[str] = None, ef: Optional[int] = None, k: int = 0) -> Dict[str, Any]:
+        return {"metric_type": self.metric_type, "params": {self.search_key: self.search_value(profile, ef, k)}}
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "IndexProfile":
+        return cls(
+            index_type=data.get("index_type", "HNSW"),
+            metric_type=data.get("metric_type", "COSINE"),
+            build={k: int(v) for k, v in (data.get("build") or {}).items()},
+            search={k: int(v) for k, v in (data.get("search") or {}).items()},
+        )
+
+
+def default_profile() -> IndexProfile:
+    """Profil issu de paths.py (variables d'environnement)."""
+    index_type = paths.MILVUS_INDEX_TYPE
+    if index_type == "HNSW":
+        build = {"M": paths.MILVUS_HNSW_M, "efConstruction": paths.MILVUS_HNSW_EF_CONSTRUCTION}
+    else:
+        build = {"nlist": paths.MILVUS_IVF_NLIST}
+    return IndexProfile(
+        index_type=index_type,
+        build=build,
+        search={"fast": paths.MILVUS_SEARCH_FAST, "accurate": paths.MILVUS_SEARCH_ACCURATE},
+    )
+
+
+def load_profile(path: Optional[str] = None) -> IndexProfile:
+    """Profil écrit par index_tuning.py s'il existe, sinon celui de paths.py."""
+    path = path or paths.INDEX_PROFILE_PATH
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return IndexProfile.from_dict(data.get("profile", data))
+    return default_profile()
+
+
+def save_profile(profile: IndexProfile, path: Optional[str] = None, report: Optional[dict] = None) -> str:
+    path = path or paths.INDEX_PROFILE_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    payload = {"profile": profile.to_dict(), **({"report": report} if report else {})}
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+_profile: Optional[IndexProfile] = None
+
+
+def get_profile() -> IndexProfile:
+    """Profil du processus (lu une fois)."""
+    global _profile
+    if _profile is None:
+        _profile = load_profile()
+    return _profile
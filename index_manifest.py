@@ -0,0 +1,144 @@
+"""
+index_manifest.py — manifeste persistant de l'indexation Milvus
+
+Un fichier JSON (paths.manifest_path) décrit ce qui est réellement indexé :
+
+    {
+      "version": 1,
+      "params": {"chunk_size": 1200, "chunk_overlap": 150, "embedding_model": "all-mpnet-base-v2"},
+      "files": {
+        "/app/data/x.pdf": {"sha256": "...", "size": 123, "mtime": 1700000000.0,
+                            "chunk_ids": [4512, 4513, ...], "indexed_at": "..."}
+      }
+    }
+
+Utilisé par `preprocess.py sync` pour n'embedder que les PDF ajoutés/modifiés
+et supprimer par clé primaire les lignes des PDF modifiés/supprimés.
+Si les paramètres (chunker, modèle d'embedding) changent, tout est à refaire.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path: str, bufsize: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(bufsize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@dataclass
+class ManifestDiff:
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+    def summary(self) -> str:
+        return (f"{len(self.added)} added, {len(self.changed)} changed, "
+                f"{len(self.removed)} removed, {len(self.unchanged)} unchanged")
+
+
+class IndexManifest:
+    """Lecture / écriture atomique du manifeste + calcul du diff avec le corpus."""
+
+    def __init__(self, path: str, params: Optional[dict] = None, files: Optional[Dict[str, dict]] = None):
+        self.path = path
+        self.params = params or {}
+        self.files: Dict[str, dict] = files or {}
+
+    # ---------- Persistance ----------
+
+    @classmethod
+    def load(cls, path: str) -> "IndexManifest":
+        if not os.path.exists(path):
+            return cls(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"[MANIFEST][WARN] unreadable manifest {path}: {e} — starting empty")
+            return cls(path)
+        if data.get("version") != MANIFEST_VERSION:
+            print(f"[MANIFEST][WARN] unsupported manifest version in {path} — starting empty")
+            return cls(path)
+        return cls(path, data.get("params") or {}, data.get("files") or {})
+
+    def save(self):
+        """Écriture atomique (fichier temporaire + os.replace)."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = {"version": MANIFEST_VERSION, "params": self.params, "files": self.files}
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    # ---------- Entrées ----------
+
+    def record(self, source: str, file_path: str, chunk_ids: List) -> None:
+        """Enregistre un fichier indexé (`file_path` = fichier lu pour le hash, `source` = clé)."""
+        st = os.stat(file_path)
+        self.files[os.path.abspath(source)] = {
+            "sha256": file_sha256(file_path),
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "chunk_ids": list(chunk_ids or []),
+            "indexed_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def forget(self, source: str) -> Optional[dict]:
+        return self.files.pop(os.path.abspath(source), None)
+
+    def chunk_ids(self, source: str) -> List:
+        return list((self.files.get(os.path.abspath(source)) or {}).get("chunk_ids") or [])
+
+    # ---------- Diff ----------
+
+    def diff(self, files: List[str], params: dict) -> ManifestDiff:
+        """
+        Compare le corpus courant au manifeste. Taille + mtime identiques => inchangé
+        sans relire le fichier ; sinon comparaison du sha256.
+        """
+        out = ManifestDiff()
+        params_changed = bool(self.files) and self.params != params
+        current = {os.path.abspath(f) for f in files}
+
+        for f in sorted(current):
+            entry = self.files.get(f)
+            if entry is None:
+                out.added.append(f)
+                continue
+            if params_changed:
+                out.changed.append(f)
+                continue
+            st = os.stat(f)
+            if st.st_size == entry.get("size") and st.st_mtime == entry.get("mtime"):
+                out.unchanged.append(f)
+            elif file_sha256(f) == entry.get("sha256"):
+                # simple "touch" : on rafraîchit mtime pour éviter de re-hasher la prochaine fois
+                entry["mtime"] = st.st_mtime
+                out.unchanged.append(f)
+            else:
+                out.changed.append(f)
+
+        out.removed = sorted(set(self.files) - current)
+        return out
@@ -0,0 +1,383 @@
+"""
+index_tuning.py — réglage de l'index Milvus (frontière rappel / latence)
+
+Balaye, sur notre corpus :
+- à la construction : HNSW (M, efConstruction) et les alternatives IVF_FLAT /
+  IVF_SQ8 (nlist) — une collection temporaire, embeddings insérés une fois,
+  index reconstruit pour chaque variante
+- à la requête : ef (HNSW) ou nprobe (IVF)
+
+Rappel mesuré contre la recherche exacte (cosinus numpy sur les mêmes
+vecteurs) : recall@k = part des k voisins exacts retrouvés. Avec un jeu de
+requêtes annotées (format retrieval_bench.py), le taux de succès
+(chunk pertinent dans les k) est aussi reporté.
+
+Le profil retenu (index_config.IndexProfile) garde une seule construction :
+- "accurate" : la plus petite latence p95 atteignant --accurate-recall
+- "fast" : la plus petite latence p95 atteignant --fast-recall
+
+    python index_tuning.py sweep queries.jsonl --k 10 --plot frontier.png
+    python index_tuning.py show
+    python index_tuning.py apply      # reconstruit l'index de la collection
+
+Le profil est écrit dans paths.INDEX_PROFILE_PATH (lu par retriever.py et
+preprocess.py au démarrage) ; `apply` est nécessaire si la construction change.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import paths
+from index_config import INDEX_TYPES, IndexProfile, load_profile, save_profile
+
+DEFAULT_BUILDS = [
+    {"index_type": "HNSW", "build": {"M": 8, "efConstruction": 100}},
+    {"index_type": "HNSW", "build": {"M": 16, "efConstruction": 200}},
+    {"index_type": "HNSW", "build": {"M": 32, "efConstruction": 400}},
+    {"index_type": "IVF_FLAT", "build": {}},
+    {"index_type": "IVF_SQ8", "build": {}},
+]
+DEFAULT_SEARCH = {
+    "ef": [16, 32, 48, 64, 96, 128, 192, 256, 384, 512],
+    "nprobe": [4, 8, 16, 32, 64, 128],
+}
+
+
+# ---------- Vérité terrain & métriques ----------
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def exact_topk(doc_vecs: np.ndarray, query_vecs: np.ndarray, k: int) -> np.ndarray:
+    """Indices des k voisins exacts (cosinus) de chaque requête."""
+    sims = _normalize(query_vecs) @ _normalize(doc_vecs).T
+    k = min(k, sims.shape[1])
+    top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def ann_recall(found: Sequence[Sequence[int]], exact: np.ndarray) -> float:
+    if not len(exact):
+        return 0.0
+    k = exact.shape[1]
+    return float(np.mean([len(set(f[:k]) & set(e)) / k for f, e in zip(found, exact.tolist())]))
+
+
+def _nlist(n_vectors: int) -> int:
+    """nlist ~ 4·sqrt(n) (recommandation Milvus), plafonné par MILVUS_IVF_NLIST."""
+    return max(16, min(paths.MILVUS_IVF_NLIST, int(4 * math.sqrt(max(1, n_vectors)))))
+
+
+# ---------- Balayage ----------
+
+def sweep(
+    backend: Any,
+    builds: List[dict],
+    query_vecs: np.ndarray,
+    exact: np.ndarray,
+    k: int,
+    search_values: Optional[Dict[str, List[int]]] = None,
+    hit: Optional[Any] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Un point par (construction, valeur de recherche).
+
+    `backend` expose build(index_type, build_params) -> secondes et
+    search(vector, search_key, value, k) -> [indices] ; `hit(i, ids)` dit si la
+    requête annotée i est satisfaite par ces résultats.
+    """
+    search_values = search_values or DEFAULT_SEARCH
+    points = []
+    for variant in builds:
+        index_type = variant["index_type"]
+        build = dict(variant.get("build") or {})
+        if index_type != "HNSW" and "nlist" not in build:
+            build["nlist"] = _nlist(backend.n_vectors)
+        key = INDEX_TYPES[index_type][0]
+        build_s = backend.build(index_type, build)
+        for value in search_values[key]:
+            if key == "ef" and value < k:
+                continue
+            if key == "nprobe" and value > build["nlist"]:
+                continue
+            backend.search(query_vecs[0], key, value, k)  # chauffe
+            found, latencies = [], []
+            for q in query_vecs:
+                start = time.perf_counter()
+                found.append(backend.search(q, key, value, k))
+                latencies.append(time.perf_counter() - start)
+            lat = np.asarray(latencies) * 1000.0
+            point = {
+                "index_type": index_type,
+                "build": build,
+                "search_key": key,
+                "value": int(value),
+                "recall": round(ann_recall(found, exact), 4),
+                "p50_ms": round(float(np.percentile(lat, 50)), 3),
+                "p95_ms": round(float(np.percentile(lat, 95)), 3),
+                "build_s": round(build_s, 2),
+            }
+            if hit is not None:
+                point["hit_rate"] = round(float(np.mean([hit(i, ids) for i, ids in enumerate(found)])), 4)
+            points.append(point)
+    return points
+
+
+def pareto_frontier(points: List[dict]) -> List[dict]:
+    """Points non dominés : aucun autre n'est à la fois plus rapide (p95) et plus précis."""
+    frontier, best = [], -1.0
+    for p in sorted(points, key=lambda p: (p["p95_ms"], -p["recall"])):
+        if p["recall"] > best:
+            frontier.append(p)
+            best = p["recall"]
+    return frontier
+
+
+def _build_key(p: dict) -> Tuple[str, str]:
+    return p["index_type"], json.dumps(p["build"], sort_keys=True)
+
+
+def _pick(points: List[dict], target: float) -> Tuple[dict, bool]:
+    """Le plus rapide atteignant `target`, sinon le plus précis."""
+    ok = [p for p in points if p["recall"] >= target]
+    if ok:
+        return min(ok, key=lambda p: p["p95_ms"]), True
+    return max(points, key=lambda p: (p["recall"], -p["p95_ms"])), False
+
+
+def choose_profile(points: List[dict], fast_recall: float = 0.90, accurate_recall: float = 0.98) -> Tuple[IndexProfile, dict]:
+    """Construction dont le point "accurate" est le meilleur, puis ef/nprobe "fast" sur la même."""
+    if not points:
+        raise ValueError("No sweep points to choose from.")
+    groups: Dict[Tuple[str, str], List[dict]] = {}
+    for p in points:
+        groups.setdefault(_build_key(p), []).append(p)
+
+    candidates = []
+    for group in groups.values():
+        accurate, met = _pick(group, accurate_recall)
+        candidates.append((not met, accurate["p95_ms"] if met else -accurate["recall"], accurate, group))
+    _, _, accurate, group = min(candidates, key=lambda c: c[:2])
+
+    fast, _ = _pick([p for p in group if p["value"] <= accurate["value"]], fast_recall)
+    profile = IndexProfile(
+        index_type=accurate["index_type"],
+        build=dict(accurate["build"]),
+        search={"fast": fast["value"], "accurate": accurate["value"]},
+    )
+    return profile, {"fast": fast, "accurate": accurate}
+
+
+# ---------- Backend Milvus ----------
+
+class MilvusSweepBackend:
+    """Collection temporaire (pk = position du chunk) ; index reconstruit par variante."""
+
+    def __init__(self, vectors: np.ndarray, collection_name: str, metric_type: str = "COSINE"):
+        from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, connections, utility
+
+        connections.connect(alias="default", host=paths.MILVUS_HOST, port=str(paths.MILVUS_PORT))
+        if utility.has_collection(collection_name):
+            utility.drop_collection(collection_name)
+        schema = CollectionSchema([
+            FieldSchema("pk", DataType.INT64, is_primary=True, auto_id=False),
+            FieldSchema("vector", DataType.FLOAT_VECTOR, dim=int(vectors.shape[1])),
+        ])
+        self.collection = Collection(collection_name, schema)
+        self.metric_type = metric_type
+        self.n_vectors = int(vectors.shape[0])
+        for start in range(0, self.n_vectors, 2000):
+            chunk = vectors[start:start + 2000]
+            self.collection.insert([list(range(start, start + len(chunk))), chunk.tolist()])
+        self.collection.flush()
+
+    def build(self, index_type: str, build: dict) -> float:
+        col = self.collection
+        col.release()
+        if col.has_index():
+            col.drop_index()
+        start = time.perf_counter()
+        col.create_index("vector", {"index_type": index_type, "metric_type": self.metric_type, "params": build})
+        col.load()
+        return time.perf_counter() - start
+
+    def search(self, vector, search_key: str, value: int, k: int) -> List[int]:
+        res = self.collection.search(
+            [list(map(float, vector))], "vector",
+            {"metric_type": self.metric_type, "params": {search_key: int(value)}}, limit=k,
+        )
+        return [int(hit.id) for hit in res[0]]
+
+    def close(self) -> None:
+        from pymilvus import utility
+
+        utility.drop_collection(self.collection.name)
+
+
+def apply_profile(profile: IndexProfile, collection_name: Optional[str] = None) -> None:
+    """Reconstruit l'index de la collection avec la construction du profil."""
+    from pymilvus import Collection, connections
+
+    connections.connect(alias="default", host=paths.MILVUS_HOST, port=str(paths.MILVUS_PORT))
+    col = Collection(collection_name or paths.MILVUS_COLLECTION)
+    col.release()
+    if col.has_index():
+        col.drop_index()
+    col.create_index("vector", profile.index_params())
+    col.load()
+
+
+# ---------- Rapport ----------
+
+def _label(p: dict) -> str:
+    build = ",".join(f"{k}={v}" for k, v in p["build"].items())
+    return f"{p['index_type']}({build})"
+
+
+def print_points(points: List[dict], chosen: Optional[dict] = None, out=sys.stderr) -> None:
+    frontier = {id(p) for p in pareto_frontier(points)}
+    picked = {id(p): name for name, p in (chosen or {}).items()}
+    print(f"{'index':<34}{'search':>12}{'recall':>9}{'hit':>8}{'p50 ms':>9}{'p95 ms':>9}  ", file=out)
+    for p in points:
+        mark = "*" if id(p) in frontier else " "
+        tag = picked.get(id(p), "")
+        hit = f"{p['hit_rate']:.3f}" if "hit_rate" in p else "-"
+        print(f"{_label(p):<34}{p['search_key'] + '=' + str(p['value']):>12}{p['recall']:>9.3f}{hit:>8}"
+              f"{p['p50_ms']:>9.2f}{p['p95_ms']:>9.2f} {mark}{tag}", file=out)
+    print("* = Pareto frontier (recall vs p95 latency)", file=out)
+
+
+def plot_frontier(points: List[dict], path: str, chosen: Optional[dict] = None) -> None:
+    """Nuage rappel / latence p95 par construction, frontière de Pareto en trait."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 5))
+    groups: Dict[Tuple[str, str], List[dict]] = {}
+    for p in points:
+        groups.setdefault(_build_key(p), []).append(p)
+    for group in groups.values():
+        group = sorted(group, key=lambda p: p["value"])
+        ax.plot([p["p95_ms"] for p in group], [p["recall"] for p in group], marker="o", ms=3, lw=1, label=_label(group[0]))
+    frontier = pareto_frontier(points)
+    ax.plot([p["p95_ms"] for p in frontier], [p["recall"] for p in frontier], "k--", lw=1, label="Pareto frontier")
+    for name, p in (chosen or {}).items():
+        ax.annotate(f"{name} ({p['search_key']}={p['value']})", (p["p95_ms"], p["recall"]),
+                    textcoords="offset points", xytext=(5, -12), fontsize=8)
+    ax.set_xlabel("p95 search latency (ms)")
+    ax.set_ylabel("recall@k vs exact search")
+    ax.grid(alpha=0.3)
+    ax.legend(fontsize=7, loc="lower right")
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    plt.close(fig)
+
+
+# ---------- CLI ----------
+
+def _cmd_sweep(args) -> int:
+    import retrieval_bench as rb
+    from embedding_engine import get_engine
+    from lexical_index import LexicalIndex
+
+    queries = rb.load_queries(args.queries)
+    docs = list(rb.iter_docstore(LexicalIndex.load(paths.bm25_dir)))
+    if not docs:
+        print(f"No chunks in {paths.bm25_dir} — run 'python preprocess.py preprocess' first.", file=sys.stderr)
+        return 1
+
+    engine = get_engine()
+    doc_vecs = np.asarray(engine.embed_documents([d.page_content for d in docs]), dtype=np.float32)
+    query_vecs = np.asarray(engine.embed_documents([q["question"] for q in queries]), dtype=np.float32)
+    exact = exact_topk(doc_vecs, query_vecs, args.k)
+    hit = lambda i, ids: rb.first_relevant_rank([docs[j] for j in ids], queries[i]) is not None  # noqa: E731
+
+    builds = DEFAULT_BUILDS
+    if args.builds:
+        with open(args.builds, "r", encoding="utf-8") as f:
+            builds = json.load(f)
+    search_values = dict(DEFAULT_SEARCH)
+    if args.ef:
+        search_values["ef"] = [int(v) for v in args.ef.split(",")]
+    if args.nprobe:
+        search_values["nprobe"] = [int(v) for v in args.nprobe.split(",")]
+
+    backend = MilvusSweepBackend(doc_vecs, f"{paths.MILVUS_COLLECTION}_tuning")
+    try:
+        points = sweep(backend, builds, query_vecs, exact, args.k, search_values, hit)
+    finally:
+        backend.close()
+
+    profile, chosen = choose_profile(points, args.fast_recall, args.accurate_recall)
+    print_points(points, chosen)
+    if args.plot:
+        plot_frontier(points, args.plot, chosen)
+        print(f"Frontier plot written to {args.plot}", file=sys.stderr)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "n_chunks": len(docs),
+        "n_queries": len(queries),
+        "k": args.k,
+        "targets": {"fast": args.fast_recall, "accurate": args.accurate_recall},
+        "chosen": chosen,
+        "points": points,
+    }
+    if args.dry_run:
+        print(json.dumps({"profile": profile.to_dict(), "report": report}, indent=2))
+        return 0
+    path = save_profile(profile, args.out, report)
+    current = load_profile()
+    print(f"Profile written to {path}: {json.dumps(profile.to_dict())}", file=sys.stderr)
+    if (current.index_type, current.build) != (profile.index_type, profile.build):
+        print("Build parameters changed — run 'python index_tuning.py apply' to rebuild the index.", file=sys.stderr)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Milvus index tuning: recall vs latency sweep.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    sp = sub.add_parser("sweep", help="sweep build / search params and write the chosen profile")
+    sp.add_argument("queries", help="query set (JSONL, retrieval_bench.py format)")
+    sp.add_argument("--k", type=int, default=10)
+    sp.add_argument("--builds", help="JSON list of {index_type, build} variants (default: HNSW M=8/16/32, IVF_FLAT, IVF_SQ8)")
+    sp.add_argument("--ef", help="comma-separated ef values (HNSW)")
+    sp.add_argument("--nprobe", help="comma-separated nprobe values (IVF)")
+    sp.add_argument("--fast-recall", type=float, default=0.90)
+    sp.add_argument("--accurate-recall", type=float, default=0.98)
+    sp.add_argument("--plot", help="write the recall/latency frontier to this PNG")
+    sp.add_argument("--out", help=f"profile path (default: {paths.INDEX_PROFILE_PATH})")
+    sp.add_argument("--dry-run", action="store_true", help="print the profile instead of writing it")
+
+    sub.add_parser("show", help="print the active profile")
+
+    ap = sub.add_parser("apply", help="rebuild the collection index with the active profile")
+    ap.add_argument("--collection", default=paths.MILVUS_COLLECTION)
+
+    args = parser.parse_args(argv)
+    if args.cmd == "sweep":
+        return _cmd_sweep(args)
+    profile = load_profile()
+    if args.cmd == "show":
+        print(json.dumps(profile.to_dict(), indent=2))
+        return 0
+    apply_profile(profile, args.collection)
+    print(f"Index of <{args.collection}> rebuilt: {json.dumps(profile.index_params())}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
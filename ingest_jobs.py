@@ -0,0 +1,114 @@
+"""
+ingest_jobs.py — ingestion des PDF uploadés en tâche de fond (/upload)
+
+/upload ne fait plus que valider et enregistrer les fichiers : l'extraction,
+le découpage, l'embedding et l'insertion Milvus tournent dans un pool de
+threads, hors de la boucle asyncio (/chat et /retrieve restent réactifs).
+
+- un travail (IngestJob) = un lot de fichiers d'une même requête
+- progression par fichier : pages extraites, chunks embeddés, lignes insérées,
+  consultable via GET /upload/{job_id}
+- INGEST_WORKERS=1 par défaut : les écritures (Milvus, manifeste, BM25) sont
+  sérialisées, comme avec l'ancien verrou `vectorstore_lock`
+- les travaux sont gardés en mémoire (uvicorn --workers 1) ; les plus anciens
+  travaux terminés sont oubliés au-delà de INGEST_MAX_JOBS
+
+Un pool de threads (et non de processus) : le modèle d'embedding et la
+connexion Milvus sont déjà chargés dans l'API ; l'encodage libère le GIL.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Callable, List, Optional, Tuple
+from uuid import uuid4
+
+
+@dataclass
+class FileProgress:
+    filename: str
+    status: str = "queued"       # queued | extracting | embedding | done | failed
+    pages_total: int = 0
+    pages_extracted: int = 0
+    chunks: int = 0
+    chunks_embedded: int = 0
+    rows_inserted: int = 0
+    error: Optional[str] = None
+
+    def on_page(self, done: int, total: int) -> None:
+        self.pages_extracted, self.pages_total = done, total
+
+    def on_batch(self, stage: str, n: int) -> None:
+        if stage == "embedded":
+            self.chunks_embedded += n
+        elif stage == "inserted":
+            self.rows_inserted += n
+
+
+@dataclass
+class IngestJob:
+    job_id: str
+    files: List[FileProgress]
+    status: str = "queued"       # queued | running | done | failed | partial
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    def finish(self) -> None:
+        failed = sum(f.status == "failed" for f in self.files)
+        self.status = "done" if not failed else "failed" if failed == len(self.files) else "partial"
+        self.finished_at = time.time()
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class IngestJobManager:
+    """File des travaux d'ingestion exécutés par `ingest_file(path, progress)`."""
+
+    def __init__(
+        self,
+        ingest_file: Callable[[str, FileProgress], None],
+        max_workers: int = 1,
+        max_jobs: int = 200,
+    ):
+        self.ingest_file = ingest_file
+        self.max_jobs = max(1, int(max_jobs))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="ingest")
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, files: List[Tuple[str, str]]) -> IngestJob:
+        """`files` = [(chemin temporaire, nom affiché)] ; renvoie le travail créé."""
+        job = IngestJob(job_id=uuid4().hex, files=[FileProgress(name) for _, name in files])
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+        self._executor.submit(self._run, job, [p for p, _ in files])
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job: IngestJob, paths: List[str]) -> None:
+        job.status = "running"
+        for path, progress in zip(paths, job.files):
+            try:
+                self.ingest_file(path, progress)
+                progress.status = "done"
+            except Exception as e:
+                print(f"[INGEST][FAIL] {progress.filename}: {e}")
+                progress.status, progress.error = "failed", str(e)
+        job.finish()
+
+    def _prune(self) -> None:
+        excess = len(self._jobs) - self.max_jobs
+        for job_id in [j for j, job in self._jobs.items() if job.finished_at is not None][:max(0, excess)]:
+            del self._jobs[job_id]
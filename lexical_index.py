@@ -0,0 +1,398 @@
+"""
+lexical_index.py — index BM25 du corpus de chunks (recherche lexicale)
+
+Pensé pour les codes d'erreur / références produit que mpnet rate :
+la tokenisation garde les termes composés ("0x8000-12", "hsm-9000.2")
+ET leurs parties.
+
+Stockage compact (pas de liste Python par document) :
+- vocabulaire : dict terme -> id
+- postings : segments CSR numpy (indptr / doc_ids int32 / tfs uint16) ;
+  un ajout crée un petit segment, fusionnés au-delà de MAX_SEGMENTS
+- par document : longueur, pk Milvus, source, (début, fin) dans le docstore (arrays)
+- docstore : JSONL append-only sur disque (texte + métadonnées), relu à la demande
+- suppression par source : tombstones (masque) ; compactage à la sauvegarde,
+  docstore réécrit sans les lignes supprimées au-delà de DOCSTORE_GARBAGE_RATIO
+- verrou interne : /upload met l'index à jour depuis un thread d'ingestion
+  pendant que /retrieve y cherche
+
+Fichiers (paths.bm25_dir) : chaque save() publie une génération complète
+(gen-NNNNNN/ : meta.json, arrays.npz, docs.jsonl) puis bascule le pointeur
+CURRENT (os.replace) : un lecteur voit toujours des arrays, une meta et un
+docstore cohérents. La génération précédente est gardée (lecteurs pas encore
+rechargés), les plus anciennes sont supprimées.
+L'index est écrit par preprocess.py et /upload ; l'API le recharge quand
+CURRENT change (reload_if_changed).
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+from functools import wraps
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from langchain_core.documents import Document
+except Exception:
+    from langchain.schema import Document  # type: ignore
+
+INDEX_VERSION = 1
+MAX_SEGMENTS = 8
+DOCSTORE_GARBAGE_RATIO = 0.3  # part d'octets supprimés au-delà de laquelle save() réécrit docs.jsonl
+
+_TOKEN = re.compile(r"\w+(?:[-./:]\w+)*", re.UNICODE)
+_PARTS = re.compile(r"[-./:_]")
+
+
+def _locked(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def tokenize(text: str) -> List[str]:
+    """Minuscules ; termes composés conservés + leurs parties."""
+    out: List[str] = []
+    for m in _TOKEN.finditer((text or "").lower()):
+        tok = m.group()
+        out.append(tok)
+        if _PARTS.search(tok):
+            out.extend(p for p in _PARTS.split(tok) if p)
+    return out
+
+
+class _Segment:
+    """Postings CSR immuables : indptr[t]..indptr[t+1] -> (doc_ids, tfs)."""
+
+    __slots__ = ("indptr", "doc_ids", "tfs")
+
+    def __init__(self, indptr: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray):
+        self.indptr, self.doc_ids, self.tfs = indptr, doc_ids, tfs
+
+    @classmethod
+    def from_coo(cls, term_ids: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray, n_terms: int) -> "_Segment":
+        order = np.argsort(term_ids, kind="stable")
+        term_ids, doc_ids, tfs = term_ids[order], doc_ids[order], tfs[order]
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.add.at(indptr, term_ids + 1, 1)
+        return cls(np.cumsum(indptr), doc_ids.astype(np.int32), tfs.astype(np.uint16))
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        if term_id + 1 >= len(self.indptr):
+            return self.doc_ids[:0], self.tfs[:0]
+        a, b = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.doc_ids[a:b], self.tfs[a:b]
+
+    def to_coo(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        counts = np.diff(self.indptr)
+        term_ids = np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+        return term_ids, self.doc_ids, self.tfs
+
+
+class LexicalIndex:
+    """Index BM25 incrémental (ajout par lot, suppression par source)."""
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1, self.b = k1, b
+        self.vocab: Dict[str, int] = {}
+        self.sources: List[str] = []
+        self._source_ids: Dict[str, int] = {}
+        self.df = np.zeros(0, dtype=np.int32)
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.pk = np.zeros(0, dtype=np.int64)
+        self.src = np.zeros(0, dtype=np.int32)
+        self.deleted = np.zeros(0, dtype=bool)
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.ends = np.zeros(0, dtype=np.int64)
+        self.segments: List[_Segment] = []
+        self.generation = 0
+        self._docs_path: Optional[str] = None  # docstore courant (génération chargée ou en préparation)
+        self._pending: Optional[str] = None    # dossier de la prochaine génération (index neuf)
+        self._lock = threading.RLock()
+
+    # ---------- Fichiers ----------
+
+    @property
+    def _current_path(self) -> str:
+        return os.path.join(self.path, "CURRENT")
+
+    def _read_current(self) -> Optional[str]:
+        try:
+            with open(self._current_path, "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _published_generation(self) -> int:
+        name = self._read_current()
+        try:
+            return int(name[len("gen-"):]) if name else 0
+        except ValueError:
+            return 0
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        idx = cls(path)
+        name = idx._read_current()
+        if name is None:
+            return idx
+        gen_dir = os.path.join(path, name)
+        try:
+            with open(os.path.join(gen_dir, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != INDEX_VERSION:
+                raise ValueError(f"unsupported version {meta.get('version')}")
+            idx.vocab = {t: i for i, t in enumerate(meta["vocab"])}
+            idx.sources = list(meta["sources"])
+            idx._source_ids = {s: i for i, s in enumerate(idx.sources)}
+            idx.k1, idx.b = meta.get("k1", idx.k1), meta.get("b", idx.b)
+            with np.load(os.path.join(gen_dir, "arrays.npz")) as arrays:
+                for field in ("df", "doc_len", "pk", "src", "deleted", "starts", "ends"):
+                    setattr(idx, field, arrays[field])
+                idx.segments = [_Segment(arrays["indptr"], arrays["seg_doc_ids"], arrays["seg_tfs"])]
+            idx.generation = int(meta["generation"])
+            idx._docs_path = os.path.join(gen_dir, "docs.jsonl")
+        except Exception as e:
+            print(f"[BM25][WARN] cannot load lexical index from {path}: {e} — starting empty")
+            return cls(path)
+        return idx
+
+    @classmethod
+    def create(cls, path: str) -> "LexicalIndex":
+        """Index vide ; la prochaine save() remplace l'index publié (reconstruction complète)."""
+        return cls(path)
+
+    def reload_if_changed(self) -> "LexicalIndex":
+        """Renvoie un index rechargé si un autre processus a publié une génération, sinon self."""
+        name = self._read_current()
+        if name is None or name == f"gen-{self.generation:06d}":
+            return self
+        return LexicalIndex.load(self.path)
+
+    def _docstore_garbage(self) -> float:
+        """Part des octets du docstore qui ne sont plus référencés (après _compact)."""
+        try:
+            size = os.path.getsize(self._docs_path) if self._docs_path else 0
+        except OSError:
+            return 0.0
+        return 1.0 - float((self.ends - self.starts).sum()) / size if size else 0.0
+
+    def _write_docstore(self, dst: str) -> None:
+        """Réécrit le docstore sans les lignes supprimées (starts / ends renumérotés)."""
+        starts, ends = [], []
+        with open(self._docs_path, "rb") as src, open(dst + ".new", "wb") as out:
+            for a, b in zip(self.starts, self.ends):
+                src.seek(int(a))
+                starts.append(out.tell())
+                out.write(src.read(int(b - a)))
+                ends.append(out.tell())
+        os.replace(dst + ".new", dst)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+
+    @_locked
+    def save(self) -> None:
+        """
+        Compacte (un seul segment, sans tombstones ; docstore réécrit au-delà de
+        DOCSTORE_GARBAGE_RATIO) puis publie une nouvelle génération et bascule CURRENT.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self._compact()
+        seg = self.segments[0] if self.segments else _Segment(
+            np.zeros(len(self.vocab) + 1, dtype=np.int64), np.zeros(0, np.int32), np.zeros(0, np.uint16))
+
+        # numérotation continue même après create() : CURRENT change à chaque save()
+        generation = max(self.generation, self._published_generation()) + 1
+        name = f"gen-{generation:06d}"
+        tmp = self._pending or tempfile.mkdtemp(dir=self.path, prefix=".tmp-")
+        try:
+            docs_path = os.path.join(tmp, "docs.jsonl")
+            if self._docs_path and self._docstore_garbage() > DOCSTORE_GARBAGE_RATIO:
+                self._write_docstore(docs_path)
+            elif self._docs_path and self._docs_path != docs_path:
+                # append-only : la nouvelle génération partage le fichier (lien) ou le copie
+                try:
+                    os.link(self._docs_path, docs_path)
+                except OSError:
+                    shutil.copyfile(self._docs_path, docs_path)
+            elif not self._docs_path:
+                open(docs_path, "wb").close()
+
+            np.savez(os.path.join(tmp, "arrays.npz"), df=self.df, doc_len=self.doc_len, pk=self.pk, src=self.src,
+                     deleted=self.deleted, starts=self.starts, ends=self.ends,
+                     indptr=seg.indptr, seg_doc_ids=seg.doc_ids, seg_tfs=seg.tfs)
+            vocab = [None] * len(self.vocab)
+            for t, i in self.vocab.items():
+                vocab[i] = t
+            with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"version": INDEX_VERSION, "generation": generation, "k1": self.k1, "b": self.b,
+                           "vocab": vocab, "sources": self.sources}, f, ensure_ascii=False)
+            os.rename(tmp, os.path.join(self.path, name))
+        except Exception:
+            if tmp != self._pending:
+                shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        fd, ptr = tempfile.mkstemp(dir=self.path, prefix=".current-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(ptr, self._current_path)
+
+        previous = f"gen-{generation - 1:06d}"
+        self.generation, self._pending = generation, None
+        self._docs_path = os.path.join(self.path, name, "docs.jsonl")
+        for old in os.listdir(self.path):
+            if old.startswith("gen-") and old not in (name, previous):
+                shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+
+    # ---------- Mise à jour ----------
+
+    @property
+    def n_docs(self) -> int:
+        return int(len(self.doc_len) - self.deleted.sum())
+
+    @_locked
+    def add_documents(self, docs: List[Any], pks: List[Any]) -> None:
+        """Indexe des chunks déjà insérés dans Milvus (pks alignés sur docs)."""
+        if not docs:
+            return
+        base = len(self.doc_len)
+        term_ids, doc_ids, tfs, lens, srcs, starts, ends = [], [], [], [], [], [], []
+        if self._docs_path is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._pending = tempfile.mkdtemp(dir=self.path, prefix=".tmp-")
+            self._docs_path = os.path.join(self._pending, "docs.jsonl")
+        with open(self._docs_path, "ab") as f:
+            for j, d in enumerate(docs):
+                tokens = tokenize(d.page_content)
+                counts: Dict[int, int] = {}
+                for tok in tokens:
+                    tid = self.vocab.setdefault(tok, len(self.vocab))
+                    counts[tid] = counts.get(tid, 0) + 1
+                term_ids.extend(counts.keys())
+                tfs.extend(min(c, 65535) for c in counts.values())
+                doc_ids.extend([base + j] * len(counts))
+                lens.append(len(tokens))
+
+                source = (d.metadata or {}).get("source", "")
+                if source not in self._source_ids:
+                    self._source_ids[source] = len(self.sources)
+                    self.sources.append(source)
+                srcs.append(self._source_ids[source])
+
+                rec = json.dumps({"text": d.page_content, "metadata": d.metadata}, ensure_ascii=False)
+                starts.append(f.tell())
+                f.write(rec.encode("utf-8") + b"\n")
+                ends.append(f.tell())
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        self.df = np.concatenate([self.df, np.zeros(len(self.vocab) - len(self.df), dtype=np.int32)])
+        np.add.at(self.df, term_ids, 1)
+        self.doc_len = np.concatenate([self.doc_len, np.asarray(lens, dtype=np.int32)])
+        self.pk = np.concatenate([self.pk, np.asarray([int(p) for p in pks], dtype=np.int64)])
+        self.src = np.concatenate([self.src, np.asarray(srcs, dtype=np.int32)])
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(docs), dtype=bool)])
+        self.starts = np.concatenate([self.starts, np.asarray(starts, dtype=np.int64)])
+        self.ends = np.concatenate([self.ends, np.asarray(ends, dtype=np.int64)])
+        self.segments.append(_Segment.from_coo(
+            term_ids, np.asarray(doc_ids, dtype=np.int32), np.asarray(tfs, dtype=np.uint16), len(self.vocab)))
+        if len(self.segments) > MAX_SEGMENTS:
+            self._merge_segments()
+
+    @_locked
+    def delete_source(self, source: str) -> int:
+        """Tombstone de tous les chunks d'une source ; renvoie leur nombre."""
+        sid = self._source_ids.get(source)
+        if sid is None:
+            return 0
+        mask = (self.src == sid) & ~self.deleted
+        n = int(mask.sum())
+        if n:
+            rows = np.flatnonzero(mask)
+            for seg in self.segments:
+                terms, docs, _ = seg.to_coo()
+                hit = np.isin(docs, rows)
+                np.subtract.at(self.df, terms[hit], 1)
+            self.deleted |= mask
+        return n
+
+    def _merge_segments(self):
+        parts = [seg.to_coo() for seg in self.segments]
+        if not parts:
+            return
+        self.segments = [_Segment.from_coo(
+            np.concatenate([p[0] for p in parts]),
+            np.concatenate([p[1] for p in parts]),
+            np.concatenate([p[2] for p in parts]),
+            len(self.vocab),
+        )]
+
+    def _compact(self):
+        """Fusionne les segments et retire les tombstones (renumérote les docs)."""
+        self._merge_segments()
+        if not self.deleted.any():
+            return
+        keep = ~self.deleted
+        remap = np.cumsum(keep) - 1
+        if self.segments:
+            terms, docs, tfs = self.segments[0].to_coo()
+            alive = keep[docs]
+            self.segments = [_Segment.from_coo(terms[alive], remap[docs[alive]], tfs[alive], len(self.vocab))]
+        # docstore append-only : les lignes supprimées y restent jusqu'à sa réécriture (save)
+        self.starts, self.ends = self.starts[keep], self.ends[keep]
+        self.doc_len, self.pk, self.src = self.doc_len[keep], self.pk[keep], self.src[keep]
+        self.deleted = np.zeros(int(keep.sum()), dtype=bool)
+
+    # ---------- Recherche ----------
+
+    @_locked
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Renvoie [(doc_idx, score BM25)] des k meilleurs chunks."""
+        n = self.n_docs
+        terms = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not n or not terms or not self.segments:
+            return []
+        avgdl = float(self.doc_len[~self.deleted].mean()) or 1.0
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / avgdl)
+        scores = np.zeros(len(self.doc_len), dtype=np.float32)
+        for tid in terms:
+            df = int(self.df[tid])
+            if df <= 0:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for seg in self.segments:
+                docs, tfs = seg.postings(tid)
+                if len(docs):
+                    tf = tfs.astype(np.float32)
+                    np.add.at(scores, docs, idf * tf * (self.k1 + 1) / (tf + norm[docs]))
+        scores[self.deleted] = 0.0
+        k = min(k, int((scores > 0).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def get_document(self, idx: int) -> Document:
+        """Relit un chunk depuis le docstore (texte + métadonnées, pk inclus)."""
+        start, end = int(self.starts[idx]), int(self.ends[idx])
+        with open(self._docs_path, "rb") as f:
+            f.seek(start)
+            rec = json.loads(f.read(end - start).decode("utf-8"))
+        meta = dict(rec.get("metadata") or {})
+        meta.setdefault("pk", int(self.pk[idx]))
+        return Document(page_content=rec.get("text", ""), metadata=meta)
+
+    @_locked
+    def search_documents(self, query: str, k: int = 5) -> List[Document]:
+        return [self.get_document(i) for i, _ in self.search(query, k)]
@@ -0,0 +1,313 @@
+"""
+llm_workers.py — pool de processus de génération llama.cpp (hors du processus uvicorn)
+
+Sans pool (LLM_WORKERS=0), chaque slot du ChatScheduler est un ChatLlamaCpp
+chargé dans le processus FastAPI. Avec LLM_WORKERS=N :
+
+- N processus (multiprocessing, contexte "spawn"), chacun avec son modèle GGUF
+  memory-mappé (les poids sont partagés par le cache de pages de l'OS) et
+  LLM_WORKER_THREADS threads llama.cpp
+- une file de travaux commune : le premier worker libre prend le suivant ;
+  les fragments générés remontent par une file d'événements unique, relayée
+  vers la boucle asyncio par un thread lecteur
+- WorkerChain : proxy côté API avec la même interface que la chaîne de
+  génération (astream / ainvoke) -> le ChatScheduler et generator.py ne
+  changent pas, un slot = un WorkerChain
+- santé : un thread de surveillance vérifie les processus toutes les
+  LLM_WORKER_HEALTH_S secondes ; un worker mort est relancé et la requête
+  qu'il générait échoue (WorkerCrashedError) au lieu de rester pendante
+- annulation : un travail abandonné par le client (ensemble partagé
+  CancelledJobs) est arrêté au fragment suivant s'il est en cours, ou ignoré
+  par le worker qui le sort de la file s'il n'a pas encore démarré
+
+L'historique (Redis), le budget de tokens et la section Sources restent dans
+le processus API : les workers ne reçoivent que {"messages", "context"}.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import multiprocessing as mp
+import os
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+import paths
+
+
+class WorkerCrashedError(RuntimeError):
+    """Le processus de génération est mort pendant la requête."""
+
+
+class CancelledJobs:
+    """
+    Ensemble partagé (mémoire partagée, entre l'API et tous les workers) des
+    derniers travaux abandonnés : tampon circulaire de `size` ids, plus que
+    de travaux en file (CHAT_MAX_QUEUE).
+    """
+
+    def __init__(self, ctx, size: int = 1024):
+        self._ids = ctx.Array("q", size)
+        self._next = ctx.Value("q", 0, lock=False)
+
+    def add(self, job_id: int) -> None:
+        with self._ids.get_lock():
+            self._ids[self._next.value % len(self._ids)] = job_id
+            self._next.value += 1
+
+    def __contains__(self, job_id: int) -> bool:
+        with self._ids.get_lock():
+            return job_id in self._ids[:]
+
+
+# ---------- Côté worker (processus enfant) ----------
+
+def _worker_main(worker_id: int, n_threads: int, jobs, events, current, cancelled) -> None:
+    import generator  # import lourd (llama.cpp, langchain) : uniquement dans l'enfant
+
+    llm = generator.get_model(n_threads=n_threads, instance=f"worker{worker_id}")
+    chain = generator.get_chain_generator(llm)
+    events.put((worker_id, None, "ready", os.getpid()))
+    _serve(worker_id, chain.stream, jobs, events, current, cancelled)
+
+
+def _serve(worker_id: int, stream, jobs, events, current, cancelled: CancelledJobs) -> None:
+    """Boucle d'un worker : `stream(inputs)` produit les fragments d'un travail."""
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, inputs = job
+        if job_id in cancelled:
+            continue  # abandonné pendant qu'il attendait dans la file : personne ne lira la réponse
+        # mémoire partagée (et non un événement) : lisible même si le processus meurt aussitôt
+        current.value = job_id
+        try:
+            for chunk in stream(inputs):
+                if job_id in cancelled:
+                    break
+                text = chunk if isinstance(chunk, str) else getattr(chunk, "content", str(chunk))
+                if text:
+                    events.put((worker_id, job_id, "token", text))
+            events.put((worker_id, job_id, "end", None))
+        except Exception as e:
+            events.put((worker_id, job_id, "error", f"{type(e).__name__}: {e}"))
+        current.value = 0
+
+
+# ---------- Côté API ----------
+
+class _Worker:
+    def __init__(self, worker_id: int):
+        self.id = worker_id
+        self.process: Optional[mp.Process] = None
+        self.current = None   # mp.Value : travail en cours (0 = libre), écrit par le worker
+        self.pid: Optional[int] = None
+        self.ready = False
+        self.restarts = 0
+        self.jobs_done = 0
+
+
+class LLMWorkerPool:
+    """N processus llama.cpp derrière une file de travaux commune."""
+
+    def __init__(
+        self,
+        n_workers: int,
+        n_threads: int = 2,
+        health_interval_s: float = 5.0,
+        start_timeout_s: float = 300.0,
+        start_method: str = "spawn",
+        target=_worker_main,
+    ):
+        if n_workers < 1:
+            raise ValueError("LLMWorkerPool needs at least one worker.")
+        self.n_threads = max(1, int(n_threads))
+        self.health_interval_s = float(health_interval_s)
+        self.start_timeout_s = float(start_timeout_s)
+        self._ctx = mp.get_context(start_method)
+        self._target = target
+
+        self._jobs = self._ctx.Queue()
+        self._events = self._ctx.Queue()
+        self._cancelled = CancelledJobs(self._ctx)
+        self._workers = [_Worker(i) for i in range(int(n_workers))]
+        self._streams: Dict[int, tuple] = {}   # job_id -> (loop, asyncio.Queue)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    # ---------- Cycle de vie ----------
+
+    def start(self, wait: bool = True) -> "LLMWorkerPool":
+        for w in self._workers:
+            self._spawn(w)
+        self._threads = [
+            threading.Thread(target=self._read_events, name="llm-workers-events", daemon=True),
+            threading.Thread(target=self._monitor, name="llm-workers-health", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        if wait:
+            self.wait_ready(self.start_timeout_s)
+        return self
+
+    def wait_ready(self, timeout: float) -> bool:
+        """Attend que tous les workers aient chargé leur modèle."""
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            if all(w.ready for w in self._workers):
+                return True
+            time.sleep(0.05)
+        print(f"[LLM-WORKERS][WARN] {sum(not w.ready for w in self._workers)} worker(s) not ready after {timeout}s")
+        return False
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        for _ in self._workers:
+            self._jobs.put(None)
+        for w in self._workers:
+            if w.process is not None:
+                w.process.join(timeout)
+                if w.process.is_alive():
+                    w.process.terminate()
+                    w.process.join(timeout)
+        self._events.put((None, None, "stop", None))
+        for t in self._threads:
+            t.join(timeout)
+        with self._lock:
+            for job_id in list(self._streams):
+                self._publish(job_id, ("error", "LLM worker pool stopped"))
+
+    def _spawn(self, w: _Worker) -> None:
+        w.current = self._ctx.Value("q", 0)
+        w.ready = False
+        w.process = self._ctx.Process(
+            target=self._target,
+            args=(w.id, self.n_threads, self._jobs, self._events, w.current, self._cancelled),
+            name=f"llm-worker-{w.id}",
+            daemon=True,
+        )
+        w.process.start()
+
+    # ---------- Génération ----------
+
+    def chains(self) -> List["WorkerChain"]:
+        """Un proxy par worker : autant de slots pour le ChatScheduler."""
+        return [WorkerChain(self) for _ in self._workers]
+
+    async def stream(self, inputs: dict) -> AsyncIterator[str]:
+        """Envoie un travail dans la file commune et relaie les fragments générés."""
+        loop = asyncio.get_running_loop()
+        out: asyncio.Queue = asyncio.Queue()
+        job_id = next(self._ids)
+        with self._lock:
+            self._streams[job_id] = (loop, out)
+        finished = False
+        try:
+            self._jobs.put((job_id, inputs))
+            while True:
+                kind, payload = await out.get()
+                if kind == "token":
+                    yield payload
+                elif kind == "end":
+                    finished = True
+                    return
+                else:
+                    finished = True
+                    raise WorkerCrashedError(payload)
+        finally:
+            with self._lock:
+                self._streams.pop(job_id, None)
+                if not finished:
+                    # client parti : arrêté au prochain fragment, ou jamais démarré s'il est en file
+                    self._cancelled.add(job_id)
+
+    # ---------- Threads internes ----------
+
+    def _publish(self, job_id: int, item: tuple) -> None:
+        target = self._streams.get(job_id)
+        if target is not None:
+            loop, out = target
+            loop.call_soon_threadsafe(out.put_nowait, item)
+
+    def _read_events(self) -> None:
+        while True:
+            worker_id, job_id, kind, payload = self._events.get()
+            if kind == "stop":
+                return
+            w = self._workers[worker_id]
+            with self._lock:
+                if kind == "ready":
+                    w.pid, w.ready = payload, True
+                    continue
+                if kind in ("end", "error"):
+                    w.jobs_done += 1
+                self._publish(job_id, (kind, payload))
+
+    def _monitor(self) -> None:
+        while not self._stopping.wait(self.health_interval_s):
+            for w in self._workers:
+                if w.process is None or w.process.is_alive() or self._stopping.is_set():
+                    continue
+                with self._lock:
+                    print(f"[LLM-WORKERS][WARN] worker {w.id} (pid {w.pid}) exited "
+                          f"with code {w.process.exitcode}; restarting")
+                    if w.current.value:
+                        self._publish(w.current.value, ("error", f"LLM worker {w.id} crashed"))
+                    w.restarts += 1
+                    self._spawn(w)
+
+    # ---------- Santé ----------
+
+    def health(self) -> dict:
+        workers = [
+            {
+                "id": w.id,
+                "pid": w.pid,
+                "alive": w.process is not None and w.process.is_alive(),
+                "ready": w.ready,
+                "busy": bool(w.current.value),
+                "jobs": w.jobs_done,
+                "restarts": w.restarts,
+            }
+            for w in self._workers
+        ]
+        return {
+            "workers": workers,
+            "healthy": sum(w["alive"] and w["ready"] for w in workers),
+            "threads_per_worker": self.n_threads,
+        }
+
+
+class WorkerChain:
+    """Proxy de chaîne de génération (astream/ainvoke) exécutée par le pool."""
+
+    def __init__(self, pool: LLMWorkerPool):
+        self.pool = pool
+
+    async def astream(self, inputs: dict) -> AsyncIterator[str]:
+        async for text in self.pool.stream(_picklable(inputs)):
+            yield text
+
+    async def ainvoke(self, inputs: dict) -> str:
+        return "".join([t async for t in self.astream(inputs)])
+
+
+def _picklable(inputs: dict) -> dict:
+    return {"messages": list(inputs.get("messages") or []), "context": list(inputs.get("context") or [])}
+
+
+def get_worker_pool() -> Optional[LLMWorkerPool]:
+    """Pool configuré via paths (None si LLM_WORKERS=0 : génération dans le processus API)."""
+    if paths.LLM_WORKERS <= 0:
+        return None
+    return LLMWorkerPool(
+        paths.LLM_WORKERS,
+        n_threads=paths.LLM_WORKER_THREADS,
+        health_interval_s=paths.LLM_WORKER_HEALTH_S,
+        start_timeout_s=paths.LLM_WORKER_START_TIMEOUT_S,
+    ).start()
@@ -0,0 +1,354 @@
+"""
+load_test.py — test de charge de l'API (utilisateurs synthétiques concurrents)
+
+Des sessions arrivent selon un processus de Poisson (--rate sessions/s pendant
+--duration s). Chaque session enchaîne --turns actions tirées selon --mix
+(chat / retrieve / history), séparées d'un temps de réflexion exponentiel
+(--think s). Un uploader optionnel envoie --upload-file toutes les
+--upload-every s et suit le travail d'ingestion (GET /upload/{job_id}).
+
+Rapport (tableau + JSON) par endpoint : nombre de requêtes, taux d'erreur
+(statuts), latences p50/p95/p99/max, débit ; pour le chat : TTFT (--stream),
+attente d'un slot de génération (histogramme rag_chat_slot_wait_seconds de
+/metrics, différence début/fin) et profondeur de file échantillonnée.
+
+Sans modèle : lancer l'API avec LLM_FAKE=1 (fake_llm.py, débit
+LLM_FAKE_TOKENS_PER_S) pour mesurer l'ordonnanceur et la recherche seuls.
+
+    LLM_FAKE=1 LLM_FAKE_TOKENS_PER_S=30 uvicorn fast_api_app:app
+    python load_test.py --url http://localhost:8000 --rate 2 --duration 60 --out load.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+DEFAULT_QUESTIONS = [
+    "How do I reset the HSM admin PIN?",
+    "What does error 0x8000-12 mean?",
+    "Which firmware versions are supported?",
+    "How to configure the network interface?",
+    "What is the backup procedure for the keys?",
+    "How do I install the client software?",
+]
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)$')
+
+
+@dataclass
+class LoadConfig:
+    rate: float = 1.0                 # nouvelles sessions / s
+    duration: float = 30.0            # durée des arrivées (s)
+    turns: int = 3                    # actions par session
+    think_s: float = 2.0              # temps de réflexion moyen entre actions
+    mix: Dict[str, float] = field(default_factory=lambda: {"chat": 0.7, "retrieve": 0.2, "history": 0.1})
+    stream: bool = False              # /chat/stream (SSE, mesure le TTFT)
+    timeout_s: float = 180.0
+    retrieve_mode: str = "hybrid"
+    upload_file: Optional[str] = None
+    upload_every_s: float = 30.0
+    questions: List[str] = field(default_factory=lambda: list(DEFAULT_QUESTIONS))
+
+
+# ---------- Mesures ----------
+
+def latency_summary(latencies_s: List[float]) -> Dict[str, float]:
+    if not latencies_s:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0, "mean": 0.0}
+    lat = np.asarray(latencies_s, dtype=np.float64) * 1000.0
+    return {
+        "p50": round(float(np.percentile(lat, 50)), 1),
+        "p95": round(float(np.percentile(lat, 95)), 1),
+        "p99": round(float(np.percentile(lat, 99)), 1),
+        "max": round(float(lat.max()), 1),
+        "mean": round(float(lat.mean()), 1),
+    }
+
+
+def parse_prometheus(text: str) -> Dict[Tuple[str, str], float]:
+    """{(nom, labels bruts): valeur} depuis le format texte de /metrics."""
+    out = {}
+    for line in text.splitlines():
+        m = _SAMPLE.match(line.strip())
+        if m:
+            try:
+                out[(m.group(1), m.group(2) or "")] = float(m.group(3))
+            except ValueError:
+                pass
+    return out
+
+
+def bucket_quantile(buckets: List[Tuple[float, float]], q: float) -> Optional[float]:
+    """Quantile d'un histogramme cumulé [(le, count)] (interpolation, comme histogram_quantile)."""
+    buckets = sorted(buckets)
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = q * buckets[-1][1]
+    prev_le, prev_count = 0.0, 0.0
+    for le, count in buckets:
+        if count >= rank:
+            if le == float("inf"):
+                return prev_le
+            if count == prev_count:
+                return le
+            return prev_le + (le - prev_le) * (rank - prev_count) / (count - prev_count)
+        prev_le, prev_count = le, count
+    return prev_le
+
+
+def slot_wait_delta(before: Dict, after: Dict, name: str = "rag_chat_slot_wait_seconds") -> Dict[str, Optional[float]]:
+    """Attente d'un slot pendant le test : différence des compteurs de l'histogramme."""
+    count = after.get((f"{name}_count", ""), 0.0) - before.get((f"{name}_count", ""), 0.0)
+    total = after.get((f"{name}_sum", ""), 0.0) - before.get((f"{name}_sum", ""), 0.0)
+    buckets = []
+    for (metric, labels), value in after.items():
+        if metric == f"{name}_bucket":
+            le = re.search(r'le="([^"]+)"', labels).group(1)
+            buckets.append((float(le), value - before.get((metric, labels), 0.0)))
+    return {
+        "count": int(count),
+        "mean_s": round(total / count, 3) if count else None,
+        "p95_s": round(bucket_quantile(buckets, 0.95), 3) if count else None,
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[Tuple[float, int]]] = defaultdict(list)
+        self.ttft: List[float] = []
+        self.ingest: List[float] = []
+
+    def record(self, endpoint: str, latency: float, status: int) -> None:
+        self.samples[endpoint].append((latency, status))
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        out = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            statuses = defaultdict(int)
+            for _, s in samples:
+                statuses[str(s)] += 1
+            errors = sum(1 for _, s in samples if not 200 <= s < 300)
+            out[endpoint] = {
+                "count": len(samples),
+                "errors": errors,
+                "error_rate": round(errors / len(samples), 4),
+                "status": dict(statuses),
+                "throughput_rps": round(len(samples) / elapsed, 3) if elapsed else 0.0,
+                "latency_ms": latency_summary([lat for lat, s in samples if 200 <= s < 300]),
+            }
+        return out
+
+
+# ---------- Scénarios ----------
+
+async def _timed(rec: Recorder, endpoint: str, coro):
+    start = time.perf_counter()
+    try:
+        r = await coro
+        status = r.status_code
+    except httpx.HTTPError:
+        r, status = None, 0  # 0 = erreur réseau / timeout client
+    rec.record(endpoint, time.perf_counter() - start, status)
+    return r
+
+
+async def _chat_stream(client: httpx.AsyncClient, rec: Recorder, params: dict, timeout: float):
+    start = time.perf_counter()
+    status, ttft = 0, None
+    try:
+        async with client.stream("POST", "/chat/stream", params=params, timeout=timeout) as r:
+            status = r.status_code
+            async for line in r.aiter_lines():
+                if ttft is None and line.startswith("event: token"):
+                    ttft = time.perf_counter() - start
+                if line.startswith("event: error"):
+                    status = 503
+    except httpx.HTTPError:
+        status = 0
+    rec.record("/chat/stream", time.perf_counter() - start, status)
+    if ttft is not None:
+        rec.ttft.append(ttft)
+
+
+async def _session(client: httpx.AsyncClient, cfg: LoadConfig, rec: Recorder, rng: random.Random, n: int):
+    session_id = f"load-{n}-{rng.randrange(1 << 30)}"
+    actions, weights = zip(*cfg.mix.items())
+    for turn in range(cfg.turns):
+        if turn:
+            await asyncio.sleep(rng.expovariate(1.0 / cfg.think_s) if cfg.think_s > 0 else 0)
+        action = rng.choices(actions, weights)[0]
+        question = rng.choice(cfg.questions)
+        if action == "chat":
+            params = {"user_input": question, "session_id": session_id, "timeout": cfg.timeout_s}
+            if cfg.stream:
+                await _chat_stream(client, rec, params, cfg.timeout_s + 5)
+            else:
+                await _timed(rec, "/chat", client.post("/chat", params=params, timeout=cfg.timeout_s + 5))
+        elif action == "retrieve":
+            await _timed(rec, "/retrieve", client.post(
+                "/retrieve", json={"query": question, "mode": cfg.retrieve_mode}, timeout=cfg.timeout_s))
+        elif action == "history":
+            await _timed(rec, "/chat/history", client.get(
+                "/chat/history", params={"session_id": session_id}, timeout=cfg.timeout_s))
+
+
+async def _uploader(client: httpx.AsyncClient, cfg: LoadConfig, rec: Recorder, stop: asyncio.Event):
+    with open(cfg.upload_file, "rb") as f:
+        data = f.read()
+    name = cfg.upload_file.rsplit("/", 1)[-1]
+    while not stop.is_set():
+        r = await _timed(rec, "/upload", client.post(
+            "/upload", files={"files": (name, data, "application/pdf")}, timeout=cfg.timeout_s))
+        if r is not None and r.status_code == 202:
+            start, job_id = time.perf_counter(), r.json()["job_id"]
+            while True:
+                await asyncio.sleep(1.0)
+                s = await _timed(rec, "/upload/{job_id}", client.get(f"/upload/{job_id}", timeout=cfg.timeout_s))
+                if s is None or s.status_code != 200 or s.json().get("finished_at") is not None:
+                    break
+            rec.ingest.append(time.perf_counter() - start)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=cfg.upload_every_s)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _scrape(client: httpx.AsyncClient) -> Dict:
+    try:
+        r = await client.get("/metrics", timeout=10)
+        return parse_prometheus(r.text) if r.status_code == 200 else {}
+    except httpx.HTTPError:
+        return {}
+
+
+async def _sample_queue(client: httpx.AsyncClient, depths: List[float], stop: asyncio.Event, every_s: float = 1.0):
+    while not stop.is_set():
+        m = await _scrape(client)
+        if ("rag_chat_queue_depth", "") in m:
+            depths.append(m[("rag_chat_queue_depth", "")])
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=every_s)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load(client: httpx.AsyncClient, cfg: LoadConfig, seed: int = 0) -> dict:
+    """Lance le scénario sur `client` (base_url = API) et renvoie le rapport."""
+    rng = random.Random(seed)
+    rec = Recorder()
+    stop = asyncio.Event()
+    depths: List[float] = []
+    before = await _scrape(client)
+
+    background = [asyncio.create_task(_sample_queue(client, depths, stop))]
+    if cfg.upload_file:
+        background.append(asyncio.create_task(_uploader(client, cfg, rec, stop)))
+
+    start = time.perf_counter()
+    sessions, n = [], 0
+    while time.perf_counter() - start < cfg.duration:
+        sessions.append(asyncio.create_task(_session(client, cfg, rec, rng, n)))
+        n += 1
+        await asyncio.sleep(rng.expovariate(cfg.rate))
+    await asyncio.gather(*sessions)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*background)
+    after = await _scrape(client)
+
+    return {
+        "config": asdict(cfg),
+        "sessions": n,
+        "elapsed_s": round(elapsed, 2),
+        "endpoints": rec.summary(elapsed),
+        "chat": {
+            "ttft_ms": latency_summary(rec.ttft) if rec.ttft else None,
+            "slot_wait": slot_wait_delta(before, after) if after else None,
+            "queue_depth_max": max(depths) if depths else None,
+            "queue_depth_mean": round(sum(depths) / len(depths), 2) if depths else None,
+        },
+        "ingest_s": latency_summary(rec.ingest) if rec.ingest else None,
+    }
+
+
+def print_report(report: dict, out=sys.stderr) -> None:
+    print(f"{report['sessions']} sessions in {report['elapsed_s']} s", file=out)
+    print(f"{'endpoint':<18}{'count':>7}{'err %':>8}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}",
+          file=out)
+    for endpoint, s in report["endpoints"].items():
+        lat = s["latency_ms"]
+        print(f"{endpoint:<18}{s['count']:>7}{100 * s['error_rate']:>8.1f}{s['throughput_rps']:>8.2f}"
+              f"{lat['p50']:>10.0f}{lat['p95']:>10.0f}{lat['p99']:>10.0f}{lat['max']:>10.0f}", file=out)
+    chat = report["chat"]
+    if chat["slot_wait"]:
+        print(f"slot wait: mean={chat['slot_wait']['mean_s']} s p95={chat['slot_wait']['p95_s']} s "
+              f"| queue depth max={chat['queue_depth_max']} mean={chat['queue_depth_mean']}", file=out)
+    if chat["ttft_ms"]:
+        print(f"TTFT: p50={chat['ttft_ms']['p50']} ms p95={chat['ttft_ms']['p95']} ms", file=out)
+
+
+def _parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("chat", "retrieve", "history"):
+            raise argparse.ArgumentTypeError(f"unknown action '{name}' (chat, retrieve, history)")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test for the RAG API (synthetic concurrent users).")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rate", type=float, default=1.0, help="new sessions per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="arrival period in seconds")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--think", type=float, default=2.0, help="mean think time between actions (s)")
+    parser.add_argument("--mix", type=_parse_mix, default="chat=0.7,retrieve=0.2,history=0.1")
+    parser.add_argument("--stream", action="store_true", help="use /chat/stream and measure TTFT")
+    parser.add_argument("--timeout", type=float, default=180.0)
+    parser.add_argument("--mode", default="hybrid", choices=("vector", "words", "hybrid"))
+    parser.add_argument("--upload-file", help="PDF uploaded periodically during the test")
+    parser.add_argument("--upload-every", type=float, default=30.0)
+    parser.add_argument("--queries", help="JSONL with a 'question' field (e.g. the retrieval_bench set)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    cfg = LoadConfig(rate=args.rate, duration=args.duration, turns=args.turns, think_s=args.think,
+                     mix=args.mix, stream=args.stream, timeout_s=args.timeout, retrieve_mode=args.mode,
+                     upload_file=args.upload_file, upload_every_s=args.upload_every)
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            cfg.questions = [json.loads(l)["question"] for l in f if l.strip() and not l.startswith("#")]
+
+    async def _run():
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+        async with httpx.AsyncClient(base_url=args.url, limits=limits) as client:
+            return await run_load(client, cfg, seed=args.seed)
+
+    report = asyncio.run(_run())
+    print_report(report)
+    payload = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+metrics.py — métriques Prometheus de l'API (exposées sur GET /metrics)
+
+HTTP (utilisées par le dashboard Grafana monitoring/.../rag-overview.json) :
+    http_requests_total{method, endpoint, status}
+    http_request_duration_seconds{method, endpoint}
+
+Étapes du pipeline RAG :
+    rag_query_embedding_seconds            encodage des requêtes (par lot)
+    rag_vector_search_seconds{mode}        recherche Milvus / BM25 / hybride
+    rag_rerank_seconds                     cross-encoder (par requête)
+    rag_rerank_fallbacks_total             budget dépassé -> ordre de la recherche
+    rag_prompt_build_seconds               historique Redis + trim
+    rag_time_to_first_token_seconds        premier fragment llama.cpp
+    rag_generation_tokens_per_second       débit de génération
+    rag_chat_latency_seconds{outcome}      de la mise en file à la réponse
+    rag_chat_slot_wait_seconds             attente d'un slot llama.cpp (histogramme)
+    rag_chat_last_slot_wait_seconds        idem, dernière valeur (gauge)
+    rag_chat_queue_depth / rag_chat_running
+    rag_upload_chunks_embedded_total
+
+prometheus_client est optionnel : sans lui, les métriques sont des no-op
+et /metrics répond 503.
+"""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+    PROMETHEUS_AVAILABLE = True
+except ImportError:  # pragma: no cover - dépendance optionnelle
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+    class _NoopMetric:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def labels(self, *args, **kwargs):
+            return self
+
+        def observe(self, *args, **kwargs):
+            pass
+
+        def inc(self, *args, **kwargs):
+            pass
+
+        def set(self, *args, **kwargs):
+            pass
+
+        def set_function(self, *args, **kwargs):
+            pass
+
+    Counter = Gauge = Histogram = _NoopMetric  # type: ignore
+
+    def generate_latest(*args, **kwargs) -> bytes:
+        return b""
+
+
+# Étapes courtes (embedding, recherche, prompt) : de la ms à quelques secondes
+_FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Génération / chat complet sur CPU : jusqu'à plusieurs minutes
+_SLOW_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 180.0, 300.0)
+_RATE_BUCKETS = (1, 2, 4, 6, 8, 10, 15, 20, 30, 50, 100)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests", ["method", "endpoint", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "endpoint"], buckets=_SLOW_BUCKETS
+)
+
+EMBEDDING_SECONDS = Histogram(
+    "rag_query_embedding_seconds", "Query embedding time (one batch)", buckets=_FAST_BUCKETS
+)
+SEARCH_SECONDS = Histogram(
+    "rag_vector_search_seconds", "Retrieval time per query", ["mode"], buckets=_FAST_BUCKETS
+)
+RERANK_SECONDS = Histogram(
+    "rag_rerank_seconds", "Cross-encoder reranking time per query", buckets=_FAST_BUCKETS
+)
+RERANK_FALLBACKS = Counter(
+    "rag_rerank_fallbacks_total", "Reranks abandoned (time budget exceeded)"
+)
+PROMPT_BUILD_SECONDS = Histogram(
+    "rag_prompt_build_seconds", "Chat history load + trimming", buckets=_FAST_BUCKETS
+)
+TTFT_SECONDS = Histogram(
+    "rag_time_to_first_token_seconds", "Time to first generated token", buckets=_SLOW_BUCKETS
+)
+TOKENS_PER_SECOND = Histogram(
+    "rag_generation_tokens_per_second", "Generation throughput", buckets=_RATE_BUCKETS
+)
+CHAT_LATENCY = Histogram(
+    "rag_chat_latency_seconds", "Chat latency from enqueue to answer", ["outcome"], buckets=_SLOW_BUCKETS
+)
+SLOT_WAIT_SECONDS = Histogram(
+    "rag_chat_slot_wait_seconds", "Wait for a llama.cpp slot", buckets=_SLOW_BUCKETS
+)
+LAST_SLOT_WAIT = Gauge(
+    "rag_chat_last_slot_wait_seconds", "Most recent wait for a llama.cpp slot"
+)
+QUEUE_DEPTH = Gauge("rag_chat_queue_depth", "Chat requests accepted but not generating yet")
+RUNNING = Gauge("rag_chat_running", "Chat requests currently generating")
+UPLOAD_CHUNKS = Counter("rag_upload_chunks_embedded_total", "Chunks embedded by /upload")
+
+
+@contextmanager
+def timed(histogram):
+    """Observe la durée du bloc dans `histogram` (ou un enfant .labels(...))."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+def observe_generation(ttft: float | None, n_tokens: int, elapsed: float) -> None:
+    """TTFT + débit (un fragment streamé par llama.cpp ≈ un token)."""
+    if ttft is not None:
+        TTFT_SECONDS.observe(ttft)
+    gen_time = elapsed - (ttft or 0.0)
+    if n_tokens > 1 and gen_time > 0:
+        TOKENS_PER_SECOND.observe((n_tokens - 1) / gen_time)
+
+
+def track_scheduler(scheduler) -> None:
+    """Gauges lues à chaque scrape depuis l'ordonnanceur du chat."""
+    QUEUE_DEPTH.set_function(lambda: scheduler.queue_depth)
+    RUNNING.set_function(lambda: scheduler.running)
+
+
+def instrument_app(app) -> None:
+    """Middleware HTTP : compteur + latence par route (gabarit, pas l'URL brute)."""
+
+    @app.middleware("http")
+    async def _prometheus_middleware(request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUESTS.labels(request.method, endpoint, str(status)).inc()
+            HTTP_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - start)
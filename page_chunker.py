@@ -0,0 +1,149 @@
+"""
+page_chunker.py — découpage en chunks page par page (métadonnées page / titre)
+
+Remplace RecursiveCharacterTextSplitter sur le texte complet du PDF (une
+chaîne géante avec marqueurs `--- Page N ---`, re-parcourue, et des chunks qui
+perdaient leur numéro de page).
+
+Entrée : un itérable de pages (numéro 1-based, lignes, indices des lignes de
+titre) produit au fil de l'extraction ; le texte complet du document n'est
+jamais construit. Chaque chunk porte :
+
+- page_start / page_end : pages couvertes (ancre pour la visionneuse PDF)
+- heading : dernier titre rencontré avant le début du chunk ("" si aucun)
+
+Découpage : paragraphes (blocs séparés par une ligne vide, un titre ouvre un
+nouveau paragraphe), regroupés jusqu'à `chunk_size` caractères ; un paragraphe
+trop long est coupé par lignes puis par mots. Le recouvrement reprend les
+`overlap` derniers caractères du chunk précédent (paragraphes entiers, puis la
+fin du dernier paragraphe coupée à une frontière de mot), comme le
+chunk_overlap de RecursiveCharacterTextSplitter.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+Page = Tuple[int, List[str], Sequence[int]]  # (numéro, lignes, indices des titres)
+
+_SEP = "\n\n"
+
+
+@dataclass
+class _Unit:
+    text: str
+    page: int
+    heading: str
+
+
+def _split_long(text: str, size: int) -> List[str]:
+    """Coupe un paragraphe trop long : par lignes, puis par mots, puis en dur."""
+    pieces: List[str] = []
+    current = ""
+
+    def push(token: str, sep: str) -> None:
+        nonlocal current
+        if current and len(current) + len(sep) + len(token) > size:
+            pieces.append(current)
+            current = ""
+        current = f"{current}{sep}{token}" if current else token
+
+    for line in text.split("\n"):
+        if len(line) <= size:
+            push(line, "\n")
+            continue
+        for word in line.split(" "):
+            while len(word) > size:
+                push(word[:size], " ")
+                word = word[size:]
+            push(word, " ")
+    if current:
+        pieces.append(current)
+    return [p.strip() for p in pieces if p.strip()]
+
+
+def iter_units(pages: Iterable[Page], chunk_size: int) -> Iterator[_Unit]:
+    """Paragraphes (≤ chunk_size) avec leur page et le titre courant."""
+    heading = ""
+    for page_no, lines, headings in pages:
+        heading_idx = set(headings or ())
+        para: List[str] = []
+
+        def flush():
+            text = "\n".join(para).strip()
+            para.clear()
+            if not text:
+                return []
+            parts = [text] if len(text) <= chunk_size else _split_long(text, chunk_size)
+            return [_Unit(p, page_no, heading) for p in parts]
+
+        for i, line in enumerate(lines):
+            if i in heading_idx and line.strip():
+                yield from flush()
+                heading = " ".join(line.split())
+                para.append(line)
+            elif not line.strip():
+                yield from flush()
+            else:
+                para.append(line)
+        yield from flush()
+
+
+def _joined_len(units: Iterable[_Unit]) -> int:
+    n, total = 0, 0
+    for u in units:
+        total += len(u.text)
+        n += 1
+    return total + len(_SEP) * max(0, n - 1)
+
+
+def _tail(units: Sequence[_Unit], room: int) -> List[_Unit]:
+    """Fin des unités sur au plus `room` caractères, coupée à une frontière de mot."""
+    kept: List[_Unit] = []
+    for u in reversed(units):
+        if room <= 0:
+            break
+        if len(u.text) <= room:
+            kept.append(u)
+            room -= len(u.text) + len(_SEP)
+            continue
+        cut = u.text[len(u.text) - room:]
+        if not u.text[len(u.text) - room - 1].isspace():
+            space = next((i for i, c in enumerate(cut) if c.isspace()), None)
+            cut = cut[space:] if space is not None else ""
+        cut = cut.strip()
+        if cut:
+            kept.append(_Unit(cut, u.page, u.heading))
+        break
+    return kept[::-1]
+
+
+def _emit(units: Sequence[_Unit], metadata: Dict[str, Any]) -> Document:
+    pages = [u.page for u in units]
+    return Document(
+        page_content=_SEP.join(u.text for u in units),
+        metadata={**metadata, "page_start": min(pages), "page_end": max(pages), "heading": units[0].heading},
+    )
+
+
+def chunk_pages(
+    pages: Iterable[Page],
+    chunk_size: int = 1200,
+    overlap: int = 150,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Iterator[Document]:
+    """Chunks produits au fil des pages (générateur)."""
+    metadata = dict(metadata or {})
+    buf: deque = deque()
+    for unit in iter_units(pages, chunk_size):
+        if buf and _joined_len(buf) + len(_SEP) + len(unit.text) > chunk_size:
+            yield _emit(buf, metadata)
+            # recouvrement : fin du chunk émis, dans la place laissée par le suivant
+            buf = deque(_tail(buf, min(overlap, chunk_size - len(_SEP) - len(unit.text))))
+        buf.append(unit)
+    if buf:
+        yield _emit(buf, metadata)
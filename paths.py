@@ -8,15 +8,44 @@ data_path = os.path.join(base_dir, "data")
 preprocessed_data = os.path.join(base_dir, "preprocessed_data")
 upload_dir_path = os.path.join(base_dir, "uploads")
 chunks_dir_path = os.path.join(preprocessed_data, "chunks")
+# Manifeste de l'indexation incrémentale (hash, chunk ids, paramètres)
+manifest_path = os.path.join(preprocessed_data, "index_manifest.json")
+# Index lexical BM25 (lexical_index.py)
+bm25_dir = os.path.join(preprocessed_data, "bm25")
+# Signatures des chunks indexés pour la déduplication à l'ingestion (chunk_dedup.py)
+dedup_dir = os.path.join(preprocessed_data, "dedup")
+# Profil d'index / de recherche Milvus choisi par index_tuning.py (index_config.py)
+INDEX_PROFILE_PATH = os.getenv("INDEX_PROFILE_PATH", os.path.join(preprocessed_data, "index_profile.json"))
 
 # model encoder for text
 bert_model_path = os.path.join(base_dir, "models" , "all-mpnet-base-v2")
+# cross-encoder de reranking (reranker.py)
+rerank_model_path = os.getenv("RERANK_MODEL_PATH", os.path.join(base_dir, "models", "ms-marco-MiniLM-L-6-v2"))
 
 
 # Model path: Set via environment variable or default to a predefined model
 default_model = "Llama-3.2-3B-Instruct-Q5_K_L.gguf"  # Using Q5 (better quality than Q4)
 generator_model_path = os.getenv("GENERATOR_MODEL_PATH", os.path.join(base_dir, "models", default_model))
 
+# -------- LLM context / prompt budget (generator.py, prompt_budget.py) --------
+# Fenêtre llama.cpp : doit couvrir gabarit + contexte + historique + génération
+LLM_N_CTX = int(os.getenv("LLM_N_CTX", "4096"))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "512"))
+# Threads llama.cpp par modèle chargé dans le processus API
+LLM_N_THREADS = int(os.getenv("LLM_N_THREADS", "2"))
+# LLM factice déterministe (fake_llm.py) pour les tests de charge sans modèle
+LLM_FAKE = os.getenv("LLM_FAKE", "0") == "1"
+LLM_FAKE_TOKENS_PER_S = float(os.getenv("LLM_FAKE_TOKENS_PER_S", "20"))
+LLM_FAKE_TOKENS = int(os.getenv("LLM_FAKE_TOKENS", "64"))
+# Part de n_ctx réservée aux chunks récupérés ; le reste va à l'historique
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "1800"))
+# Cache d'états KV llama.cpp (prompt_cache.py) : RAM par instance + débordement disque optionnel
+# (PROMPT_CACHE_DISK_MB au total, réparti entre les instances / workers)
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "1") == "1"
+PROMPT_CACHE_RAM_MB = int(os.getenv("PROMPT_CACHE_RAM_MB", "1024"))
+PROMPT_CACHE_DISK_DIR = os.getenv("PROMPT_CACHE_DISK_DIR", "")
+PROMPT_CACHE_DISK_MB = int(os.getenv("PROMPT_CACHE_DISK_MB", "8192"))
+
 # explanation video
 exp_video = os.path.join(base_dir, "videos", "view_doc_explanation.mp4")
 
@@ -39,6 +68,135 @@ MILVUS_URI  = os.getenv("MILVUS_URI", f"http://{MILVUS_HOST}:{MILVUS_PORT}")  #
 MILVUS_COLLECTION = os.getenv("MILVUS_COLLECTION", "rag_docs")
 # Dimension des embeddings (all-mpnet-base-v2 = 768)
 EMB_DIM = 768
+# Durée (s) avant de revérifier le schéma mis en cache par schema_normalizer.py
+SCHEMA_CACHE_TTL_S = float(os.getenv("SCHEMA_CACHE_TTL_S", "300"))
+# Index vectoriel (défauts si INDEX_PROFILE_PATH n'existe pas) : HNSW, IVF_FLAT ou IVF_SQ8
+MILVUS_INDEX_TYPE = os.getenv("MILVUS_INDEX_TYPE", "HNSW").upper()
+MILVUS_HNSW_M = int(os.getenv("MILVUS_HNSW_M", "16"))
+MILVUS_HNSW_EF_CONSTRUCTION = int(os.getenv("MILVUS_HNSW_EF_CONSTRUCTION", "200"))
+MILVUS_IVF_NLIST = int(os.getenv("MILVUS_IVF_NLIST", "1024"))
+# Paramètre de recherche (ef HNSW / nprobe IVF) : "fast" pour /retrieve, "accurate" pour le chat
+MILVUS_SEARCH_FAST = int(os.getenv("MILVUS_SEARCH_FAST", "48"))
+MILVUS_SEARCH_ACCURATE = int(os.getenv("MILVUS_SEARCH_ACCURATE", "128"))
+# Plafond des surcharges par requête (/retrieve {"ef": ...})
+MILVUS_SEARCH_MAX = int(os.getenv("MILVUS_SEARCH_MAX", "1024"))
+RETRIEVE_SEARCH_PROFILE = os.getenv("RETRIEVE_SEARCH_PROFILE", "fast")
+
+
+# -------- Vector backend (retriever.load_vectorstore) --------
+# "milvus" (serveur) ou "faiss" (index en processus, faiss_store.py : mono-nœud / air-gapped)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "milvus").lower()
+FAISS_DIR = os.getenv("FAISS_DIR", os.path.join(preprocessed_data, "faiss"))
+# HNSW ou IVF_PQ (entraîné automatiquement à partir de 39·max(nlist, 2^nbits) chunks)
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "HNSW").upper()
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "1024"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "16"))  # sous-quantificateurs (EMB_DIM doit être divisible)
+FAISS_PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+# Index memory-mapped au chargement (démarrage à froid rapide)
+FAISS_MMAP = os.getenv("FAISS_MMAP", "1") == "1"
+
+
+# -------- Chat scheduler config --------
+# Nombre de contextes llama.cpp chargés en parallèle (1 slot = 1 génération à la fois)
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", "1"))
+# Nombre max de requêtes regroupées pour une recherche (retrieval) commune
+CHAT_MAX_BATCH = int(os.getenv("CHAT_MAX_BATCH", "4"))
+# Fenêtre d'attente (ms) pour compléter un lot avant de lancer la recherche
+CHAT_BATCH_WINDOW_MS = int(os.getenv("CHAT_BATCH_WINDOW_MS", "20"))
+# Nombre max de requêtes en attente ou en cours ; au-delà /chat répond 429
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "32"))
+# Délai max (s) d'une requête /chat avant réponse 503
+CHAT_TIMEOUT_S = float(os.getenv("CHAT_TIMEOUT_S", "180"))
+
+
+# -------- LLM worker pool (llm_workers.py) --------
+# Processus de génération dédiés (0 = modèles dans le processus API, CHAT_CONCURRENCY slots)
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "0"))
+# Threads llama.cpp par worker (viser LLM_WORKERS * LLM_WORKER_THREADS ≈ nb de cœurs)
+LLM_WORKER_THREADS = int(os.getenv("LLM_WORKER_THREADS", "2"))
+# Intervalle (s) de vérification des processus ; un worker mort est relancé
+LLM_WORKER_HEALTH_S = float(os.getenv("LLM_WORKER_HEALTH_S", "5"))
+# Délai max (s) de chargement des modèles au démarrage du pool
+LLM_WORKER_START_TIMEOUT_S = float(os.getenv("LLM_WORKER_START_TIMEOUT_S", "300"))
+
+
+# -------- Upload ingestion (ingest_jobs.py) --------
+# Threads d'ingestion en tâche de fond (1 = fichiers traités l'un après l'autre)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+# Nombre de travaux gardés en mémoire pour GET /upload/{job_id}
+INGEST_MAX_JOBS = int(os.getenv("INGEST_MAX_JOBS", "200"))
+
+
+# -------- Chat history (Redis) --------
+# Nombre de derniers messages lus pour construire le prompt
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+# Nombre max de messages conservés par session (0 = illimité) ; au-delà, LTRIM
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "0"))
+# Résumé (extractif) des tours retirés, réinjecté dans le prompt système
+CHAT_HISTORY_SUMMARY = os.getenv("CHAT_HISTORY_SUMMARY", "0") == "1"
+# TTL glissant des sessions en secondes (0 = pas d'expiration)
+CHAT_HISTORY_TTL_S = int(os.getenv("CHAT_HISTORY_TTL_S", "0"))
+
+
+# -------- Dashboard metrics (Redis, dashboard_metrics.py) --------
+# Durée de conservation des agrégats journaliers (histogrammes de latence)
+DASHBOARD_RETENTION_DAYS = int(os.getenv("DASHBOARD_RETENTION_DAYS", "400"))
+
+
+# -------- Semantic answer cache (Redis) --------
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+# Similarité cosinus minimale entre questions pour réutiliser une réponse
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_S = int(os.getenv("ANSWER_CACHE_TTL_S", str(24 * 3600)))
+# Nombre max d'entrées ; au-delà, éviction des moins récemment utilisées
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+
+
+# -------- Query embedding cache --------
+# Taille du LRU en mémoire (nombre de requêtes)
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "2048"))
+# Second niveau Redis (vecteurs float32), partagé entre processus
+EMBED_CACHE_REDIS = os.getenv("EMBED_CACHE_REDIS", "1") == "1"
+EMBED_CACHE_TTL_S = int(os.getenv("EMBED_CACHE_TTL_S", str(7 * 24 * 3600)))
+
+
+# -------- Embedding engine (ingestion) --------
+# Backend CPU : "torch" (fp32), "int8" (quantization dynamique) ou "onnx"
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Taille des paquets d'insertion Milvus (borne la mémoire crête à l'ingestion)
+MILVUS_INSERT_BATCH = int(os.getenv("MILVUS_INSERT_BATCH", "512"))
+
+
+# -------- Ingest dedup (chunk_dedup.py) --------
+# "near" (identiques + quasi identiques), "exact" (identiques seulement) ou "off"
+DEDUP_MODE = os.getenv("DEDUP_MODE", "near")
+# Distance de Hamming max entre SimHash 64 bits pour un quasi-doublon
+DEDUP_MAX_HAMMING = int(os.getenv("DEDUP_MAX_HAMMING", "6"))
+# En dessous (mots), un chunk n'est comparé qu'à l'identique
+DEDUP_MIN_WORDS = int(os.getenv("DEDUP_MIN_WORDS", "20"))
+
+
+# -------- Hybrid retrieval (BM25 + vecteurs) --------
+# Mode de recherche du chat : "vector", "words" ou "hybrid"
+CHAT_RETRIEVAL_MODE = os.getenv("CHAT_RETRIEVAL_MODE", "vector")
+# Candidats récupérés par chaque moteur avant fusion RRF
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+# Constante k de la Reciprocal Rank Fusion (1 / (k + rang))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+
+# -------- Cross-encoder reranking --------
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+# Candidats rescorés pour le contexte du chat (les k meilleurs sont gardés)
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "10"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+# Au-delà de ce budget (ms) par requête, on garde l'ordre de la recherche
+RERANK_BUDGET_MS = int(os.getenv("RERANK_BUDGET_MS", "300"))
+# Nombre max de scores (requête, chunk) en cache
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
 
 
 # streamlit run streamlit_app.py --browser.serverAddress localhost
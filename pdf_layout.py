@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+pdf_layout.py — extraction du texte des PDF avec mise en page (PyMuPDF)
+
+Extrait de preprocess.py (extract_text_with_layout et ses helpers), avec :
+
+- une seule analyse par page : `page.get_text("dict")` sert à la fois au
+  texte, aux titres et à la détection des pages à ignorer (TOC / history),
+  au lieu d'un `get_text("text")` puis d'un `get_text("dict")`
+- sans TEXT_PRESERVE_IMAGES : les blocs image (et leurs octets) ne sont plus
+  décodés
+- lignes construites par `"".join(parts)` au lieu de `+=` répétés
+
+Deux modes (EXTRACT_MODE) :
+
+- "layout" (défaut) : tri des blocs / lignes / spans en Python et espaces
+  proportionnels aux écarts entre spans — même texte qu'avant
+- "fast" : ordre de lecture natif de PyMuPDF (`sort=True`), spans concaténés
+  tels quels ; plus rapide, les alignements en colonnes ne sont pas rendus
+
+Mesure : `python extract_bench.py` (pages/s, ancienne extraction vs modes).
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Dépendance requise : pip install "pymupdf>=1.24.0"
+import fitz  # PyMuPDF
+
+EXTRACT_MODE = os.getenv("EXTRACT_MODE", "layout")
+EXTRACT_MODES = ("layout", "fast")
+
+# dict sans les images : le texte et les polices suffisent
+_DICT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+_SKIP_HEAD_CHARS = 500
+
+
+def load_doc(filepath: str):
+    """Ouvre le PDF avec PyMuPDF; renvoie l'objet doc ou None en cas d'échec."""
+    try:
+        return fitz.open(filepath)
+    except Exception as e:
+        print(f"[PDF][FAIL] cannot open {filepath}: {e}")
+        return None
+
+def is_skippable_page(plain_txt: str) -> bool:
+    """
+    Heuristique CONSERVATRICE pour ignorer Table of Contents / Revision History.
+    - On regarde uniquement le DÉBUT de la page (500 premiers caractères).
+    - On cherche des entêtes explicites ; PAS de tests '....' ni du substring 'toc'.
+    """
+    if not plain_txt:
+        return False
+    head = plain_txt.strip()[:_SKIP_HEAD_CHARS].lower()
+    headings = (
+        "table of contents",
+        "sommaire",
+        "table des matières",
+        "revision history",
+        "historique des révisions",
+        "change log",
+        "document history",
+    )
+    return any(h in head for h in headings)
+
+def strip_sections(text: str) -> str:
+    """Nettoyage léger optionnel des sections; ici on garde simple."""
+    return text.strip()
+
+_HEADING_SIZE_RATIO = 1.2  # taille de police >= 1.2 × corps de texte
+_HEADING_MAX_CHARS = 120
+
+def _is_heading(text: str, size: float, bold: bool, block_lines: int, body_size: float) -> bool:
+    """Ligne de titre : police nettement plus grande que le corps, ou ligne courte en gras isolée."""
+    text = text.strip()
+    if not text or len(text) > _HEADING_MAX_CHARS or not any(c.isalpha() for c in text):
+        return False
+    if body_size and size >= body_size * _HEADING_SIZE_RATIO:
+        return True
+    return bold and block_lines <= 2 and len(text) <= 80 and not text.endswith((".", ":", ";", ","))
+
+def _head_text(blocks) -> str:
+    """Début du texte de la page dans l'ordre du flux (= get_text("text")), pour is_skippable_page."""
+    parts, n = [], 0
+    for block in blocks:
+        for line in block.get("lines", ()):
+            text = "".join(span["text"] for span in line["spans"])
+            parts.append(text)
+            n += len(text) + 1
+            if n > 2 * _SKIP_HEAD_CHARS:  # marge pour les blancs retirés par strip()
+                return "\n".join(parts)
+    return "\n".join(parts)
+
+def _top(item) -> float:
+    return item["bbox"][1]
+
+def _left(item) -> float:
+    return item["bbox"][0]
+
+def _layout_line(spans, space_multiplier: float) -> str:
+    """Spans triés de gauche à droite, séparés par des espaces proportionnels à l'écart."""
+    parts = []
+    cursor_x = None
+    for span in sorted(spans, key=_left):
+        x0, _, x1, _ = span['bbox']
+        if cursor_x is not None:
+            gap = x0 - cursor_x
+            parts.append(' ' * max(1, int(gap // (span['size'] * space_multiplier))))
+        parts.append(span['text'])
+        cursor_x = x1
+    return "".join(parts).rstrip()
+
+def page_lines(page, space_multiplier=0.5, mode: Optional[str] = None):
+    """
+    Lignes (avec mise en page rudimentaire) d'une page et indices des lignes de
+    titre : (lines, headings). Renvoie None si la page est à ignorer (TOC / history).
+    """
+    mode = mode or EXTRACT_MODE
+    if mode not in EXTRACT_MODES:
+        raise ValueError(f"Unknown EXTRACT_MODE '{mode}' (expected one of {EXTRACT_MODES}).")
+    fast = mode == "fast"
+
+    blocks = page.get_text("dict", flags=_DICT_FLAGS, sort=fast).get("blocks", [])
+
+    #   decide early whether we keep this page (same parse, stream order)
+    if is_skippable_page(_head_text(blocks)):
+        print(f"Skipping page {page.number + 1} (TOC / history)")
+        return None
+
+    # (text, taille max, tout en gras, nb de lignes du bloc) ; None = fin de bloc
+    rows = []
+    size_chars: Dict[float, int] = defaultdict(int)
+
+    # text blocks, top-to-bottom (déjà triés par PyMuPDF en mode fast)
+    for block in (blocks if fast else sorted(blocks, key=_top)):
+        lines = block.get("lines", [])
+        for line in (lines if fast else sorted(lines, key=_top)):
+            spans = line.get("spans", [])
+            if fast:
+                line_text = "".join(span['text'] for span in spans).rstrip()
+            else:
+                line_text = _layout_line(spans, space_multiplier)
+            size, bold = 0.0, True
+            for span in spans:
+                txt = span['text']
+                if txt.strip():
+                    size = max(size, span['size'])
+                    bold = bold and bool(span['flags'] & 16)
+                    size_chars[round(span['size'] * 2) / 2] += len(txt)
+            rows.append((line_text, size, bold and size > 0, len(lines)))
+        # blank line after block
+        rows.append(None)
+
+    body_size = max(size_chars, key=size_chars.get) if size_chars else 0.0
+    full_lines, headings = [], []
+    for row in rows:
+        if row is None:
+            full_lines.append("")
+            continue
+        text, size, bold, block_lines = row
+        if _is_heading(text, size, bold, block_lines, body_size):
+            headings.append(len(full_lines))
+        full_lines.append(text)
+    return full_lines, headings
+
+def page_marker(page_no: int) -> str:
+    # page delimiter (only for retained pages)
+    return f"--- Page {page_no} ---"
+
+def join_lines(full_lines: List[str]) -> str:
+    # join lines & collapse 3+ newlines to 2
+    text = "\n".join(full_lines)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return strip_sections(text)
+
+def iter_pages(doc, space_multiplier=0.5, on_page=None, mode: Optional[str] = None) -> Iterator[Tuple[int, List[str], List[int]]]:
+    """
+    Pages retenues d'un document ouvert, une à une : (numéro 1-based, lignes,
+    indices des titres). `on_page(done, total)` est appelé après chaque page.
+    """
+    for pno in range(doc.page_count):
+        res = page_lines(doc.load_page(pno), space_multiplier, mode)
+        if res is not None:
+            yield (pno + 1, *res)
+        if on_page is not None:
+            on_page(pno + 1, doc.page_count)
+
+def extract_text_with_layout(
+    filepath,
+    images_dir="images",
+    space_multiplier=0.5,
+    on_page=None,
+):
+    """
+    Extract text with rudimentary layout, skipping TOC/History pages.
+    `on_page(done, total)` est appelé après chaque page (progression /upload).
+    """
+    doc = load_doc(filepath)
+    if doc is None:
+        return ""
+
+    meta = doc.metadata
+
+    os.makedirs(images_dir, exist_ok=True)
+    full_lines = []
+
+    for page_no, lines, _ in iter_pages(doc, space_multiplier, on_page):
+        full_lines.append(page_marker(page_no))
+        full_lines.extend(lines)
+
+    doc.close()
+    return join_lines(full_lines), meta
@@ -2,16 +2,25 @@
 """
 preprocess.py — ingestion RAG avec Milvus (ta fonction d'extraction + skip TOC conservateur)
 
-- TA fonction extract_text_with_layout est intégrée telle quelle (PyMuPDF)
+- TA fonction extract_text_with_layout (PyMuPDF), déplacée dans pdf_layout.py : une analyse par page, mode "fast" optionnel
 - is_skippable_page : heuristique CONSERVATRICE (ne skippe que si en-tête explicite)
 - get_text() renvoie toujours (text, meta)
-- chunking: 1200/150
+- extraction parallèle (pool de processus, plages de pages) + chunks streamés
+  vers l'embedding fichier par fichier
+- chunking: 1200/150, page par page (page_chunker.py : page_start / page_end / heading)
+- embedding par lots triés par longueur + insert Milvus par paquets (embedding_engine.py)
 - normalisation des métadonnées (title/source toujours présents, tout en str)
 - insertion Milvus par fichier (continue si un PDF échoue)
 
+- manifeste (index_manifest.py) : hash des fichiers + chunk ids Milvus,
+  pour une ré-indexation incrémentale (commande `sync`)
+- index BM25 (lexical_index.py, paths.bm25_dir) tenu à jour avec Milvus,
+  pour les recherches "words" / "hybrid"
+
 CLI:
     python preprocess.py preprocess   # indexe tout 'data/'
     python preprocess.py add_doc      # ingère les nouveaux PDFs depuis 'uploads/'
+    python preprocess.py sync         # ré-indexe seulement les PDF ajoutés/modifiés/supprimés
 """
 
 from __future__ import annotations
@@ -21,8 +30,9 @@ import re
 import sys
 import pickle
 import shutil
-from typing import List, Tuple, Dict, Any
-from collections import defaultdict
+from typing import List, Tuple, Dict, Any, Iterator
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 
 # ---- LangChain
 try:
@@ -30,8 +40,6 @@ try:
 except Exception:
     from langchain.schema import Document  # type: ignore
 
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 # ---- Milvus
 from pymilvus import utility, Collection
@@ -40,8 +48,14 @@ from pymilvus.exceptions import MilvusException, DataNotMatchException
 # ---- Modules locaux
 import paths
 import retriever
+import page_chunker
+import schema_normalizer
+from chunk_dedup import DedupIndex
+from index_config import get_profile
+from index_manifest import IndexManifest
+from lexical_index import LexicalIndex
+from embedding_engine import get_engine
 
-from pymilvus import Collection, DataType
 from langchain_milvus import Milvus as LCMilvus  
 
 
@@ -49,107 +63,25 @@ from langchain_milvus import Milvus as LCMilvus
 # TA FONCTION D'EXTRACTION (ET HELPERS)
 # =========================
 
-# Dépendance requise : pip install "pymupdf>=1.24.0"
-import fitz  # PyMuPDF
-
-def load_doc(filepath: str):
-    """Ouvre le PDF avec PyMuPDF; renvoie l'objet doc ou None en cas d'échec."""
-    try:
-        return fitz.open(filepath)
-    except Exception as e:
-        print(f"[PDF][FAIL] cannot open {filepath}: {e}")
-        return None
-
-def is_skippable_page(plain_txt: str) -> bool:
-    """
-    Heuristique CONSERVATRICE pour ignorer Table of Contents / Revision History.
-    - On regarde uniquement le DÉBUT de la page (500 premiers caractères).
-    - On cherche des entêtes explicites ; PAS de tests '....' ni du substring 'toc'.
-    """
-    if not plain_txt:
-        return False
-    head = plain_txt.strip()[:500].lower()
-    headings = (
-        "table of contents",
-        "sommaire",
-        "table des matières",
-        "revision history",
-        "historique des révisions",
-        "change log",
-        "document history",
-    )
-    return any(h in head for h in headings)
-
-def strip_sections(text: str) -> str:
-    """Nettoyage léger optionnel des sections; ici on garde simple."""
-    return text.strip()
-
-def extract_text_with_layout(
-    filepath,
-    images_dir="images",
-    space_multiplier=0.5,
-):
-    """Extract text with rudimentary layout, skipping TOC/History pages."""
-    doc = load_doc(filepath)
-    if doc is None:
-        return ""
-
-    meta = doc.metadata
-
-    os.makedirs(images_dir, exist_ok=True)
-    full_lines = []
-
-    for pno in range(doc.page_count):
-        page = doc.load_page(pno)
-
-        #   decide early whether we keep this page
-        plain_txt = page.get_text("text")
-        if is_skippable_page(plain_txt):
-            print(f"Skipping page {pno + 1} (TOC / history)")
-            continue  # jump to next page
-
-        # page delimiter (only for retained pages)
-        full_lines.append(f"--- Page {pno + 1} ---")
-
-        page_dict = page.get_text("dict")
-
-        # text blocks, top-to-bottom
-        blocks = sorted(page_dict.get("blocks", []), key=lambda b: b['bbox'][1])
-        for block in blocks:
-            # process lines within block
-            lines = sorted(block.get("lines", []), key=lambda l: l['bbox'][1])
-            for line in lines:
-                spans = sorted(line.get("spans", []), key=lambda s: s['bbox'][0])
-                line_text = ""
-                cursor_x = None
-                for span in spans:
-                    x0, _, x1, _ = span['bbox']
-                    txt = span.get('text', '')
-                    if cursor_x is not None:
-                        gap = x0 - cursor_x
-                        n_spaces = max(1, int(gap // (span['size'] * space_multiplier)))
-                        line_text += ' ' * n_spaces
-                    line_text += txt
-                    cursor_x = x1
-                full_lines.append(line_text.rstrip())
-            # blank line after block
-            full_lines.append("")
-
-    doc.close()
-
-    # join lines & collapse 3+ newlines to 2
-    text = "\n".join(full_lines)
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    return strip_sections(text), meta
-
-def get_text(path: str) -> Tuple[str, Dict[str, Any]]:
+# Extraction PyMuPDF (une analyse par page, modes "layout" / "fast") : pdf_layout.py
+from pdf_layout import (
+    load_doc,
+    is_skippable_page,
+    strip_sections,
+    extract_text_with_layout,
+    iter_pages,
+    page_lines,
+    EXTRACT_MODE,
+)
+
+def get_text(path: str, on_page=None) -> Tuple[str, Dict[str, Any]]:
     """
     Utilise TA fonction ci-dessus.
     Elle peut dans un cas retourner juste "" (string) si doc=None ; on enveloppe pour
     toujours renvoyer (text, meta: dict).
     """
     try:
-        res = extract_text_with_layout(path)
+        res = extract_text_with_layout(path, on_page=on_page)
         if isinstance(res, tuple):
             text, meta = res
             return text or "", (meta or {})
@@ -166,6 +98,10 @@ def get_text(path: str) -> Tuple[str, Dict[str, Any]]:
 CHUNK_SIZE = 1200
 CHUNK_OVERLAP = 150
 
+# Extraction parallèle : nb de processus et taille des unités de travail (pages)
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "16"))
+
 def get_all_files() -> List[str]:
     """Liste tous les PDF du corpus 'data/'."""
     base = getattr(paths, "data_path", "data")
@@ -183,28 +119,178 @@ def sanitize_filename(name: str) -> str:
     return re.sub(r"[^A-Za-z0-9._-]+", "_", name)
 
 # =========================
-# Chunking
+# Extraction parallèle (pool de processus, unités = plages de pages)
 # =========================
 
-def get_chunks(chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Document]:
-    """Découpe tous les PDF du corpus en chunks Document(page_content, metadata)."""
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
-    docs: List[Document] = []
-    files = get_all_files()
-
+def _extract_page_range(filepath: str, start: int, end: int, space_multiplier: float = 0.5) -> List[Tuple[int, List[str], List[int]]]:
+    """Worker : pages [start, end) d'un PDF, (numéro, lignes, titres) (pages ignorées omises)."""
+    doc = load_doc(filepath)
+    if doc is None:
+        raise RuntimeError(f"cannot open {filepath}")
+    try:
+        pages = []
+        for pno in range(start, end):
+            res = page_lines(doc.load_page(pno), space_multiplier)
+            if res is not None:
+                pages.append((pno + 1, *res))
+        return pages
+    finally:
+        doc.close()
+
+def _plan_extraction(files: List[str], pages_per_task: int):
+    """Découpe chaque PDF en plages de pages ; renvoie [(fpath, meta, [(start, end), ...])]."""
+    plan = []
     for fpath in files:
-        text, meta = get_text(fpath)
-        if not text:
+        doc = load_doc(fpath)
+        if doc is None:
+            plan.append((fpath, {}, []))
+            continue
+        n, meta = doc.page_count, (doc.metadata or {})
+        doc.close()
+        ranges = [(s, min(s + pages_per_task, n)) for s in range(0, n, pages_per_task)]
+        plan.append((fpath, meta, ranges))
+    return plan
+
+def _local_pages(fpath: str):
+    """Pages d'un PDF extraites dans le processus courant (générateur)."""
+    doc = load_doc(fpath)
+    if doc is None:
+        raise RuntimeError(f"cannot open {fpath}")
+    try:
+        yield from iter_pages(doc)
+    finally:
+        doc.close()
+
+def _pooled_pages(fpath: str, ranges, inflight: deque, fill):
+    """
+    Pages d'un PDF à mesure que ses plages reviennent du pool, dans l'ordre.
+    Toutes les plages sont consommées même après un échec (la file reste
+    alignée sur le plan) ; l'échec est levé à la fin.
+    """
+    error = None if ranges else RuntimeError(f"cannot open {fpath}")
+    for _ in ranges:
+        fut = inflight.popleft()
+        fill()
+        try:
+            pages = fut.result()
+        except Exception as e:
+            error = error or e
+            continue
+        if error is None:
+            yield from pages
+    if error is not None:
+        raise RuntimeError(f"{fpath}: {error}")
+
+def iter_page_streams(
+    files: List[str],
+    workers: int = EXTRACT_WORKERS,
+    pages_per_task: int = PAGES_PER_TASK,
+) -> Iterator[Tuple[str, Dict[str, Any], Iterator[Tuple[int, List[str], List[int]]]]]:
+    """
+    Produit (fpath, meta, pages) dans l'ordre de `files`, `pages` étant un
+    générateur de (numéro, lignes, titres) : le texte complet d'un fichier n'est
+    jamais assemblé. Les gros PDF sont répartis en unités de PAGES_PER_TASK pages
+    (pool de processus, avance de 2 × workers unités : l'extraction continue
+    pendant que l'appelant chunke / embedde). Un générateur non consommé par
+    l'appelant est vidé avant de passer au fichier suivant.
+    """
+    if workers <= 1 or not files:
+        for fpath in files:
+            doc = load_doc(fpath)
+            meta = (doc.metadata or {}) if doc is not None else {}
+            if doc is not None:
+                doc.close()
+            yield fpath, meta, _local_pages(fpath)
+        return
+
+    plan = _plan_extraction(files, max(1, pages_per_task))
+    tasks = iter([(fpath, s, e) for fpath, _, ranges in plan for s, e in ranges])
+    window = 2 * workers
+    inflight: deque = deque()
+
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        def _fill():
+            while len(inflight) < window:
+                t = next(tasks, None)
+                if t is None:
+                    return
+                inflight.append(ex.submit(_extract_page_range, *t))
+
+        _fill()
+        for fpath, meta, ranges in plan:
+            pages = _pooled_pages(fpath, ranges, inflight, _fill)
+            yield fpath, meta, pages
+            try:
+                for _ in pages:
+                    pass
+            except Exception:
+                pass
+
+def _make_document(text: str, meta: Dict[str, Any], source: str) -> Document:
+    """Document 'fichier entier' avec métadonnées nettoyées (str, source/title garantis)."""
+    meta_clean = {k: v for k, v in (meta or {}).items() if v is not None}
+    meta_clean = {str(k): str(v) for k, v in meta_clean.items()}
+    meta_clean["source"] = os.path.abspath(source)
+    if not meta_clean.get("title"):
+        meta_clean["title"] = os.path.splitext(os.path.basename(source))[0]
+    return Document(page_content=text, metadata=meta_clean)
+
+def _chunk_file(pages, meta: Dict[str, Any], source: str, chunk_size: int, overlap: int) -> List[Document]:
+    """Chunks d'un fichier (page_start / page_end / heading sur chaque chunk)."""
+    base = _make_document("", meta, source).metadata
+    return list(page_chunker.chunk_pages(pages, chunk_size=chunk_size, overlap=overlap, metadata=base))
+
+def iter_chunks(
+    files: List[str],
+    chunk_size: int = CHUNK_SIZE,
+    overlap: int = CHUNK_OVERLAP,
+    source_for=None,
+) -> Iterator[List[Document]]:
+    """
+    Produit les chunks fichier par fichier, page par page au fil de l'extraction
+    parallèle. `source_for(fpath)` permet de réécrire la source (ex. uploads/ -> data/).
+    Un fichier dont l'extraction échoue en cours de route est ignoré en entier.
+    """
+    for fpath, meta, pages in iter_page_streams(files):
+        source = source_for(fpath) if source_for else fpath
+        try:
+            splits = _chunk_file(pages, meta, source, chunk_size, overlap)
+        except Exception as e:
+            print(f"[EXTRACT][FAIL] {e}")
+            continue
+        if not splits:
             print(f"[READ][SKIP] empty text: {fpath}")
             continue
-        meta_clean = {k: v for k, v in (meta or {}).items() if v is not None}
-        meta_clean = {str(k): str(v) for k, v in meta_clean.items()}
-        meta_clean["source"] = os.path.abspath(fpath)
-        if not meta_clean.get("title"):
-            meta_clean["title"] = os.path.splitext(os.path.basename(fpath))[0]
-        docs.append(Document(page_content=text, metadata=meta_clean))
+        yield splits
+
+def get_page_chunks(
+    path: str,
+    source: str | None = None,
+    on_page=None,
+    chunk_size: int = CHUNK_SIZE,
+    overlap: int = CHUNK_OVERLAP,
+) -> List[Document]:
+    """Chunks d'un seul PDF (ingestion /upload) ; [] si illisible ou vide."""
+    doc = load_doc(path)
+    if doc is None:
+        return []
+    try:
+        return _chunk_file(iter_pages(doc, on_page=on_page), doc.metadata or {}, source or path, chunk_size, overlap)
+    except Exception as e:
+        print(f"[EXTRACT][FAIL] {path}: {e}")
+        return []
+    finally:
+        doc.close()
 
-    all_splits = text_splitter.split_documents(docs)
+# =========================
+# Chunking
+# =========================
+
+def get_chunks(chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Document]:
+    """Découpe tous les PDF du corpus en chunks Document(page_content, metadata)."""
+    all_splits: List[Document] = []
+    for splits in iter_chunks(get_all_files(), chunk_size=chunk_size, overlap=overlap):
+        all_splits.extend(splits)
 
     # Sauvegarde pickle (debug)
     directory_path = getattr(paths, "chunks_dir_path", os.path.join("preprocessed", "chunks"))
@@ -261,84 +347,86 @@ def _group_by_source(docs: List[Document]) -> Dict[str, List[Document]]:
 
 
 
-def _normalize_docs_for_collection(vectorstore, collection_name, docs):
+def persist_vectorstore(vectorstore) -> None:
+    """Backends en processus (faiss_store) : écrit l'index avant le manifeste ; Milvus : rien à faire."""
+    persist = getattr(vectorstore, "persist", None)
+    if callable(persist):
+        persist()
+
+def _insert_docs(vectorstore, docs: List[Document]) -> List:
+    """Insertion par paquets via l'EmbeddingEngine du vectorstore (sinon add_documents)."""
+    engine = getattr(vectorstore, "embeddings", None)
+    if hasattr(engine, "insert_documents"):
+        return engine.insert_documents(vectorstore, docs)
+    return vectorstore.add_documents(docs)
+
+def _add_lexical(lexical, docs: List[Document], ids: List) -> None:
+    """Indexe dans BM25 les chunks insérés (pks Milvus alignés sur docs)."""
+    if lexical is None:
+        return
+    if len(ids or []) != len(docs):
+        print(f"[BM25][WARN] {len(docs)} chunks but {len(ids or [])} ids — not indexed lexically")
+        return
+    lexical.add_documents(docs, ids)
+
+def load_dedup_index(lexical: LexicalIndex | None = None, fresh: bool = False) -> DedupIndex | None:
     """
-    Aligne docs.metadata sur le schéma EXISTANT de la collection Milvus :
-    - garde UNIQUEMENT les champs déjà présents dans la collection
-    - remplit les champs manquants avec une valeur par défaut selon dtype
+    Index de signatures pour la déduplication à l'ingestion (None si DEDUP_MODE=off).
+    Absent ou vide : amorcé avec les chunks déjà indexés (docstore BM25).
     """
-    col = Collection(collection_name)
-    # text/vector fields tels que déclarés dans ton vectorstore LangChain
-    text_field = getattr(vectorstore, "text_field", "text")
-    vector_field = getattr(vectorstore, "vector_field", "vector")
-    ignore = {text_field, vector_field, "id", "pk"}
-
-    # map nom_de_champ -> dtype
-    schema_map = {f.name: f.dtype for f in col.schema.fields}
-    required = [name for name in schema_map.keys() if name not in ignore]
-
-    def default_for(dtype):
-        if dtype == DataType.VARCHAR:
-            return ""
-        if dtype in (DataType.INT8, DataType.INT16, DataType.INT32, DataType.INT64):
-            return 0
-        if dtype in (DataType.FLOAT, DataType.DOUBLE):
-            return 0.0
-        if dtype == DataType.BOOL:
-            return False
-        if dtype == DataType.JSON:
-            return {}
-        return ""
-
-    def cast_to_dtype(val, dtype):
-        try:
-            if dtype == DataType.VARCHAR:
-                return "" if val is None else str(val)
-            if dtype in (DataType.INT8, DataType.INT16, DataType.INT32, DataType.INT64):
-                return 0 if val in (None, "") else int(val)
-            if dtype in (DataType.FLOAT, DataType.DOUBLE):
-                return 0.0 if val in (None, "") else float(val)
-            if dtype == DataType.BOOL:
-                if isinstance(val, str):
-                    return val.strip().lower() in ("true", "1", "yes", "y", "t")
-                return bool(val)
-            if dtype == DataType.JSON:
-                return val if isinstance(val, (dict, list)) else {}
-        except Exception:
-            return default_for(dtype)
-        return val
-
-    norm = []
-    for d in docs:
-        md = d.metadata or {}
-        new_md = {}
-        for name in required:
-            dtype = schema_map[name]
-            if name in md:
-                new_md[name] = cast_to_dtype(md.get(name), dtype)
-            else:
-                new_md[name] = default_for(dtype)
-        d.metadata = new_md
-        norm.append(d)
-    return norm
-
-
-def _safe_add_per_source(vectorstore, splits: List[Document]) -> Tuple[int, List[str]]:
+    if paths.DEDUP_MODE == "off":
+        return None
+    kwargs = dict(near=paths.DEDUP_MODE == "near", max_hamming=paths.DEDUP_MAX_HAMMING,
+                  min_words=paths.DEDUP_MIN_WORDS)
+    if fresh:
+        return DedupIndex.create(paths.dedup_dir, **kwargs)
+    dedup = DedupIndex.load(paths.dedup_dir, **kwargs)
+    if not dedup.n_rows and lexical is not None and lexical.n_docs:
+        n = dedup.bootstrap(lexical.get_document(i) for i in range(len(lexical.deleted)) if not lexical.deleted[i])
+        print(f"[DEDUP] signatures of {n} indexed chunks loaded from the BM25 docstore")
+    return dedup
+
+def _safe_add_per_source(
+    vectorstore,
+    splits: List[Document],
+    ids_out: Dict[str, List] | None = None,
+    lexical: LexicalIndex | None = None,
+    dedup: DedupIndex | None = None,
+) -> Tuple[int, List[str]]:
     """
     Insert par fichier. Si un fichier échoue, on le logge et on continue.
-    Retourne (n_inserted, failed_sources[list]).
+    Retourne (n_inserted, failed_sources[list]) ; `ids_out[source]` reçoit les
+    clés primaires Milvus insérées (pour le manifeste), `lexical` les chunks.
+    Avec `dedup`, les chunks déjà indexés pour un autre fichier ne sont pas
+    insérés mais liés à leur source canonique.
     """
     inserted, failed = 0, []
     groups = _group_by_source(splits)
     for src, docs in groups.items():
+        dups = []
+        if dedup is not None:
+            docs, dups = dedup.filter(src, docs)
+            if not docs:
+                print(f"[DEDUP] {os.path.basename(src)}: all {len(dups)} chunks already indexed elsewhere")
+                dedup.add(src, [], dups)
+                if ids_out is not None:
+                    ids_out[src] = []
+                continue
         try:
             docs = _normalize_doc_metadata(docs)
-            docs = _normalize_docs_for_collection(vectorstore, getattr(paths, "MILVUS_COLLECTION", "rag_docs"), docs)
-            vectorstore.add_documents(docs)  # Milvus auto-id
+            docs = schema_normalizer.normalize_docs(vectorstore, getattr(paths, "MILVUS_COLLECTION", "rag_docs"), docs)
+            ids = _insert_docs(vectorstore, docs)  # Milvus auto-id
+            if ids_out is not None:
+                ids_out[src] = list(ids or [])
+            _add_lexical(lexical, docs, ids)
+            if dedup is not None:
+                dedup.add(src, docs, dups)
             inserted += len(docs)
         except (DataNotMatchException, MilvusException, Exception) as e:
             print(f"[Milvus][SKIP] insertion failed for source: {src}\n  -> {e}")
             failed.append(src)
+            # le schéma a peut-être changé : relu pour le fichier suivant
+            schema_normalizer.invalidate()
     return inserted, failed
 
 # =========================
@@ -355,50 +443,97 @@ def get_vectorizer(
     Ouvre/crée la collection Milvus et la peuple si vide.
     Retourne un vectorstore LangChain (Milvus).
     """
-    embedding_model = HuggingFaceEmbeddings(model_name=paths.bert_model_path)
+    embedding_model = get_engine()
     vectorstore = retriever.load_vectorstore(embedding_model, collection_name=collection_name)
 
     # Est-ce que la collection existe / contient des entités ?
-    try:
-        if not utility.has_collection(collection_name):
-            raise MilvusException(message=f"Collection '{collection_name}' not exist, or schema not ready.")
-
-        col = Collection(collection_name)
+    schema_free = getattr(vectorstore, "schema_free", False)  # faiss_store : pas de collection à créer
+    if schema_free:
+        n = vectorstore.ntotal
+    else:
         try:
-            col.load()
+            if not utility.has_collection(collection_name):
+                raise MilvusException(message=f"Collection '{collection_name}' not exist, or schema not ready.")
+
+            col = Collection(collection_name)
+            try:
+                col.load()
+            except Exception as e:
+                print(f"[Milvus][WARN] load() failed for '{collection_name}': {e}")
+            n = getattr(col, "num_entities", 0)
         except Exception as e:
-            print(f"[Milvus][WARN] load() failed for '{collection_name}': {e}")
-        n = getattr(col, "num_entities", 0)
-    except Exception as e:
-        print(f"[Milvus] Collection lookup failed ({e}) — treating as empty.")
-        n = 0
+            print(f"[Milvus] Collection lookup failed ({e}) — treating as empty.")
+            n = 0
 
-    # Peupler si vide
+    # Peupler si vide — les chunks arrivent fichier par fichier depuis l'extraction
+    # parallèle : l'embedding du fichier i recouvre l'extraction des suivants.
     if n == 0:
         print(f"[Milvus] Creating collection <{collection_name}> and embedding all documents …")
-        all_splits = get_chunks(chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
-        if all_splits:
-            # 1) uniformiser les métadatas pour un schéma stable
-            all_splits = _normalize_doc_metadata(all_splits)
-
-            # 2) création *explicite* de la collection + insert initial
-            try:
-                vectorstore = LCMilvus.from_documents(
-                    documents=all_splits,
-                    embedding=embedding_model,                        # NB: param s’appelle 'embedding'
-                    connection_args={"uri": paths.MILVUS_URI},        # <<— URI
-                    collection_name=collection_name,
-                    index_params={"index_type": "HNSW", "metric_type": "COSINE", "params": {"M": 16, "efConstruction": 200}},
-                    search_params={"metric_type": "COSINE", "params": {"ef": 128}},
-                    drop_old=False,
-                )
-                print(f"[Milvus] Inserted {len(all_splits)} chunks (new collection).")
-            except Exception as e:
-                print(f"[Milvus][ERROR] initial creation failed: {e}")
-        else:
+        manifest = IndexManifest(paths.manifest_path, params=_index_params())
+        lexical = LexicalIndex.create(paths.bm25_dir)
+        dedup = load_dedup_index(fresh=True)
+        created, inserted, failed = schema_free, 0, []
+        for splits in iter_chunks(get_all_files(), chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+            src = splits[0].metadata.get("source", "unknown")
+            if not created:
+                # 1) uniformiser les métadatas pour un schéma stable
+                splits = _normalize_doc_metadata(splits)
+
+                # 2) création *explicite* de la collection + insert initial
+                try:
+                    vectorstore = LCMilvus(
+                        embedding_function=embedding_model,
+                        connection_args={"uri": paths.MILVUS_URI},        # <<— URI
+                        collection_name=collection_name,
+                        index_params=get_profile().index_params(),
+                        search_params=get_profile().search_params("accurate"),
+                        drop_old=False,
+                        auto_id=True,
+                    )
+                    ids = _insert_docs(vectorstore, splits)
+                    _add_lexical(lexical, splits, ids)
+                    if dedup is not None:
+                        dedup.add(src, splits)
+                    manifest.record(src, src, ids)
+                    persist_vectorstore(vectorstore)
+                    manifest.save()
+                    schema_normalizer.invalidate(collection_name)
+                    created = True
+                    inserted += len(splits)
+                except Exception as e:
+                    print(f"[Milvus][ERROR] initial creation failed: {e}")
+                    failed.append(src)
+                continue
+
+            # 3) fichiers suivants : insert résilient aligné sur le schéma créé
+            ids_by_src: Dict[str, List] = {}
+            n_ok, n_failed = _safe_add_per_source(vectorstore, splits, ids_out=ids_by_src, lexical=lexical, dedup=dedup)
+            inserted += n_ok
+            failed.extend(n_failed)
+            for source, ids in ids_by_src.items():
+                manifest.record(source, source, ids)
+            persist_vectorstore(vectorstore)
+            manifest.save()
+        lexical.save()
+        if dedup is not None:
+            dedup.save()
+
+        if created:
+            print(f"[Milvus] Inserted {inserted} chunks (new collection).")
+            print(embedding_model.report())
+            if dedup is not None:
+                print(dedup.summary(paths.EMB_DIM))
+        elif not failed:
             print("[Milvus] No chunks to insert (corpus empty?).")
+        if failed:
+            print("[Milvus] The following sources failed and were skipped:")
+            for src in failed:
+                print("  -", src)
     else:
         print(f"[Milvus] Using existing collection <{collection_name}> ({n} vectors)")
+        if not os.path.exists(os.path.join(paths.bm25_dir, "meta.json")):
+            print("[BM25][WARN] no lexical index: 'words'/'hybrid' search falls back to vectors "
+                  "(drop the collection and re-run 'preprocess' to build it)")
 
     return vectorstore
 
@@ -426,35 +561,39 @@ def add_documents(
 
         print(f"Processing {len(new_files)} new documents …")
 
-        splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-        new_docs: List[Document] = []
-        for fname in new_files:
-            fpath = os.path.join(upload_directory, fname)
-            try:
-                text, meta = get_text(fpath)
-                if not text:
-                    print(f"[READ][SKIP] empty text: {fpath}")
-                    continue
-                meta_clean = {k: v for k, v in (meta or {}).items() if v is not None}
-                meta_clean = {str(k): str(v) for k, v in meta_clean.items()}
-                meta_clean["source"] = os.path.abspath(os.path.join(paths.data_path, fname))
-                if not meta_clean.get("title"):
-                    meta_clean["title"] = os.path.splitext(os.path.basename(meta_clean["source"]))[0]
-                new_docs.append(Document(page_content=text, metadata=meta_clean))
-            except Exception as e:
-                print(f"[READ][SKIP] failed to parse {fpath}: {e}")
-
-        if not new_docs:
+        # Extraction parallèle + append résilient par fichier, au fil de l'eau
+        embedding_model = get_engine()
+        vectorstore = retriever.load_vectorstore(embedding_model, collection_name=collection_name)
+        require_chunk_fields(vectorstore, collection_name)
+        manifest = IndexManifest.load(paths.manifest_path)
+        lexical = LexicalIndex.load(paths.bm25_dir)
+        dedup = load_dedup_index(lexical)
+        n, n_files, failed = 0, 0, []
+        for splits in iter_chunks(
+            [os.path.join(upload_directory, fname) for fname in new_files],
+            source_for=lambda fpath: os.path.join(paths.data_path, os.path.basename(fpath)),
+        ):
+            ids_by_src: Dict[str, List] = {}
+            n_ok, n_failed = _safe_add_per_source(vectorstore, splits, ids_out=ids_by_src, lexical=lexical, dedup=dedup)
+            n += n_ok
+            n_files += 1
+            failed.extend(n_failed)
+            for src, ids in ids_by_src.items():
+                manifest.record(src, os.path.join(upload_directory, os.path.basename(src)), ids)
+        persist_vectorstore(vectorstore)
+        manifest.save()
+        lexical.save()
+        if dedup is not None:
+            dedup.save()
+
+        if not n_files:
             print("No readable text found in the uploaded files.")
             return
 
-        new_splits = splitter.split_documents(new_docs)
-
-        # Append résilient par fichier
-        embedding_model = HuggingFaceEmbeddings(model_name=paths.bert_model_path)
-        vectorstore = retriever.load_vectorstore(embedding_model, collection_name=collection_name)
-        n, failed = _safe_add_per_source(vectorstore, new_splits)
-        print(f"Added {n} chunks from {len(new_docs)} file(s) to Milvus.")
+        print(f"Added {n} chunks from {n_files} file(s) to Milvus.")
+        print(embedding_model.report())
+        if dedup is not None:
+            print(dedup.summary(paths.EMB_DIM))
         if failed:
             print("[Milvus] The following sources failed and were skipped:")
             for s in failed:
@@ -473,6 +612,155 @@ def add_documents(
     except Exception as e:
         print(f"[ADD][ERROR] {e}")
 
+# =========================
+# Ré-indexation incrémentale (manifeste)
+# =========================
+
+def _index_params() -> Dict[str, Any]:
+    """Paramètres qui, s'ils changent, invalident tous les embeddings du manifeste."""
+    params = {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "chunker": "pages",
+        "embedding_model": os.path.basename(os.path.normpath(paths.bert_model_path)),
+    }
+    # changer de backend = index vide à remplir (clé absente pour Milvus : manifestes existants inchangés)
+    if paths.VECTOR_BACKEND != "milvus":
+        params["vector_backend"] = paths.VECTOR_BACKEND
+    # texte extrait différent en mode "fast" (clé absente pour "layout")
+    if EXTRACT_MODE != "layout":
+        params["extract_mode"] = EXTRACT_MODE
+    return params
+
+# Métadonnées posées par page_chunker.py, à conserver dans la collection
+CHUNK_FIELDS = ("page_start", "page_end", "heading")
+
+def missing_chunk_fields(vectorstore, collection_name: str) -> List[str]:
+    """Champs de CHUNK_FIELDS que la collection existante ne stocke pas (perdus à l'insertion)."""
+    if getattr(vectorstore, "schema_free", False) or not utility.has_collection(collection_name):
+        return []
+    return schema_normalizer.missing_fields(vectorstore, collection_name, CHUNK_FIELDS)
+
+def require_chunk_fields(vectorstore, collection_name: str) -> None:
+    """Refuse d'insérer dans une collection créée avant le découpage par page."""
+    missing = missing_chunk_fields(vectorstore, collection_name)
+    if missing:
+        raise RuntimeError(
+            f"Collection <{collection_name}> has no field {missing} (created before page chunking): "
+            "run `python preprocess.py sync` to rebuild it."
+        )
+
+def _milvus_str(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+def _delete_source_rows(vectorstore, source: str, chunk_ids: List, lexical: LexicalIndex | None = None) -> None:
+    """Supprime les lignes d'un fichier : par clé primaire si connue, sinon par `source`."""
+    if chunk_ids:
+        vectorstore.delete(ids=list(chunk_ids))
+    elif hasattr(vectorstore, "delete_source"):
+        vectorstore.delete_source(source)
+    else:
+        vectorstore.delete(expr=f'source == "{_milvus_str(source)}"')
+    if lexical is not None:
+        lexical.delete_source(source)
+
+def sync_index(collection_name: str = getattr(paths, "MILVUS_COLLECTION", "rag_docs")) -> None:
+    """
+    Diff 'data/' <-> manifeste, puis :
+      1) supprime (par pk) les lignes des PDF modifiés ou supprimés
+      2) embedde uniquement les PDF ajoutés ou modifiés
+    Le manifeste est sauvegardé après chaque fichier (reprise possible après crash).
+    """
+    manifest = IndexManifest.load(paths.manifest_path)
+    params = _index_params()
+    full = bool(manifest.files) and manifest.params != params
+    if full:
+        print(f"[SYNC] index params changed {manifest.params} -> {params}: full re-embed")
+    files = get_all_files()
+    diff = manifest.diff(files, params)
+    print(f"[SYNC] {diff.summary()}")
+    if diff.is_empty():
+        manifest.save()  # mtimes éventuellement rafraîchis
+        print("[SYNC] Index is up to date.")
+        return
+
+    embedding_model = get_engine()
+    vectorstore = retriever.load_vectorstore(embedding_model, collection_name=collection_name)
+
+    # collection qui ne peut pas stocker les métadonnées des chunks (page_start /
+    # page_end / heading, ex. créée avant le découpage par page, sans manifeste) :
+    # elles seraient perdues à chaque insertion, on recrée tout
+    missing = missing_chunk_fields(vectorstore, collection_name)
+    if missing:
+        print(f"[SYNC] collection <{collection_name}> has no field {missing}: dropping it and rebuilding from scratch")
+        utility.drop_collection(collection_name)
+        schema_normalizer.invalidate(collection_name)
+        get_vectorizer(collection_name=collection_name)
+        return
+
+    lexical = LexicalIndex.load(paths.bm25_dir)
+    dedup = load_dedup_index(lexical)
+
+    # fichiers dont des chunks évités (doublons) renvoient aux fichiers modifiés / supprimés :
+    # ré-ingérés eux aussi, sinon ce contenu disparaîtrait de l'index
+    linked: List[str] = []
+    if dedup is not None:
+        redo = set(diff.added + diff.changed)
+        present = set(files)
+        linked = [s for s in dedup.dependents(diff.changed + diff.removed) if s in present and s not in redo]
+        if linked:
+            print(f"[SYNC] {len(linked)} file(s) linked to changed/removed ones by dedup: re-embedding them too")
+
+    # 1) lignes périmées
+    for src in diff.changed + diff.removed + linked:
+        try:
+            _delete_source_rows(vectorstore, src, manifest.chunk_ids(src), lexical=lexical)
+            manifest.forget(src)
+            if dedup is not None:
+                dedup.delete_source(src)
+            print(f"[SYNC] deleted rows of {os.path.basename(src)}")
+        except Exception as e:
+            print(f"[SYNC][WARN] delete failed for {src}: {e}")
+    # fichiers inconnus du manifeste mais peut-être déjà indexés (ex. via /upload)
+    for src in diff.added:
+        try:
+            _delete_source_rows(vectorstore, src, [], lexical=lexical)
+            if dedup is not None:
+                dedup.delete_source(src)
+        except Exception as e:
+            print(f"[SYNC][WARN] cleanup failed for {src}: {e}")
+    manifest.params = params
+    persist_vectorstore(vectorstore)
+    manifest.save()
+    lexical.save()
+    if dedup is not None:
+        dedup.save()
+
+    # 2) embedding des nouveaux / modifiés
+    inserted, failed = 0, []
+    todo = diff.added + diff.changed + linked
+    for splits in iter_chunks(todo, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+        ids_by_src: Dict[str, List] = {}
+        n_ok, n_failed = _safe_add_per_source(vectorstore, splits, ids_out=ids_by_src, lexical=lexical, dedup=dedup)
+        inserted += n_ok
+        failed.extend(n_failed)
+        for src, ids in ids_by_src.items():
+            manifest.record(src, src, ids)
+        persist_vectorstore(vectorstore)
+        manifest.save()
+        lexical.save()
+        if dedup is not None:
+            dedup.save()
+
+    print(f"[SYNC] Added {inserted} chunks from {len(todo) - len(failed)} file(s).")
+    print(embedding_model.report())
+    if dedup is not None:
+        print(dedup.summary(paths.EMB_DIM))
+    if failed:
+        print("[SYNC] The following sources failed and will be retried on next sync:")
+        for src in failed:
+            print("  -", src)
+
 # =========================
 # CLI
 # =========================
@@ -481,6 +769,7 @@ def _usage():
     print("Usage:")
     print("  python preprocess.py preprocess   # indexe tout le dossier data/")
     print("  python preprocess.py add_doc      # ingère les nouveaux PDF depuis uploads/")
+    print("  python preprocess.py sync         # ré-indexe seulement les PDF ajoutés/modifiés/supprimés")
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
@@ -492,5 +781,7 @@ if __name__ == "__main__":
         get_vectorizer()
     elif cmd == "add_doc":
         add_documents()
+    elif cmd == "sync":
+        sync_index()
     else:
         _usage()
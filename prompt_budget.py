@@ -0,0 +1,145 @@
+"""
+prompt_budget.py — budget de tokens du prompt (tokenizer du GGUF)
+
+Remplace `trim_messages(..., token_counter=len, max_tokens=4000)` (qui comptait
+des messages, pas des tokens) par un vrai budget, cohérent avec n_ctx :
+
+    n_ctx = gabarit système + contexte récupéré + historique + génération (max_tokens)
+
+- TokenCounter : compte via le tokenizer llama.cpp (Llama.tokenize), avec un
+  cache LRU par texte (les messages de l'historique sont recomptés à chaque tour)
+- PromptBudget.fit_documents : garde les chunks dans l'ordre du retriever tant
+  qu'ils tiennent dans le budget contexte (le premier est tronqué au besoin)
+- PromptBudget.trim_history : historique le plus récent qui tient dans le reste
+
+Sans tokenizer (tests, modèle absent) : estimation ~4 caractères / token.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+from langchain_core.messages import HumanMessage, SystemMessage, trim_messages
+
+# En-têtes du chat template (Llama 3 : <|start_header_id|>role<|end_header_id|>\n\n ... <|eot_id|>)
+MESSAGE_OVERHEAD = 5
+# Séparateur entre chunks dans create_stuff_documents_chain ("\n\n")
+DOC_SEPARATOR_TOKENS = 1
+CHARS_PER_TOKEN = 4
+
+
+class TokenCounter:
+    """Nombre de tokens d'un texte, mis en cache (clé = hash du texte)."""
+
+    def __init__(self, tokenize: Optional[Callable[[bytes], List[int]]] = None, max_entries: int = 8192):
+        self.tokenize = tokenize
+        self.max_entries = max(1, int(max_entries))
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_llm(cls, llm: Any, max_entries: int = 8192) -> "TokenCounter":
+        """Utilise le tokenizer du modèle llama.cpp (ChatLlamaCpp.client ou Llama)."""
+        client = getattr(llm, "client", llm)
+        tokenize = getattr(client, "tokenize", None)
+        if tokenize is None:
+            return cls(None, max_entries)
+        return cls(lambda data: tokenize(data, add_bos=False, special=False), max_entries)
+
+    def count(self, text: str) -> int:
+        text = text or ""
+        if not text:
+            return 0
+        if self.tokenize is None:
+            return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            n = self._cache.get(key)
+            if n is not None:
+                self._cache.move_to_end(key)
+                return n
+        n = len(self.tokenize(text.encode("utf-8")))
+        with self._lock:
+            self._cache[key] = n
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return n
+
+    def count_messages(self, messages: List[Any]) -> int:
+        return sum(self.count(getattr(m, "content", "") or "") + MESSAGE_OVERHEAD for m in messages)
+
+
+class PromptBudget:
+    """Répartit n_ctx entre gabarit, contexte récupéré, historique et génération."""
+
+    def __init__(
+        self,
+        counter: TokenCounter,
+        n_ctx: int = 4096,
+        max_new_tokens: int = 512,
+        context_tokens: int = 1800,
+        template: str = "",
+    ):
+        self.counter = counter
+        self.n_ctx = int(n_ctx)
+        self.max_new_tokens = int(max_new_tokens)
+        self.context_tokens = int(context_tokens)
+        self.template_tokens = counter.count(template) + MESSAGE_OVERHEAD
+
+    @property
+    def input_tokens(self) -> int:
+        """Tokens disponibles pour le prompt (n_ctx - génération)."""
+        return max(0, self.n_ctx - self.max_new_tokens)
+
+    def fit_documents(self, docs: List[Any]) -> tuple[List[Any], int]:
+        """Chunks qui tiennent dans le budget contexte ; renvoie (docs, tokens utilisés)."""
+        kept, used = [], 0
+        for d in docs or []:
+            n = self.counter.count(d.page_content) + DOC_SEPARATOR_TOKENS
+            if used + n <= self.context_tokens:
+                kept.append(d)
+                used += n
+            elif not kept:
+                # le meilleur chunk seul dépasse : on le tronque plutôt que de n'envoyer rien
+                d = self._truncate(d, self.context_tokens - DOC_SEPARATOR_TOKENS)
+                kept.append(d)
+                used += self.counter.count(d.page_content) + DOC_SEPARATOR_TOKENS
+                break
+            else:
+                break
+        return kept, used
+
+    def trim_history(self, messages: List[Any], context_used: Optional[int] = None) -> List[Any]:
+        """
+        Derniers messages qui tiennent dans le reste du budget (système inclus).
+        `context_used=None` réserve tout le budget contexte (contexte inconnu).
+        """
+        used = self.context_tokens if context_used is None else context_used
+        budget = self.input_tokens - self.template_tokens - used
+        trimmed = trim_messages(
+            messages,
+            strategy="last",
+            start_on="human",
+            end_on=("human", "tool"),
+            token_counter=self.counter.count_messages,
+            include_system=True,
+            max_tokens=max(0, budget),
+        )
+        if not any(isinstance(m, HumanMessage) for m in trimmed):
+            # la question courante doit toujours partir, même hors budget
+            system = [m for m in messages[:1] if isinstance(m, SystemMessage)]
+            last_human = next((m for m in reversed(messages) if isinstance(m, HumanMessage)), None)
+            trimmed = system + ([last_human] if last_human is not None else [])
+        return trimmed
+
+    def _truncate(self, doc: Any, max_tokens: int) -> Any:
+        text = doc.page_content
+        # estimation par le ratio caractères/tokens du chunk, puis ajustement
+        n = max(1, self.counter.count(text))
+        cut = int(len(text) * max_tokens / n)
+        while cut > 0 and self.counter.count(text[:cut]) > max_tokens:
+            cut = int(cut * 0.9)
+        return type(doc)(page_content=text[:cut], metadata=dict(doc.metadata or {}))
@@ -0,0 +1,253 @@
+"""
+prompt_cache.py — réutilisation des états KV llama.cpp entre les tours (prefix cache)
+
+llama_cpp.Llama accepte un cache d'états (Llama.set_cache) : avant d'évaluer un
+prompt, il recharge l'état dont la suite de tokens partage le plus long préfixe
+avec ce prompt, puis n'évalue que les tokens suivants ; après la génération il
+enregistre l'état (prompt + réponse).
+
+La clé est donc la suite de tokens elle-même :
+- préfixe système partagé : tous les prompts commencent par le même gabarit
+  système (generator.SYSTEM_TEMPLATE + SYSTEM_PROMPT_CONTENT) -> réutilisé
+  d'une session à l'autre
+- par session : le prompt d'un tour reprend l'historique et la question du
+  tour précédent ; le contexte récupéré est placé APRÈS la question
+  (generator.CONTEXT_TEMPLATE) pour ne pas casser ce préfixe. L'état enregistré
+  se termine par [contexte, réponse] alors que le prompt suivant enchaîne la
+  réponse (avec son bloc Sources) puis la nouvelle question : seul
+  [système, historique, question précédente] est réutilisé, la réponse
+  précédente, la nouvelle question et le nouveau contexte sont réévalués
+
+PromptStateCache :
+- LRU en RAM borné en octets (PROMPT_CACHE_RAM_MB)
+- débordement optionnel sur disque (PROMPT_CACHE_DISK_DIR, PROMPT_CACHE_DISK_MB) :
+  les états évincés de la RAM y sont écrits, et remontés en RAM au besoin ;
+  un dossier par instance (slot ou worker : jamais partagé entre processus)
+  sous un dossier par empreinte du modèle (spill_dir) : les états d'un autre
+  GGUF / n_ctx sont effacés au lieu d'être rechargés
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+Key = Tuple[int, ...]
+
+
+def longest_token_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def _state_size(state: Any) -> int:
+    return int(getattr(state, "llama_state_size", 0) or 0)
+
+
+class _DiskTier:
+    """États sérialisés dans un dossier ({sha}.key = tokens, {sha}.state = pickle), LRU par mtime."""
+
+    def __init__(self, path: str, capacity_bytes: int):
+        self.path = path
+        self.capacity_bytes = int(capacity_bytes)
+        os.makedirs(path, exist_ok=True)
+        self.keys: Dict[str, Key] = {}
+        for name in os.listdir(path):
+            if name.endswith(".key.npy"):
+                sha = name[: -len(".key.npy")]
+                if os.path.exists(self._state_path(sha)):
+                    self.keys[sha] = tuple(int(t) for t in np.load(os.path.join(path, name)))
+
+    def _state_path(self, sha: str) -> str:
+        return os.path.join(self.path, f"{sha}.state")
+
+    def _key_path(self, sha: str) -> str:
+        return os.path.join(self.path, f"{sha}.key.npy")
+
+    @staticmethod
+    def sha(key: Key) -> str:
+        return hashlib.sha1(np.asarray(key, dtype=np.int32).tobytes()).hexdigest()
+
+    def longest(self, key: Key) -> Tuple[Optional[str], int]:
+        best, best_len = None, 0
+        for sha, k in self.keys.items():
+            n = longest_token_prefix(k, key)
+            if n > best_len:
+                best, best_len = sha, n
+        return best, best_len
+
+    def put(self, key: Key, state: Any) -> None:
+        sha = self.sha(key)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._state_path(sha))
+        np.save(self._key_path(sha), np.asarray(key, dtype=np.int32))
+        self.keys[sha] = key
+        self._evict()
+
+    def pop(self, sha: str) -> Any:
+        with open(self._state_path(sha), "rb") as f:
+            state = pickle.load(f)
+        self._remove(sha)
+        return state
+
+    def _remove(self, sha: str) -> None:
+        self.keys.pop(sha, None)
+        for p in (self._state_path(sha), self._key_path(sha)):
+            if os.path.exists(p):
+                os.remove(p)
+
+    def _evict(self) -> None:
+        files = [(sha, os.stat(self._state_path(sha))) for sha in self.keys if os.path.exists(self._state_path(sha))]
+        total = sum(st.st_size for _, st in files)
+        for sha, st in sorted(files, key=lambda x: x[1].st_mtime):
+            if total <= self.capacity_bytes:
+                break
+            self._remove(sha)
+            total -= st.st_size
+
+
+class PromptStateCache:
+    """
+    Cache d'états compatible avec Llama.set_cache (même interface que
+    llama_cpp.LlamaRAMCache : recherche du plus long préfixe de tokens).
+    """
+
+    def __init__(self, capacity_bytes: int, disk_dir: Optional[str] = None, disk_capacity_bytes: int = 0):
+        self.capacity_bytes = int(capacity_bytes)
+        self.cache_state: "OrderedDict[Key, Any]" = OrderedDict()
+        self.disk = _DiskTier(disk_dir, disk_capacity_bytes) if disk_dir else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    @property
+    def cache_size(self) -> int:
+        return sum(_state_size(s) for s in self.cache_state.values())
+
+    def _find_longest_prefix_key(self, key: Key) -> Tuple[Optional[Key], int]:
+        best, best_len = None, 0
+        for k in self.cache_state:
+            n = longest_token_prefix(k, key)
+            if n > best_len:
+                best, best_len = k, n
+        return best, best_len
+
+    def __contains__(self, key: Sequence[int]) -> bool:
+        key = tuple(key)
+        with self._lock:
+            if self._find_longest_prefix_key(key)[0] is not None:
+                return True
+            return self.disk is not None and self.disk.longest(key)[0] is not None
+
+    def __getitem__(self, key: Sequence[int]) -> Any:
+        key = tuple(key)
+        with self._lock:
+            ram_key, ram_len = self._find_longest_prefix_key(key)
+            if self.disk is not None:
+                sha, disk_len = self.disk.longest(key)
+                if sha is not None and disk_len > ram_len:
+                    disk_key = self.disk.keys[sha]
+                    try:
+                        state = self.disk.pop(sha)
+                    except Exception as e:
+                        print(f"[PROMPT-CACHE][WARN] unreadable spilled state: {e}")
+                        self.disk._remove(sha)
+                    else:
+                        self._put(disk_key, state)
+                        self.disk_hits += 1
+                        self.reused_tokens += disk_len
+                        return state
+            if ram_key is None:
+                self.misses += 1
+                raise KeyError("Key not found")
+            self.cache_state.move_to_end(ram_key)
+            self.hits += 1
+            self.reused_tokens += ram_len
+            return self.cache_state[ram_key]
+
+    def __setitem__(self, key: Sequence[int], value: Any) -> None:
+        with self._lock:
+            self._put(tuple(key), value)
+
+    def _put(self, key: Key, value: Any) -> None:
+        self.cache_state.pop(key, None)
+        self.cache_state[key] = value
+        while self.cache_size > self.capacity_bytes and len(self.cache_state) > 1:
+            old_key, old_state = self.cache_state.popitem(last=False)
+            if self.disk is not None:
+                try:
+                    self.disk.put(old_key, old_state)
+                except Exception as e:
+                    print(f"[PROMPT-CACHE][WARN] disk spill failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "ram_entries": len(self.cache_state),
+            "ram_bytes": self.cache_size,
+            "disk_entries": len(self.disk.keys) if self.disk is not None else 0,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "reused_tokens": self.reused_tokens,
+        }
+
+
+_FINGERPRINT = re.compile(r"^[0-9a-f]{16}$")
+
+
+def model_fingerprint(model_path: str, *settings: Any) -> str:
+    """
+    Empreinte courte d'un modèle GGUF (taille, premier et dernier Mo : sans
+    relire des Go de poids) et des réglages qui changent l'état KV (n_ctx...).
+    """
+    h = hashlib.sha1()
+    size = os.path.getsize(model_path)
+    h.update(str(size).encode())
+    with open(model_path, "rb") as f:
+        h.update(f.read(1 << 20))
+        f.seek(max(0, size - (1 << 20)))
+        h.update(f.read())
+    for value in settings:
+        h.update(repr(value).encode())
+    return h.hexdigest()[:16]
+
+
+def spill_dir(base: str, fingerprint: str, instance: str) -> str:
+    """
+    Dossier de débordement d'une instance : base/<empreinte>/<instance>. Les
+    dossiers d'autres empreintes (modèle changé) et l'ancien agencement
+    base/slotN sont supprimés.
+    """
+    if os.path.isdir(base):
+        for name in os.listdir(base):
+            if name != fingerprint and (_FINGERPRINT.match(name) or name.startswith("slot")):
+                shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+    return os.path.join(base, fingerprint, instance)
+
+
+def install_prompt_cache(llm: Any, capacity_bytes: int, disk_dir: Optional[str] = None,
+                         disk_capacity_bytes: int = 0) -> Optional[PromptStateCache]:
+    """Branche un PromptStateCache sur le modèle llama.cpp de `llm` (ChatLlamaCpp)."""
+    client = getattr(llm, "client", None)
+    if client is None or not hasattr(client, "set_cache"):
+        return None
+    cache = PromptStateCache(capacity_bytes, disk_dir=disk_dir, disk_capacity_bytes=disk_capacity_bytes)
+    client.set_cache(cache)
+    return cache
@@ -4,50 +4,109 @@ import os
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from datetime import datetime, timezone
 
-def create_redis_client():
+def create_redis_client(decode_responses: bool = True):
+    """
+    Client Redis partagé. `decode_responses=False` pour les clés binaires
+    (ex. vecteurs float32 du cache sémantique).
+    """
     redis_host = os.getenv('REDIS_HOST', '127.0.0.1')
     redis_port = int(os.getenv('REDIS_PORT', '6379'))
-    pool = ConnectionPool(host=redis_host, port=redis_port, max_connections=100, decode_responses=True)
+    pool = ConnectionPool(host=redis_host, port=redis_port, max_connections=100, decode_responses=decode_responses)
     return Redis(connection_pool=pool)
 
 class RedisChatMessageHistory:
     """
     Historique des messages d'une session via Redis, avec prise en charge
     de la durée des réponses assistant et TTL glissant optionnel.
+
+    Clés :
+        chat_history:{sid}          LIST  tours user / assistant (JSON)
+        chat_history:{sid}:system   STR   prompt système (stocké à part)
+        chat_history:{sid}:summary  STR   résumé des tours retirés par compact()
+
+    window(n) ne lit que les n derniers tours (LRANGE -n -1) ; les messages
+    décodés sont gardés en cache sur l'instance (une instance par requête)
+    et complétés à chaque écriture, sans relire Redis.
+    Les anciennes sessions (system en tête de liste) restent lisibles.
     """
-    def __init__(self, session_id: str, redis_client: Redis, ttl_seconds: int | None = None):
+    def __init__(
+        self,
+        session_id: str,
+        redis_client: Redis,
+        ttl_seconds: int | None = None,
+        max_messages: int | None = None,
+        summarizer=None,
+    ):
         self.session_id = session_id
         self.redis_client = redis_client
         self.key = f"chat_history:{session_id}"
+        self.system_key = f"{self.key}:system"
+        self.summary_key = f"{self.key}:summary"
         self.ttl_seconds = ttl_seconds
+        # au-delà de max_messages tours, les plus anciens sont retirés (résumés
+        # par summarizer(résumé_précédent, messages_retirés) -> str, si fourni)
+        self.max_messages = max_messages
+        self.summarizer = summarizer
 
-    def _push(self, data: dict):
-        self.redis_client.rpush(self.key, json.dumps(data))
-        if self.ttl_seconds:
-            # TTL "glissant" : on renouvelle à chaque insertion
-            self.redis_client.expire(self.key, self.ttl_seconds)
+        self._system = None          # (system, summary) une fois lus
+        self._tail = None            # derniers tours décodés (cache)
+        self._tail_complete = False  # _tail contient tout l'historique
 
-    def get_messages(self):
-        """Reconstruit des objets LangChain à partir du JSON stocké."""
-        messages = []
-        for message_json in self.redis_client.lrange(self.key, 0, -1):
-            data = json.loads(message_json)
-            role = data.get("role")
-            content = data.get("content", "")
-            if role == "system":
-                msg = SystemMessage(content=content)
-            elif role == "assistant":
-                msg = AIMessage(content=content)
-                if "duration" in data:
-                    setattr(msg, "duration", data["duration"])
-            else:
-                msg = HumanMessage(content=content)
-            messages.append(msg)
-        return messages
+    # ---------- Décodage ----------
 
-    @property
-    def messages(self):
-        return self.get_messages()
+    @staticmethod
+    def _decode(message_json):
+        data = json.loads(message_json)
+        role = data.get("role")
+        content = data.get("content", "")
+        if role == "system":
+            return SystemMessage(content=content)
+        if role == "assistant":
+            msg = AIMessage(content=content)
+            if "duration" in data:
+                setattr(msg, "duration", data["duration"])
+            return msg
+        return HumanMessage(content=content)
+
+    @staticmethod
+    def _text(raw):
+        if isinstance(raw, bytes):
+            return raw.decode("utf-8")
+        return raw if isinstance(raw, str) else None
+
+    # ---------- Écriture ----------
+
+    def _push(self, data: dict, also=None):
+        """RPUSH (+ EXPIRE / métriques `also(pipe)`) en un aller-retour si besoin."""
+        payload = json.dumps(data)
+        if not (self.ttl_seconds or also or self.max_messages):
+            self.redis_client.rpush(self.key, payload)
+            length = None
+        else:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.rpush(self.key, payload)
+            if self.ttl_seconds:
+                # TTL "glissant" : on renouvelle à chaque insertion
+                pipe.expire(self.key, self.ttl_seconds)
+            if also is not None:
+                also(pipe)
+            length = pipe.execute()[0]
+
+        if self._tail is not None:
+            self._tail.append(self._decode(payload))
+        if self.max_messages and isinstance(length, int) and length > self.max_messages:
+            self.compact(self.max_messages)
+
+    def set_system_message(self, content: str) -> None:
+        """Enregistre le prompt système (une seule fois par session)."""
+        if self.get_system_message() is not None:
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.set(self.system_key, content, nx=True)
+        if self.ttl_seconds:
+            pipe.expire(self.system_key, self.ttl_seconds)
+        pipe.execute()
+        self._system = (content, self._system[1] if self._system else None)
 
     def add_message(self, message):
         """Ajoute un message LangChain, en conservant la durée si présente."""
@@ -70,8 +129,11 @@ class RedisChatMessageHistory:
             data["duration"] = float(dur)
         self._push(data)
 
-    def add_ai_message(self, content: str, duration: float | None = None):
-        """Utilitaire explicite pour les réponses assistant."""
+    def add_ai_message(self, content: str, duration: float | None = None, also=None):
+        """
+        Utilitaire explicite pour les réponses assistant. `also(pipe)` ajoute
+        des commandes (ex. métriques) au même pipeline Redis.
+        """
         data = {
             "role": "assistant",
             "content": content,
@@ -79,10 +141,103 @@ class RedisChatMessageHistory:
         }
         if duration is not None:
             data["duration"] = float(duration)
-        self._push(data)
+        self._push(data, also=also)
+
+    def compact(self, keep: int) -> int:
+        """
+        Ne garde que les `keep` derniers tours (LTRIM) ; les tours retirés sont
+        passés au summarizer (s'il existe) et le résumé est stocké à part.
+        Renvoie le nombre de messages retirés.
+        """
+        dropped_raw = self.redis_client.lrange(self.key, 0, -keep - 1) if keep else \
+            self.redis_client.lrange(self.key, 0, -1)
+        if not dropped_raw:
+            return 0
+        dropped = [self._decode(m) for m in dropped_raw]
+        pipe = self.redis_client.pipeline(transaction=False)
+        if self.summarizer is not None:
+            summary = self.summarizer(self.get_summary(), [m for m in dropped if not isinstance(m, SystemMessage)])
+            pipe.set(self.summary_key, summary)
+            if self.ttl_seconds:
+                pipe.expire(self.summary_key, self.ttl_seconds)
+            self._system = (self.get_system_message(), summary)
+        # un system historique en tête de liste est conservé à part avant d'être retiré
+        legacy = next((m for m in dropped if isinstance(m, SystemMessage)), None)
+        if legacy is not None:
+            pipe.set(self.system_key, legacy.content, nx=True)
+        pipe.ltrim(self.key, len(dropped), -1)
+        pipe.execute()
+        if self._tail is not None:
+            self._tail = self._tail[-keep:] if keep else []
+        return len(dropped)
+
+    # ---------- Lecture ----------
+
+    def _load_system(self):
+        if self._system is None:
+            system, summary = (self._text(v) for v in self.redis_client.mget([self.system_key, self.summary_key]) or [None, None])
+            if system is None:
+                # ancienne session : system en tête de la liste
+                first = self._text(self.redis_client.lindex(self.key, 0))
+                if first is not None:
+                    msg = self._decode(first)
+                    if isinstance(msg, SystemMessage):
+                        system = msg.content
+            self._system = (system, summary)
+        return self._system
+
+    def get_system_message(self) -> str | None:
+        return self._load_system()[0]
+
+    def get_summary(self) -> str | None:
+        return self._load_system()[1]
+
+    def window(self, n: int):
+        """
+        Messages pour le prompt : un SystemMessage (prompt système + résumé
+        éventuel) suivi des `n` derniers tours user / assistant.
+        """
+        if self._tail is None or (len(self._tail) < n and not self._tail_complete):
+            raw = self.redis_client.lrange(self.key, -n, -1) if n > 0 else []
+            self._tail = [self._decode(m) for m in raw]
+            self._tail_complete = len(raw) < n
+        turns = [m for m in self._tail[-n:] if not isinstance(m, SystemMessage)] if n > 0 else []
+
+        system, summary = self._load_system()
+        parts = [p for p in (system, f"Summary of the earlier conversation:\n{summary}" if summary else None) if p]
+        return ([SystemMessage(content="\n\n".join(parts))] if parts else []) + turns
+
+    def get_messages(self):
+        """Reconstruit des objets LangChain à partir du JSON stocké (historique complet)."""
+        messages = [self._decode(m) for m in self.redis_client.lrange(self.key, 0, -1)]
+        self._tail, self._tail_complete = list(messages), True
+        system = self._text(self.redis_client.get(self.system_key))
+        if system is not None and not any(isinstance(m, SystemMessage) for m in messages):
+            messages.insert(0, SystemMessage(content=system))
+        return messages
+
+    @property
+    def messages(self):
+        return self.get_messages()
+
+    def last_message(self):
+        """Dernier message de la session (depuis le cache si l'instance l'a écrit)."""
+        if self._tail:
+            return self._tail[-1]
+        raw = self._text(self.redis_client.lindex(self.key, -1))
+        return self._decode(raw) if raw is not None else None
 
     def clear(self):
-        self.redis_client.delete(self.key)
+        self.redis_client.delete(self.key, self.system_key, self.summary_key)
+        self._system, self._tail, self._tail_complete = None, None, False
 
-def get_chat_history(redis_cl, session_id: str, ttl_seconds: int | None = None) -> RedisChatMessageHistory:
-    return RedisChatMessageHistory(session_id, redis_cl, ttl_seconds=ttl_seconds)
+def get_chat_history(
+    redis_cl,
+    session_id: str,
+    ttl_seconds: int | None = None,
+    max_messages: int | None = None,
+    summarizer=None,
+) -> RedisChatMessageHistory:
+    return RedisChatMessageHistory(
+        session_id, redis_cl, ttl_seconds=ttl_seconds, max_messages=max_messages, summarizer=summarizer
+    )
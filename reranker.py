@@ -0,0 +1,139 @@
+"""
+reranker.py — reranking des candidats par cross-encoder (CPU)
+
+La recherche (vectorielle / hybride) sur-échantillonne les candidats ; le
+cross-encoder rescore chaque couple (requête, chunk) et on garde les meilleurs.
+
+- scoring par lots (RERANK_BATCH_SIZE), modèle local (RERANK_MODEL_PATH)
+- cache LRU des scores par (hash de la requête normalisée, chunk_id) :
+  une même question (reformulée à l'identique, rafraîchissement de page,
+  /retrieve puis /chat) ne repasse pas dans le modèle
+- budget de temps (RERANK_BUDGET_MS) : s'il est dépassé avant la fin du
+  scoring, on garde l'ordre de la recherche (les scores déjà calculés restent
+  en cache pour la prochaine fois)
+
+Modèle conseillé : cross-encoder/ms-marco-MiniLM-L-6-v2 (~90 MB) dans
+models/ms-marco-MiniLM-L-6-v2 (voir MODELS_README.md).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+import metrics
+import paths
+from answer_cache import chunk_id
+from embedding_cache import normalize_query
+
+
+def _load_cross_encoder(model_path: str, max_length: int):
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_path, device="cpu", max_length=max_length)
+
+
+class CrossEncoderReranker:
+    """Rescore (requête, chunks) avec un cross-encoder ; scores mis en cache."""
+
+    def __init__(
+        self,
+        model_path: str,
+        batch_size: int = 16,
+        budget_ms: int = 300,
+        max_entries: int = 20000,
+        max_length: int = 512,
+    ):
+        self.model = _load_cross_encoder(model_path, max_length)
+        self.batch_size = max(1, int(batch_size))
+        self.budget_s = max(0, int(budget_ms)) / 1000.0
+        self.max_entries = max(1, int(max_entries))
+
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    # ---------- API ----------
+
+    def rerank(self, query: str, docs: List[Any], top_k: Optional[int] = None) -> List[Any]:
+        """Renvoie `docs` triés par score décroissant (ordre d'origine si budget dépassé)."""
+        docs = list(docs or [])
+        if len(docs) <= 1:
+            return docs[:top_k]
+
+        start = time.perf_counter()
+        qhash = hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+        keys = [(qhash, chunk_id(d)) for d in docs]
+        scores = [self._get(k) for k in keys]
+
+        todo = [i for i, s in enumerate(scores) if s is None]
+        with self._lock:
+            self.hits += len(docs) - len(todo)
+            self.misses += len(todo)
+
+        for b in range(0, len(todo), self.batch_size):
+            if self.budget_s and time.perf_counter() - start > self.budget_s:
+                with self._lock:
+                    self.fallbacks += 1
+                metrics.RERANK_FALLBACKS.inc()
+                return docs[:top_k]
+            idx = todo[b:b + self.batch_size]
+            pairs = [(query, docs[i].page_content) for i in idx]
+            for i, s in zip(idx, self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)):
+                scores[i] = float(s)
+                self._put(keys[i], scores[i])
+
+        metrics.RERANK_SECONDS.observe(time.perf_counter() - start)
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        return [docs[i] for i in order][:top_k]
+
+    async def arerank(self, query: str, docs: List[Any], top_k: Optional[int] = None) -> List[Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.rerank, query, docs, top_k)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "score_hits": self.hits,
+            "score_misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "budget_fallbacks": self.fallbacks,
+            "entries": len(self._scores),
+        }
+
+    # ---------- Cache ----------
+
+    def _get(self, key: Tuple[str, str]) -> Optional[float]:
+        with self._lock:
+            s = self._scores.get(key)
+            if s is not None:
+                self._scores.move_to_end(key)
+            return s
+
+    def _put(self, key: Tuple[str, str], score: float):
+        with self._lock:
+            self._scores[key] = score
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+
+def get_reranker():
+    """Reranker configuré via paths (None si désactivé ou modèle indisponible)."""
+    if not paths.RERANK_ENABLED:
+        return None
+    try:
+        return CrossEncoderReranker(
+            paths.rerank_model_path,
+            batch_size=paths.RERANK_BATCH_SIZE,
+            budget_ms=paths.RERANK_BUDGET_MS,
+            max_entries=paths.RERANK_CACHE_SIZE,
+        )
+    except Exception as e:
+        print(f"[RERANK][WARN] cross-encoder unavailable ({e}) — reranking disabled")
+        return None
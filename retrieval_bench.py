@@ -0,0 +1,273 @@
+"""
+retrieval_bench.py — benchmark / non-régression de la recherche (recall@k, MRR, latence)
+
+Jeu de requêtes annotées (JSONL, une ligne par question) :
+
+    {"question": "How to reset the HSM admin PIN?", "source": "HSM_admin_guide.pdf", "page": 42}
+    {"question": "error 0x8000-12", "source": ["ErrorCodes.pdf", "Troubleshooting.pdf"]}
+
+- `source` : nom du PDF attendu (ou liste), comparé au nom de fichier du chunk
+- `page` (optionnel) : page attendue ; vérifiée si le chunk porte ses pages
+  (métadonnées page / page_start..page_end, ou marqueurs "--- Page N ---"),
+  sinon seule la source compte
+
+Chaque configuration ({"name", "mode", "rerank", "ef"}) est évaluée avec
+retriever.search_documents (même chemin que /retrieve) : recall@k pour chaque
+k demandé, MRR (rang du premier chunk pertinent) et latences p50/p95/p99.
+
+Backends :
+- memory (défaut, hors ligne) : chunks du docstore BM25 (paths.bm25_dir,
+  c.-à-d. ce qui est indexé) ré-embeddés dans un InMemoryVectorStore
+  (recherche exacte : référence pour mesurer le rappel perdu par HNSW)
+- milvus : collection configurée (paths.MILVUS_*) ; `ef` par configuration
+  (réglage de l'index lui-même : index_tuning.py)
+
+Résultats : JSON (commit git, paramètres, métriques) à comparer entre commits :
+
+    python retrieval_bench.py queries.jsonl --k 1,3,5,10 --out bench.json
+    python retrieval_bench.py queries.jsonl --configs configs.json --compare bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+import paths
+import retriever as rt
+
+DEFAULT_CONFIGS = [
+    {"name": "vector", "mode": "vector"},
+    {"name": "words", "mode": "words"},
+    {"name": "hybrid", "mode": "hybrid"},
+]
+
+_PAGE_MARK = re.compile(r"--- Page (\d+) ---")
+
+
+# ---------- Jeu de requêtes & pertinence ----------
+
+def load_queries(path: str) -> List[dict]:
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            q = json.loads(line)
+            if not q.get("question") or not q.get("source"):
+                raise ValueError(f"{path}:{n}: 'question' and 'source' are required")
+            sources = q["source"] if isinstance(q["source"], list) else [q["source"]]
+            q["sources"] = {os.path.basename(s) for s in sources}
+            queries.append(q)
+    return queries
+
+
+def doc_pages(doc: Any) -> Optional[range]:
+    """Pages couvertes par un chunk, si connues."""
+    md = doc.metadata or {}
+    if md.get("page_start"):
+        return range(int(md["page_start"]), int(md.get("page_end") or md["page_start"]) + 1)
+    if md.get("page") not in (None, ""):
+        return range(int(md["page"]), int(md["page"]) + 1)
+    marks = [int(m) for m in _PAGE_MARK.findall(doc.page_content or "")]
+    return range(min(marks), max(marks) + 1) if marks else None
+
+
+def is_relevant(doc: Any, query: dict) -> bool:
+    if os.path.basename((doc.metadata or {}).get("source", "")) not in query["sources"]:
+        return False
+    page = query.get("page")
+    if page is None:
+        return True
+    pages = doc_pages(doc)
+    return pages is None or int(page) in pages
+
+
+def first_relevant_rank(docs: Sequence[Any], query: dict) -> Optional[int]:
+    for rank, d in enumerate(docs, 1):
+        if is_relevant(d, query):
+            return rank
+    return None
+
+
+# ---------- Métriques ----------
+
+def score(ranks: Sequence[Optional[int]], latencies_s: Sequence[float], ks: Iterable[int]) -> Dict[str, Any]:
+    n = max(1, len(ranks))
+    out: Dict[str, Any] = {f"recall@{k}": round(sum(r is not None and r <= k for r in ranks) / n, 4) for k in ks}
+    out["mrr"] = round(sum(1.0 / r for r in ranks if r) / n, 4)
+    lat = np.asarray(latencies_s, dtype=np.float64) * 1000.0
+    out["latency_ms"] = {
+        "p50": round(float(np.percentile(lat, 50)), 2) if len(lat) else 0.0,
+        "p95": round(float(np.percentile(lat, 95)), 2) if len(lat) else 0.0,
+        "p99": round(float(np.percentile(lat, 99)), 2) if len(lat) else 0.0,
+        "mean": round(float(lat.mean()), 2) if len(lat) else 0.0,
+    }
+    return out
+
+
+async def run_config(
+    config: dict,
+    queries: List[dict],
+    retriever: Any,
+    ks: Sequence[int],
+    lexical: Any = None,
+    reranker: Any = None,
+) -> Dict[str, Any]:
+    """Évalue une configuration (requêtes séquentielles, une requête de chauffe)."""
+    k = max(ks)
+    mode = config.get("mode", "vector")
+    rr = reranker if config.get("rerank") else None
+    ef = config.get("ef")  # par requête : jamais hérité d'une configuration précédente
+    search = lambda q: rt.search_documents(q, retriever, k=k, mode=mode, lexical=lexical, reranker=rr, ef=ef)  # noqa: E731
+
+    await search(queries[0]["question"])
+    ranks, latencies, misses = [], [], []
+    for q in queries:
+        start = time.perf_counter()
+        docs = await search(q["question"])
+        latencies.append(time.perf_counter() - start)
+        rank = first_relevant_rank(docs, q)
+        ranks.append(rank)
+        if rank is None:
+            misses.append(q["question"])
+    return {"config": config, **score(ranks, latencies, ks), "misses": misses}
+
+
+# ---------- Backends ----------
+
+def iter_docstore(lexical: Any) -> Iterable[Any]:
+    for i in np.flatnonzero(~lexical.deleted):
+        yield lexical.get_document(int(i))
+
+
+def build_memory_retriever(docs: List[Any], embeddings: Any, k: int):
+    """InMemoryVectorStore (cosinus exact) sur les chunks ; pk conservés pour la fusion RRF."""
+    from langchain_core.vectorstores import InMemoryVectorStore
+
+    store = InMemoryVectorStore(embeddings)
+    store.add_documents(docs)
+    return rt.get_retriever(store, k=k)
+
+
+async def run_benchmark(
+    queries: List[dict],
+    configs: List[dict],
+    retriever: Any,
+    ks: Sequence[int],
+    lexical: Any = None,
+    reranker: Any = None,
+) -> List[Dict[str, Any]]:
+    results = []
+    for config in configs:
+        results.append(await run_config(config, queries, retriever, ks, lexical, reranker))
+    return results
+
+
+# ---------- Rapport ----------
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def print_table(results: List[dict], ks: Sequence[int], previous: Optional[dict] = None, out=sys.stderr) -> None:
+    """Tableau lisible ; avec `previous` (résultats d'un autre commit), les écarts entre parenthèses."""
+    prev = {r["config"]["name"]: r for r in (previous or {}).get("results", [])}
+    cols = [f"recall@{k}" for k in ks] + ["mrr"]
+    print(f"{'config':<16}" + "".join(f"{c:>16}" for c in cols) + f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}", file=out)
+    for r in results:
+        old = prev.get(r["config"]["name"])
+        cells = []
+        for c in cols:
+            cell = f"{r[c]:.3f}"
+            if old is not None and c in old:
+                cell += f" ({r[c] - old[c]:+.3f})"
+            cells.append(f"{cell:>16}")
+        lat = r["latency_ms"]
+        print(f"{r['config']['name']:<16}" + "".join(cells)
+              + f"{lat['p50']:>10.1f}{lat['p95']:>10.1f}{lat['p99']:>10.1f}", file=out)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Retrieval benchmark (recall@k, MRR, latency percentiles).")
+    parser.add_argument("queries", help="labeled query set (JSONL)")
+    parser.add_argument("--backend", choices=("memory", "milvus"), default="memory")
+    parser.add_argument("--configs", help="JSON list of configurations (default: vector / words / hybrid)")
+    parser.add_argument("--k", default="1,3,5,10", help="comma-separated cut-offs for recall@k")
+    parser.add_argument("--out", help="write JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", help="previous JSON results to show deltas against")
+    args = parser.parse_args(argv)
+
+    from embedding_engine import get_engine
+    from lexical_index import LexicalIndex
+
+    ks = sorted({int(k) for k in args.k.split(",") if k.strip()})
+    queries = load_queries(args.queries)
+    configs = DEFAULT_CONFIGS
+    if args.configs:
+        with open(args.configs, "r", encoding="utf-8") as f:
+            configs = json.load(f)
+
+    lexical = LexicalIndex.load(paths.bm25_dir)
+    embeddings = get_engine()
+    if args.backend == "memory":
+        docs = list(iter_docstore(lexical))
+        if not docs:
+            print(f"No chunks in {paths.bm25_dir} — run 'python preprocess.py preprocess' first.", file=sys.stderr)
+            return 1
+        retriever = build_memory_retriever(docs, embeddings, max(ks))
+        n_chunks = len(docs)
+    else:
+        retriever = rt.get_retriever(rt.load_vectorstore(embeddings), k=max(ks))
+        n_chunks = lexical.n_docs
+
+    reranker = None
+    if any(c.get("rerank") for c in configs):
+        from reranker import CrossEncoderReranker
+        reranker = CrossEncoderReranker(paths.rerank_model_path, batch_size=paths.RERANK_BATCH_SIZE, budget_ms=0)
+
+    results = asyncio.run(run_benchmark(queries, configs, retriever, ks, lexical, reranker))
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "backend": args.backend,
+            "queries": os.path.basename(args.queries),
+            "n_queries": len(queries),
+            "n_chunks": n_chunks,
+            "ks": ks,
+        },
+        "results": results,
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+    print_table(results, ks, previous)
+
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
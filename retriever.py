@@ -6,7 +6,14 @@ les mêmes fonctions publiques :
 
 - load_vectorstore(embedding_model, collection_name="rag_docs")
 - get_retriever(vectorstore, k=NB_DOCS)
-- get_best_files(query: str, retriever, k=NB_DOCS) -> (paths, metas)
+- get_best_files(query: str, retriever, k=NB_DOCS, mode="vector") -> (paths, metas)
+- batch_retrieve(retriever, queries) -> [docs, ...]  (recherche groupée)
+
+Modes de recherche : "vector" (Milvus), "words" (BM25, lexical_index.py),
+"hybrid" (les deux, fusionnés par Reciprocal Rank Fusion — rrf_fuse).
+Sans index lexical chargé, "words" et "hybrid" retombent sur "vector".
+Un reranker optionnel (reranker.CrossEncoderReranker) rescore les candidats
+sur-échantillonnés avant de garder les k meilleurs.
 
 Prérequis:
     pip install pymilvus>=2.4.0
@@ -16,6 +23,10 @@ Configuration (dans paths.py ou via variables d'environnement):
     MILVUS_HOST (def: "localhost")
     MILVUS_PORT (def: "19530")
     MILVUS_COLLECTION (def: "rag_docs")
+    Index / recherche : index_config.py (profils "fast" / "accurate",
+    surcharge `ef` par requête)
+    VECTOR_BACKEND=faiss : index FAISS en processus (faiss_store.py) à la
+    place de Milvus, même interface
 """
 
 from __future__ import annotations
@@ -24,7 +35,10 @@ import os
 import asyncio
 from typing import List, Tuple, Any
 
+import metrics
 import paths
+from index_config import get_profile
+from answer_cache import chunk_id
 
 # Milvus vectorstore wrapper (utilise langchain-milvus si dispo, sinon community)
 try:
@@ -55,6 +69,8 @@ except Exception:
 # Nombre de documents à retourner par défaut
 NB_DOCS = 2
 
+SEARCH_MODES = ("vector", "words", "hybrid")
+
 
 def _get_milvus_cfg() -> Tuple[str, str, str]:
     """Lit la config Milvus depuis paths.py (si définie) ou depuis l'environnement."""
@@ -64,7 +80,7 @@ def _get_milvus_cfg() -> Tuple[str, str, str]:
     return host, port, collection
 
 
-def load_vectorstore(embedding_model: Any, collection_name: str | None = None) -> Milvus:
+def load_vectorstore(embedding_model: Any, collection_name: str | None = None) -> Any:
     """
     Initialise (ou ouvre) une collection Milvus pour le RAG.
 
@@ -73,8 +89,13 @@ def load_vectorstore(embedding_model: Any, collection_name: str | None = None) -
         collection_name: nom de la collection Milvus (optionnel)
 
     Returns:
-        Milvus vectorstore (LangChain)
+        Milvus vectorstore (LangChain), ou faiss_store.FaissVectorStore si
+        paths.VECTOR_BACKEND == "faiss" (collection_name ignoré)
     """
+    if paths.VECTOR_BACKEND == "faiss":
+        from faiss_store import load_faiss_store
+        return load_faiss_store(embedding_model)
+
     host, port, default_collection = _get_milvus_cfg()
     collection_name = collection_name or default_collection
 
@@ -82,13 +103,10 @@ def load_vectorstore(embedding_model: Any, collection_name: str | None = None) -
     # Note: langchain_milvus.Milvus expects 'uri' in connection_args
     connections.connect(alias="default", host=host, port=port)
 
-    # Bon compromis pour mpnet (COSINE) — ajustables si besoin
-    index_params = {
-        "index_type": "HNSW",
-        "metric_type": "COSINE",
-        "params": {"M": 16, "efConstruction": 200},
-    }
-    search_params = {"metric_type": "COSINE", "params": {"ef": 128}}
+    # Profil d'index (index_config.py) ; le profil "accurate" est la recherche par défaut
+    profile = get_profile()
+    index_params = profile.index_params()
+    search_params = profile.search_params("accurate")
 
     # Build URI for Milvus connection
     milvus_uri = f"http://{host}:{port}"
@@ -146,7 +164,134 @@ def get_retriever(vectorstore: Any, k: int = NB_DOCS) -> VectorStoreRetrieverK:
     )
 
 
-async def get_best_files(query: str, retriever: VectorStoreRetrieverK, k: int = NB_DOCS) -> Tuple[List[str], List[dict]]:
+def rrf_fuse(ranked_lists: List[List[Any]], k: int | None = None, limit: int | None = None) -> List[Any]:
+    """
+    Reciprocal Rank Fusion : score(doc) = somme des 1 / (k + rang) sur les listes.
+    Les doublons sont identifiés par chunk_id (pk Milvus) ; la première occurrence
+    (liste la plus à gauche) est conservée.
+    """
+    k = paths.RRF_K if k is None else k
+    scores: dict = {}
+    docs: dict = {}
+    for ranked in ranked_lists:
+        for rank, d in enumerate(ranked or []):
+            cid = chunk_id(d)
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rank + 1)
+            docs.setdefault(cid, d)
+    order = sorted(scores, key=scores.get, reverse=True)
+    return [docs[c] for c in order[:limit]]
+
+
+def _lexical_ready(lexical: Any) -> bool:
+    return lexical is not None and lexical.n_docs > 0
+
+
+async def _lexical_search(lexical: Any, query: str, k: int) -> List[Any]:
+    loop = asyncio.get_running_loop()
+    with metrics.timed(metrics.SEARCH_SECONDS.labels("words")):
+        return await loop.run_in_executor(None, lexical.search_documents, query, k)
+
+
+async def _embed_queries(emb: Any, queries: List[str]) -> List[List[float]]:
+    # embed_queries (embedding_cache.CachedEmbeddings) ne recalcule que les requêtes inconnues
+    embed = getattr(emb, "embed_queries", None) or emb.embed_documents
+    loop = asyncio.get_running_loop()
+    with metrics.timed(metrics.EMBEDDING_SECONDS):
+        return await loop.run_in_executor(None, embed, list(queries))
+
+
+def _search_param(vs: Any, k: int, profile: str | None = None, ef: int | None = None) -> dict | None:
+    """Paramètres Milvus pour une requête (None = ceux du vectorstore)."""
+    if profile is None and ef is None:
+        return None
+    if not isinstance(getattr(vs, "search_params", None), dict):
+        return None  # backend sans paramètres de recherche (ex. InMemoryVectorStore)
+    return get_profile().search_params(profile, ef=ef, k=k)
+
+
+async def _vector_search(vs: Any, vector: List[float], k: int, param: dict | None = None) -> List[Any]:
+    kwargs = {"param": param} if param is not None else {}
+    with metrics.timed(metrics.SEARCH_SECONDS.labels("vector")):
+        return await vs.asimilarity_search_by_vector(vector, k=k, **kwargs)
+
+
+def _has_vector_api(vs: Any) -> bool:
+    return getattr(vs, "embeddings", None) is not None and hasattr(vs, "asimilarity_search_by_vector")
+
+
+async def _dense_search(
+    retriever: VectorStoreRetrieverK, query: str, k: int, profile: str | None = None, ef: int | None = None
+) -> List[Any]:
+    """Recherche vectorielle, embedding et recherche Milvus mesurés séparément."""
+    vs = getattr(retriever, "vectorstore", None)
+    if not isinstance(retriever, VectorStoreRetriever) or not _has_vector_api(vs):
+        retriever.actual_k = k
+        with metrics.timed(metrics.SEARCH_SECONDS.labels("vector")):
+            return await retriever.ainvoke(query)
+    vector = (await _embed_queries(vs.embeddings, [query]))[0]
+    return await _vector_search(vs, vector, k, _search_param(vs, k, profile, ef))
+
+
+async def search_documents(
+    query: str,
+    retriever: VectorStoreRetrieverK,
+    k: int = NB_DOCS,
+    mode: str = "vector",
+    lexical: Any = None,
+    reranker: Any = None,
+    profile: str | None = None,
+    ef: int | None = None,
+) -> List[Any]:
+    """
+    Recherche selon `mode` ("vector", "words", "hybrid") ; renvoie les Documents.
+    Avec `reranker`, les k candidats sont réordonnés par le cross-encoder.
+    `profile` ("fast" / "accurate") et `ef` règlent la recherche Milvus de
+    cette requête seulement (par défaut : paramètres du vectorstore).
+    """
+    docs = await _search(query, retriever, k, mode, lexical, profile, ef)
+    if reranker is not None:
+        docs = await reranker.arerank(query, docs, k)
+    return docs
+
+
+async def _search(
+    query: str,
+    retriever: VectorStoreRetrieverK,
+    k: int,
+    mode: str,
+    lexical: Any,
+    profile: str | None = None,
+    ef: int | None = None,
+) -> List[Any]:
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode '{mode}' (expected one of {SEARCH_MODES}).")
+    if mode != "vector" and not _lexical_ready(lexical):
+        mode = "vector"
+
+    if mode == "words":
+        return await _lexical_search(lexical, query, k)
+
+    if mode == "hybrid":
+        n = max(k, paths.HYBRID_CANDIDATES)
+        with metrics.timed(metrics.SEARCH_SECONDS.labels("hybrid")):
+            dense, sparse = await asyncio.gather(
+                _dense_search(retriever, query, n, profile, ef), _lexical_search(lexical, query, n)
+            )
+            return rrf_fuse([dense, sparse], limit=k)
+
+    return await _dense_search(retriever, query, k, profile, ef)
+
+
+async def get_best_files(
+    query: str,
+    retriever: VectorStoreRetrieverK,
+    k: int = NB_DOCS,
+    mode: str = "vector",
+    lexical: Any = None,
+    reranker: Any = None,
+    profile: str | None = None,
+    ef: int | None = None,
+) -> Tuple[List[str], List[dict]]:
     """
     Lance une recherche via le retriever et renvoie (list_paths, list_metas).
 
@@ -154,19 +299,76 @@ async def get_best_files(query: str, retriever: VectorStoreRetrieverK, k: int =
         query: requête utilisateur
         retriever: retriever renvoyé par get_retriever(...)
         k: nombre de documents à retourner
+        mode: "vector", "words" (BM25) ou "hybrid" (fusion RRF)
+        lexical: lexical_index.LexicalIndex (requis pour "words" / "hybrid")
+        reranker: reranker.CrossEncoderReranker optionnel (réordonne les k chunks)
+        profile: profil de recherche "fast" / "accurate" (index_config.py)
+        ef: surcharge du paramètre de recherche (ef HNSW / nprobe IVF)
 
     Returns:
         (doc_paths, metas)
     """
-    # Forcer k au cas où l'appelant change la valeur
-    retriever.actual_k = k
-    docs = await retriever.ainvoke(query)
+    docs = await search_documents(
+        query, retriever, k=k, mode=mode, lexical=lexical, reranker=reranker, profile=profile, ef=ef
+    )
 
     doc_paths = [d.metadata.get("source") for d in docs]
     metas = [d.metadata for d in docs]
     return doc_paths, metas
 
 
+async def batch_retrieve(
+    retriever: VectorStoreRetrieverK,
+    queries: List[str],
+    return_vectors: bool = False,
+    mode: str = "vector",
+    lexical: Any = None,
+    reranker: Any = None,
+):
+    """
+    Recherche groupée pour plusieurs requêtes : un seul passage d'encodage
+    (embed_documents) pour tout le lot, puis une recherche par vecteur.
+
+    Args:
+        retriever: retriever renvoyé par get_retriever(...)
+        queries: liste des requêtes utilisateur
+        return_vectors: renvoie aussi les embeddings des requêtes
+            (None par requête si le backend ne les expose pas)
+        mode: "vector" ou "hybrid" (fusion RRF avec l'index BM25 `lexical`) ;
+            "words" est traité comme "hybrid" : le chat garde toujours la
+            recherche vectorielle (embeddings réutilisés par le cache sémantique)
+        reranker: sur-échantillonne paths.RERANK_CANDIDATES candidats par requête,
+            rescorés par le cross-encoder, puis garde les k meilleurs
+
+    Returns:
+        une liste de Documents par requête (même ordre que `queries`),
+        ou (docs_par_requete, vecteurs) si return_vectors=True
+    """
+    if not queries:
+        return ([], []) if return_vectors else []
+
+    retriever._apply_k()
+    k = (getattr(retriever, "search_kwargs", None) or {}).get("k", NB_DOCS)
+    hybrid = mode != "vector" and _lexical_ready(lexical)
+    k_final = max(k, paths.RERANK_CANDIDATES) if reranker is not None else k
+    k_dense = max(k_final, paths.HYBRID_CANDIDATES) if hybrid else k_final
+    vs = retriever.vectorstore
+
+    # Backend sans accès direct aux embeddings : on retombe sur le batch LangChain
+    if not _has_vector_api(vs):
+        docs = await retriever.abatch(list(queries))
+        return (docs, [None] * len(docs)) if return_vectors else docs
+
+    vectors = await _embed_queries(vs.embeddings, queries)
+    docs = list(await asyncio.gather(*(_vector_search(vs, v, k_dense) for v in vectors)))
+    if hybrid:
+        sparse = await asyncio.gather(*(_lexical_search(lexical, q, k_dense) for q in queries))
+        docs = [rrf_fuse([d, s], limit=k_final) for d, s in zip(docs, sparse)]
+    if reranker is not None:
+        docs = list(await asyncio.gather(*(reranker.arerank(q, d, k) for q, d in zip(queries, docs))))
+    return (docs, vectors) if return_vectors else docs
+
+
 def parse_retriever_input(x: Any) -> str:
     """Extrait la requête utilisateur depuis divers formats."""
     if isinstance(x, str):
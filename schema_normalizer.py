@@ -0,0 +1,187 @@
+"""
+schema_normalizer.py — alignement des métadonnées sur le schéma Milvus existant
+
+Remplace les deux copies (fast_api_app.normalize_docs_for_existing_schema et
+preprocess._normalize_docs_for_collection) qui relisaient le schéma
+(Collection(...) = un RPC) à chaque appel, soit une fois par PDF ingéré.
+
+- le schéma est mis en cache par collection ; après SCHEMA_CACHE_TTL_S on
+  relit la description et on ne reconstruit le plan que si la version a
+  changé (collection recréée : collection_id / champs différents)
+- plan précompilé : un tuple (champ, caster, défaut) par champ scalaire ;
+  la normalisation de milliers de chunks est une seule boucle
+- invalidate() après création / suppression de la collection ou un insert
+  refusé (schéma peut-être différent)
+
+Règles (inchangées) : on garde UNIQUEMENT les champs présents dans la
+collection (hors texte / vecteur / clé primaire), les champs absents prennent
+la valeur par défaut du type, une valeur non convertible aussi.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymilvus import Collection, DataType
+
+import paths
+
+_INT_TYPES = (DataType.INT8, DataType.INT16, DataType.INT32, DataType.INT64)
+_FLOAT_TYPES = (DataType.FLOAT, DataType.DOUBLE)
+_TRUE = ("true", "1", "yes", "y", "t")
+
+Field = Tuple[str, Callable[[Any], Any], Callable[[], Any]]
+
+
+def default_factory(dtype) -> Callable[[], Any]:
+    """Valeur par défaut d'un type Milvus (nouvel objet à chaque appel pour JSON)."""
+    if dtype in _INT_TYPES:
+        return int
+    if dtype in _FLOAT_TYPES:
+        return float
+    if dtype == DataType.BOOL:
+        return bool
+    if dtype == DataType.JSON:
+        return dict
+    return str
+
+
+def _to_bool(val):
+    if isinstance(val, str):
+        return val.strip().lower() in _TRUE
+    return bool(val)
+
+
+def make_caster(dtype) -> Callable[[Any], Any]:
+    """Conversion d'une valeur vers `dtype` ; valeur par défaut si impossible."""
+    default = default_factory(dtype)
+    if dtype == DataType.VARCHAR:
+        convert = lambda v: v if type(v) is str else ("" if v is None else str(v))  # noqa: E731
+    elif dtype in _INT_TYPES:
+        convert = lambda v: 0 if v is None or v == "" else int(v)  # noqa: E731
+    elif dtype in _FLOAT_TYPES:
+        convert = lambda v: 0.0 if v is None or v == "" else float(v)  # noqa: E731
+    elif dtype == DataType.BOOL:
+        convert = _to_bool
+    elif dtype == DataType.JSON:
+        convert = lambda v: v if isinstance(v, (dict, list)) else {}  # noqa: E731
+    else:
+        return lambda v: v
+
+    def cast(val):
+        try:
+            return convert(val)
+        except Exception:
+            return default()
+    return cast
+
+
+class SchemaPlan:
+    """Table (champ, caster, défaut) d'une version du schéma."""
+
+    def __init__(self, fields: Iterable[Tuple[str, Any]], version: Any = None):
+        self.version = version
+        self.fields: Tuple[Field, ...] = tuple(
+            (name, make_caster(dtype), default_factory(dtype)) for name, dtype in fields
+        )
+
+    def apply(self, docs: List[Any]) -> List[Any]:
+        fields = self.fields
+        for d in docs:
+            md = d.metadata or {}
+            d.metadata = {
+                name: cast(md[name]) if name in md else default()
+                for name, cast, default in fields
+            }
+        return docs
+
+
+def _describe(collection_name: str) -> Tuple[Any, List[Tuple[str, Any]]]:
+    """(version, [(champ, dtype)]) : un seul appel Milvus."""
+    col = Collection(collection_name)
+    fields = [(f.name, f.dtype) for f in col.schema.fields]
+    try:
+        desc = col.describe() or {}
+        ident = desc.get("collection_id") or desc.get("created_timestamp")
+    except Exception:
+        ident = None
+    return (ident, tuple(fields)), fields
+
+
+class SchemaNormalizer:
+    """Plans de normalisation par collection, relus au plus tous les `ttl_s`."""
+
+    def __init__(self, ttl_s: float = 300.0, describe: Callable[[str], Tuple[Any, list]] = _describe):
+        self.ttl_s = float(ttl_s)
+        self._describe = describe
+        self._plans: Dict[Tuple[str, frozenset], Tuple[SchemaPlan, float]] = {}
+        self._lock = threading.Lock()
+        self.describes = 0
+
+    def plan(self, collection_name: str, ignore: Iterable[str] = ()) -> SchemaPlan:
+        key = (collection_name, frozenset(ignore))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._plans.get(key)
+            if cached is not None and now - cached[1] < self.ttl_s:
+                return cached[0]
+
+        version, fields = self._describe(collection_name)
+        with self._lock:
+            self.describes += 1
+            cached = self._plans.get(key)
+            if cached is not None and cached[0].version == version:
+                plan = cached[0]  # même schéma : on garde les casters
+            else:
+                plan = SchemaPlan([(n, t) for n, t in fields if n not in key[1]], version)
+            self._plans[key] = (plan, now)
+        return plan
+
+    @staticmethod
+    def _ignored(vectorstore) -> set:
+        return {
+            getattr(vectorstore, "text_field", "text"),
+            getattr(vectorstore, "vector_field", "vector"),
+            "id",
+            "pk",
+        }
+
+    def normalize(self, vectorstore, collection_name: str, docs: List[Any]) -> List[Any]:
+        """Aligne `docs.metadata` sur le schéma EXISTANT de la collection (en place)."""
+        if getattr(vectorstore, "schema_free", False):
+            return docs  # backend sans schéma (faiss_store)
+        return self.plan(collection_name, self._ignored(vectorstore)).apply(docs)
+
+    def missing(self, vectorstore, collection_name: str, names: Iterable[str]) -> List[str]:
+        """Champs de `names` que normalize() retirerait (absents de la collection)."""
+        if getattr(vectorstore, "schema_free", False):
+            return []
+        kept = {name for name, _, _ in self.plan(collection_name, self._ignored(vectorstore)).fields}
+        return [n for n in names if n not in kept]
+
+    def invalidate(self, collection_name: Optional[str] = None) -> None:
+        with self._lock:
+            if collection_name is None:
+                self._plans.clear()
+            else:
+                for key in [k for k in self._plans if k[0] == collection_name]:
+                    del self._plans[key]
+
+
+_normalizer = SchemaNormalizer(ttl_s=paths.SCHEMA_CACHE_TTL_S)
+
+
+def normalize_docs(vectorstore, collection_name: str, docs: List[Any]) -> List[Any]:
+    """Normaliseur partagé du processus (API ou preprocess)."""
+    return _normalizer.normalize(vectorstore, collection_name, docs)
+
+
+def missing_fields(vectorstore, collection_name: str, names: Iterable[str]) -> List[str]:
+    """Métadonnées de `names` qui seraient perdues à l'insertion (plan en cache, sans RPC en plus)."""
+    return _normalizer.missing(vectorstore, collection_name, names)
+
+
+def invalidate(collection_name: Optional[str] = None) -> None:
+    _normalizer.invalidate(collection_name)
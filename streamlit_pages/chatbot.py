@@ -2,9 +2,10 @@
 import streamlit as st
 import requests
 import uuid
-import time
+import json
 import os
 from datetime import datetime
+import dashboard_metrics
 import redis_db
 from streamlit_cookies_manager import EncryptedCookieManager
 
@@ -35,11 +36,47 @@ def save_feedback(msg_index):
     key = f"feedback:{'positive' if fb else 'negative'}:{date_str}"
     redis_client.incr(key)
 
-def stream_data_with_time(text, duration_str):
-    """Streaming mot-à-mot + affichage de la durée à la fin."""
-    for word in (text + f" \n\n*⏱️ {duration_str}*").split(" "):
-        yield word + " "
-        time.sleep(0.05)
+class ChatStreamError(RuntimeError):
+    """Échec de /chat/stream ; `status` = statut HTTP (429 / 503 : service surchargé)."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def stream_chat(user_input, session_id, final):
+    """
+    Consomme le flux SSE de /chat/stream : renvoie les fragments au fil de l'eau
+    et remplit `final` avec la trame finale (response, sources, duration).
+    Lève ChatStreamError sur un statut HTTP non-200, une trame d'erreur ou un
+    flux terminé sans trame finale.
+    """
+    with requests.post(
+        f"{FASTAPI_URL}/chat/stream",
+        params={"user_input": user_input, "session_id": session_id},
+        headers={**headers, "Accept": "text/event-stream"},
+        stream=True,
+        timeout=(5, None),
+    ) as r:
+        if r.status_code != 200:
+            raise ChatStreamError(f"HTTP {r.status_code}", status=r.status_code)
+        event = None
+        for line in r.iter_lines(decode_unicode=True):
+            if not line:
+                event = None
+                continue
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[5:].strip())
+                if event == "token":
+                    yield data.get("text", "")
+                elif event == "final":
+                    final.update(data)
+                elif event == "error":
+                    raise ChatStreamError(data.get("error", "stream error"), status=data.get("status"))
+        if not final:
+            raise ChatStreamError("stream ended without a final event")
 
 # ========================================================================
 # Manage persistent session_id via cookie
@@ -83,6 +120,9 @@ st.page_link("streamlit_pages/home.py", label="Home", icon="🏠", disabled=st.s
 
 st.header("Chat with Llama Model 🤖")
 
+if st.session_state.get("chat_error"):
+    st.error(st.session_state.pop("chat_error"))
+
 # Show chat history before new user inputs
 for idx, msg in enumerate(st.session_state.history):
     with st.chat_message(msg["role"]):
@@ -126,44 +166,35 @@ if user_input :
     st.session_state.history.append({"role": "user", "content": user_input})
 
     # save (stats) for daily users
-    date_str = datetime.utcnow().date().isoformat()
-    redis_client.sadd(f"users:{date_str}", session_id)
+    dashboard_metrics.record_user(redis_client, session_id)
 
-    # call API +  time
-    with st.spinner("Génération en cours…", show_time=True):
-        resp = requests.post(
-            f"{FASTAPI_URL}/chat",
-            params={"user_input": user_input, "session_id": session_id},
-            headers=headers
-        ).json()
+    # call API (streaming SSE) + display tokens as they arrive
+    final = {}
+    with st.chat_message("assistant"):
+        try:
+            st.write_stream(stream_chat(user_input, session_id, final))
+        except Exception as e:
+            # 429 (file pleine) / 503 (échéance) : surcharge ; le reste est une vraie erreur
+            print(f"[CHAT][ERROR] {type(e).__name__}: {e}")
+            st.session_state.history.pop()
+            st.session_state.disable_button = False
+            st.session_state.disable = False
+            if getattr(e, "status", None) in (429, 503):
+                st.session_state.chat_error = "⚠️ Le service est surchargé, veuillez réessayer dans quelques instants."
+            else:
+                st.session_state.chat_error = f"⚠️ Erreur lors de la génération de la réponse : {e}"
+            st.rerun()
 
     # calculation and duration storing
-    elapsed = resp.get("duration",0.0)
-    m, s = divmod(elapsed, 60)
-    formatted = f"{int(m)}:{int(s):02d}"
+    elapsed = final.get("duration", 0.0)
 
-    # add AI response on chat history
-    ai_text = resp["response"]
+    # add AI response (with sources block) on chat history
     st.session_state.history.append({
         "role": "assistant",
-        "content": ai_text,
+        "content": final.get("response", ""),
         "duration": elapsed
     })
 
-   
-
-    # display ai response and feedbacks widget
-    with st.chat_message("assistant"):
-        st.write_stream(stream_data_with_time(ai_text, formatted))
-        idx = len(st.session_state.history) - 1
-        st.session_state[f"feedback_{idx}"] = None
-        st.feedback(
-            options="thumbs",
-            key=f"feedback_{idx}",
-            on_change=save_feedback,
-            args=[idx],
-        )
-    
     st.session_state.disable_button = False
     st.session_state.disable = False
     st.rerun()
\ No newline at end of file
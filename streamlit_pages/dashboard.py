@@ -1,7 +1,7 @@
 # dashbord.py
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
+import dashboard_metrics
 import redis_db
 
 
@@ -26,33 +26,40 @@ if not st.session_state.authed:
     st.stop()
 
 
-# Redis client
-r = redis_db.create_redis_client()
+# Redis client (one per Streamlit server, not per rerun)
+@st.cache_resource
+def get_redis():
+    return redis_db.create_redis_client()
 
-# 7 last days
-today = datetime.utcnow().date()
-days = [today - timedelta(days=i) for i in range(6, -1, -1)]
-dates = [d.isoformat() for d in days]
 
-# Retrieve data from redis
-user_counts = [r.scard(f"users:{date}") for date in dates]
-pos = [int(r.get(f"feedback:positive:{date}") or 0) for date in dates]
-neg = [int(r.get(f"feedback:negative:{date}") or 0) for date in dates]
-responses = [int(r.get(f"responses:{date}") or 0) for date in dates]
+# Daily rollups: whole range in one pipelined call, cached briefly across reruns
+@st.cache_data(ttl=60, show_spinner=False)
+def load_rollups(n_days: int, end: str) -> pd.DataFrame:
+    dates = dashboard_metrics.last_days(n_days, end)
+    rows = dashboard_metrics.fetch_rollups(get_redis(), dates)
+    return pd.DataFrame(rows, index=dates).fillna(0)
 
 
+st.page_link("streamlit_pages/home.py", label="Home", icon="🏠")
+
+# Streamlit UI
+st.title("📊 Dashboard RAG")
+
+n_days = st.radio("Period", [7, 30, 90], horizontal=True, format_func=lambda n: f"{n} days")
+df = load_rollups(n_days, dashboard_metrics.today())
+dates = list(df.index)
 
-# the mean of duration
-avg_response_times = []
-for date in dates:
-    # list string converted to float
-    lst = r.lrange(f"response_times:{date}", 0, -1)
-    floats = [float(v) for v in lst] if lst else []
-    avg = sum(floats) / len(floats) if floats else 0
-    avg_response_times.append(round(avg, 2))
+user_counts = df["users"].astype(int).tolist()
+pos = df["positive"].astype(int).tolist()
+neg = df["negative"].astype(int).tolist()
+responses = df["responses"].astype(int).tolist()
 
-# DataFrame for duration
-df_rt = pd.DataFrame({"Temps de réponse moyen (s)": avg_response_times}, index=dates)
+# DataFrame for duration (daily latency histograms)
+df_rt = pd.DataFrame({
+    "p50 (s)": df["p50"].round(2),
+    "p95 (s)": df["p95"].round(2),
+    "p99 (s)": df["p99"].round(2),
+}, index=dates)
 
 
 # Calculation of all feedbacks and percentage
@@ -76,11 +83,6 @@ df_rate = pd.DataFrame({
     "Taux de feedback (%)": [round(rate * 100, 2) for rate in rates]
 }, index=dates)
 
-st.page_link("streamlit_pages/home.py", label="Home", icon="🏠")
-
-# Streamlit UI
-st.title("📊 Dashboard RAG")
-
 st.subheader("Users per day")
 st.bar_chart(df_users)
 
@@ -93,9 +95,9 @@ st.subheader("Feedbacks rate (feedbacks / réponses IA)")
 dernier_taux = df_rate["Taux de feedback (%)"].iloc[-1]
 st.metric("Current feedbacks rate (%)", f"{dernier_taux}%")
 
-# Graph for the feedbacks of the week
+# Graph for the feedbacks of the period
 st.area_chart(df_rate)
 
 # Graph for the duration 
-st.subheader("⏱️ average response time per day in seconds")
+st.subheader("⏱️ response time per day in seconds (p50 / p95 / p99)")
 st.line_chart(df_rt)
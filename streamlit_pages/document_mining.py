@@ -10,6 +10,8 @@ ss.setdefault("pdf_refs", [])
 ss.setdefault("metadatas", [])
 ss.setdefault("selected_pdf", None)
 ss.setdefault("selected_meta", {})
+ss.setdefault("anchors", [])
+ss.setdefault("selected_page", None)
 
 # ---------- 2. Barre latérale : options -------------------
 st.sidebar.header("Options")
@@ -17,14 +19,19 @@ show_meta = st.sidebar.checkbox("Afficher les métadonnées", value=False)
 
 
 # ---------- 2b.  Mode de recherche ------------------------
-mode = None 
+MODES = {"Sémantique": "vector", "Mots-clés": "words", "Hybride": "hybrid"}
+mode_label = st.sidebar.radio(
+    "Mode de recherche", list(MODES), index=2,
+    help="Mots-clés / Hybride : utile pour les codes d'erreur et références exactes.",
+)
+mode = MODES[mode_label]
 
 # ---------- 3. Zone de requête ------------------------------
 st.page_link("streamlit_pages/home.py", label="Home", icon="🏠")
 query = st.text_input("Entrez votre requête")
 
 if st.button("Chercher") and query.strip():
-    payload = {"query": query}  # 'mode' retiré
+    payload = {"query": query, "mode": mode}
 
     try:
         r = requests.post(f"{FASTAPI_URL}/retrieve", json=payload, timeout=15)
@@ -46,7 +53,9 @@ if st.button("Chercher") and query.strip():
 
     ss.pdf_refs   = data.get("documents", []) or []
     ss.metadatas  = data.get("metadatas", []) or []
+    ss.anchors    = data.get("anchors", []) or []
     ss.selected_pdf  = None
+    ss.selected_page = None
     ss.selected_meta = {}
     st.rerun()  # relance pour afficher les résultats
 
@@ -59,16 +68,30 @@ if not ss.pdf_refs:
 else:
     for i, path in enumerate(ss.pdf_refs):
         name = os.path.basename(path) or f"doc_{i}"
-        if st.button(name, key=f"btn_{i}"):
+        anchors = ss.anchors[i] if i < len(ss.anchors) else []
+        label = f"{name} — p. {anchors[0]['page']}" if anchors else name
+        clicked = st.button(label, key=f"btn_{i}")
+        target = anchors[0]["page"] if clicked and anchors else None
+        # autres pages où la requête a matché dans ce document
+        if len(anchors) > 1:
+            cols = st.columns(min(len(anchors) - 1, 6))
+            for j, a in enumerate(anchors[1:7]):
+                if cols[j].button(f"p. {a['page']}", key=f"btn_{i}_{j}", help=a.get("heading") or None):
+                    clicked, target = True, a["page"]
+        if clicked:
             ss.selected_pdf  = path
             ss.selected_meta = ss.metadatas[i] if i < len(ss.metadatas) else {}
+            ss.selected_page = target
             st.rerun()
 
 # ---------- 5. Visionneuse PDF + métadonnées ----------------
 if ss.selected_pdf:
     st.markdown("### Visionneuse PDF")
+    if ss.selected_page:
+        st.caption(f"Ouvert à la page {ss.selected_page}")
     with open(ss.selected_pdf, "rb") as f:
-        pdf_viewer(input=f.read(), width=700, height=900)
+        # scroll_to_page : la visionneuse s'ouvre directement sur la page du hit
+        pdf_viewer(input=f.read(), width=700, height=900, scroll_to_page=ss.selected_page)
 
     if show_meta and ss.selected_meta:
         st.markdown("#### Métadonnées")
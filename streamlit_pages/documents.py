@@ -1,23 +1,70 @@
 import streamlit as st
 import requests
 import os
+import time
 
 FASTAPI_URL = os.getenv("FASTAPI_URL", "http://127.0.0.1:8000")
+POLL_S = 1.0
 
 st.page_link("streamlit_pages/home.py", label="Home", icon="🏠")
 st.header("Dataset PDF Documents :file_folder:")
 
-uploaded_file = st.file_uploader("Upload a PDF document", type=["pdf"])
-if uploaded_file is not None:
-    with st.spinner("Indexation en cours..."):
-        files = {
-            "file": (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")
-        }
+
+def _file_progress(f):
+    """Fraction indicative : extraction (1/3) puis insertion des chunks (2/3)."""
+    if f["status"] in ("done", "failed"):
+        return 1.0
+    pages = f["pages_extracted"] / f["pages_total"] if f["pages_total"] else 0.0
+    rows = f["rows_inserted"] / f["chunks"] if f["chunks"] else 0.0
+    return min(1.0, pages / 3 + 2 * rows / 3)
+
+
+uploaded_files = st.file_uploader("Upload PDF documents", type=["pdf"], accept_multiple_files=True)
+if uploaded_files and st.button("Indexer", type="primary"):
+    files = [
+        ("files", (f.name, f.getvalue(), "application/pdf"))
+        for f in uploaded_files
+    ]
+    try:
+        r = requests.post(f"{FASTAPI_URL}/upload", files=files, timeout=60)
+    except Exception as e:
+        st.error(f"Impossible d'appeler l'API /upload : {e}")
+        st.stop()
+    if not r.ok:
+        st.error(f"Erreur d'indexation : {r.text}")
+        st.stop()
+
+    job = r.json()
+    for rej in job.get("rejected", []):
+        st.warning(f"{rej['filename']} refusé : {rej['error']}")
+
+    # Suivi de l'ingestion en tâche de fond (GET /upload/{job_id})
+    bar = st.progress(0.0, text="Indexation en cours...")
+    details = st.empty()
+    while True:
         try:
-            r = requests.post(f"{FASTAPI_URL}/upload", files=files, timeout=120)
-            if r.ok:
-                st.success(f" {r.json().get('message', 'Indexed')} ({uploaded_file.name})")
-            else:
-                st.error(f"Erreur d'indexation : {r.text}")
+            status = requests.get(f"{FASTAPI_URL}/upload/{job['job_id']}", timeout=10).json()
         except Exception as e:
-            st.error(f"Impossible d'appeler l'API /upload : {e}")
+            st.error(f"Suivi de l'indexation impossible : {e}")
+            break
+        done = sum(_file_progress(f) for f in status["files"]) / max(1, len(status["files"]))
+        bar.progress(done, text=f"Indexation : {status['status']}")
+        details.table([
+            {
+                "Fichier": f["filename"],
+                "Étape": f["status"],
+                "Pages": f"{f['pages_extracted']}/{f['pages_total']}",
+                "Chunks embeddés": f"{f['chunks_embedded']}/{f['chunks']}",
+                "Lignes insérées": f["rows_inserted"],
+            }
+            for f in status["files"]
+        ])
+        if status["finished_at"] is not None:
+            break
+        time.sleep(POLL_S)
+
+    for f in status.get("files", []):
+        if f["status"] == "done":
+            st.success(f"Indexé ({f['filename']})")
+        elif f["status"] == "failed":
+            st.error(f"Erreur d'indexation ({f['filename']}) : {f['error']}")
@@ -36,3 +36,1028 @@ def test_redis_chat_message_history():
     assert isinstance(messages[0], HumanMessage)
     assert isinstance(messages[1], SystemMessage)
     assert isinstance(messages[2], AIMessage)
+
+
+@pytest.mark.asyncio
+async def test_chat_scheduler_batches_and_backpressure(monkeypatch):
+    import chat_scheduler
+
+    batches = []
+
+    async def fake_batch_retrieve(retriever, queries, return_vectors=False, **kwargs):
+        batches.append(list(queries))
+        return [[f"doc-{q}"] for q in queries], [None] * len(queries)
+
+    async def fake_stream(user_input, chain, chat_hist, context):
+        yield "token", "..."
+        yield "final", {"response": f"{chain}:{user_input}:{context[0]}", "duration": 0.1}
+
+    monkeypatch.setattr(chat_scheduler.rt, "batch_retrieve", fake_batch_retrieve)
+    monkeypatch.setattr(chat_scheduler.generator, "stream_chat_st", fake_stream)
+    monkeypatch.setattr(chat_scheduler.generator, "get_chat_hist_instance", lambda sid: MagicMock())
+
+    sched = chat_scheduler.ChatScheduler(None, ["slot0", "slot1"], max_batch=4, batch_window_ms=50, max_queue=3)
+    reqs = [sched.submit(f"s{i}", f"q{i}") for i in range(3)]
+    with pytest.raises(chat_scheduler.QueueFullError):
+        sched.submit("s3", "q3")
+
+    sched.start()
+    results = [await sched.wait(r) for r in reqs]
+    await sched.stop()
+
+    assert batches == [["q0", "q1", "q2"]]
+    assert [r[0].split(":", 1)[1] for r in results] == ["q0:doc-q0", "q1:doc-q1", "q2:doc-q2"]
+    assert sched.queue_depth == 0
+
+
+@pytest.mark.asyncio
+async def test_chat_scheduler_streams_tokens(monkeypatch):
+    import chat_scheduler
+
+    async def fake_batch_retrieve(retriever, queries, return_vectors=False, **kwargs):
+        return [["doc"] for _ in queries], [None] * len(queries)
+
+    async def fake_stream(user_input, chain, chat_hist, context):
+        for tok in ("Hel", "lo"):
+            yield "token", tok
+        yield "final", {"response": "Hello", "sources": [], "duration": 0.2, "ttft": 0.1}
+
+    monkeypatch.setattr(chat_scheduler.rt, "batch_retrieve", fake_batch_retrieve)
+    monkeypatch.setattr(chat_scheduler.generator, "stream_chat_st", fake_stream)
+    monkeypatch.setattr(chat_scheduler.generator, "get_chat_hist_instance", lambda sid: MagicMock())
+
+    sched = chat_scheduler.ChatScheduler(None, ["slot0"], batch_window_ms=0)
+    sched.start()
+    req = sched.submit("s", "q", stream=True)
+    tokens = []
+    while (tok := await req.tokens.get()) is not None:
+        tokens.append(tok)
+    final = await req.future
+    await sched.stop()
+
+    assert tokens == ["Hel", "lo"]
+    assert final["response"] == "Hello"
+
+
+@pytest.mark.asyncio
+async def test_chat_scheduler_deadline_frees_generation_slot(monkeypatch):
+    import asyncio
+    import chat_scheduler
+
+    async def fake_batch_retrieve(retriever, queries, return_vectors=False, **kwargs):
+        return [["doc"] for _ in queries], [None] * len(queries)
+
+    produced = []
+
+    async def slow_stream(user_input, chain, chat_hist, context):
+        for i in range(1000):
+            await asyncio.sleep(0.01)
+            produced.append(i)
+            yield "token", "x"
+        yield "final", {"response": "x" * 1000, "duration": 10.0}
+
+    monkeypatch.setattr(chat_scheduler.rt, "batch_retrieve", fake_batch_retrieve)
+    monkeypatch.setattr(chat_scheduler.generator, "stream_chat_st", slow_stream)
+    monkeypatch.setattr(chat_scheduler.generator, "get_chat_hist_instance", lambda sid: MagicMock())
+
+    sched = chat_scheduler.ChatScheduler(None, ["slot0"], batch_window_ms=0)
+    sched.start()
+    req = sched.submit("s", "q", timeout=0.1)
+    with pytest.raises(chat_scheduler.DeadlineExceededError):
+        await sched.wait(req)
+    await asyncio.sleep(0.05)
+    n = len(produced)
+    await asyncio.sleep(0.05)
+
+    assert len(produced) == n < 1000  # generation stopped at the next fragment
+    assert sched.running == 0 and sched.queue_depth == 0
+
+    nxt = sched.submit("s", "q2", timeout=0.1)  # the only slot is free again
+    with pytest.raises(chat_scheduler.DeadlineExceededError):
+        await sched.wait(nxt)
+    assert len(produced) > n
+    await sched.stop()
+
+
+def test_semantic_answer_cache_threshold_and_invalidation():
+    import fakeredis
+    from answer_cache import SemanticAnswerCache
+
+    cache = SemanticAnswerCache(fakeredis.FakeRedis(), threshold=0.9, max_entries=2)
+    docs = [MagicMock(metadata={"pk": 1, "source": "/data/a.pdf"})]
+
+    assert cache.lookup([1.0, 0.0], docs) is None
+    cache.store([1.0, 0.0], docs, "answer A")
+    assert cache.lookup([0.99, 0.05], docs) == "answer A"
+    # same question, different retrieved chunks -> different key
+    assert cache.lookup([1.0, 0.0], [MagicMock(metadata={"pk": 2, "source": "/data/a.pdf"})]) is None
+    assert cache.lookup([0.0, 1.0], docs) is None
+
+    assert cache.invalidate_source("/data/a.pdf") == 1
+    assert cache.lookup([1.0, 0.0], docs) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 4
+
+
+def test_cached_embeddings_lru_and_redis_tier():
+    import fakeredis
+    from embedding_cache import CachedEmbeddings
+
+    inner = MagicMock()
+    inner.embed_documents.side_effect = lambda texts: [[float(len(t)), 1.0] for t in texts]
+    r = fakeredis.FakeRedis()
+
+    emb = CachedEmbeddings(inner, max_entries=1, redis_client=r)
+    assert emb.embed_query("hsm  reset") == [9.0, 1.0]
+    assert emb.embed_query(" hsm reset ") == [9.0, 1.0]      # normalized -> L1 hit
+    emb.embed_query("other")                                 # evicts "hsm reset" from L1
+    assert emb.embed_queries(["hsm reset", "new"]) == [[9.0, 1.0], [3.0, 1.0]]  # L2 hit + miss
+    assert (emb.l1_hits, emb.l2_hits, emb.misses) == (1, 1, 3)
+    assert inner.embed_documents.call_count == 3
+
+
+def test_embedding_cache_namespace_per_backend():
+    import fakeredis
+    from embedding_cache import CachedEmbeddings
+    from embedding_engine import cache_namespace
+
+    assert cache_namespace("/models/mpnet/", "torch") == "mpnet:torch-fp32"
+    assert cache_namespace("/models/mpnet", "int8") == "mpnet:int8-qint8"
+
+    r = fakeredis.FakeRedis()
+    fp32, int8 = MagicMock(), MagicMock()
+    fp32.embed_documents.side_effect = lambda texts: [[1.0, 0.0] for _ in texts]
+    int8.embed_documents.side_effect = lambda texts: [[0.9, 0.1] for _ in texts]
+    CachedEmbeddings(fp32, redis_client=r, namespace=cache_namespace("mpnet", "torch")).embed_query("hsm")
+    # same model, quantized backend: the fp32 vector in Redis is not reused
+    emb = CachedEmbeddings(int8, redis_client=r, namespace=cache_namespace("mpnet", "int8"))
+    assert emb.embed_query("hsm") == pytest.approx([0.9, 0.1]) and emb.l2_hits == 0
+
+
+def test_index_manifest_diff(tmp_path):
+    from index_manifest import IndexManifest
+
+    a, b, c = (tmp_path / n for n in ("a.pdf", "b.pdf", "c.pdf"))
+    a.write_bytes(b"%PDF-a"); b.write_bytes(b"%PDF-b"); c.write_bytes(b"%PDF-c")
+    params = {"chunk_size": 1200, "chunk_overlap": 150, "embedding_model": "mpnet"}
+
+    m = IndexManifest(str(tmp_path / "manifest.json"), params=params)
+    m.record(str(a), str(a), [1, 2]); m.record(str(b), str(b), [3]); m.record(str(c), str(c), [4])
+    m.save()
+
+    b.write_bytes(b"%PDF-b v2")
+    c.unlink()
+    d = tmp_path / "d.pdf"; d.write_bytes(b"%PDF-d")
+
+    m = IndexManifest.load(str(tmp_path / "manifest.json"))
+    diff = m.diff([str(a), str(b), str(d)], params)
+    assert (diff.added, diff.changed, diff.removed, diff.unchanged) == ([str(d)], [str(b)], [str(c)], [str(a)])
+    assert m.chunk_ids(str(a)) == [1, 2]
+
+    # chunker params changed -> every indexed file must be re-embedded
+    diff = m.diff([str(a), str(b), str(d)], {**params, "chunk_size": 800})
+    assert diff.changed == [str(a), str(b)] and diff.added == [str(d)]
+
+
+def test_embedding_engine_sorted_batches_and_insert_chunks(monkeypatch):
+    import numpy as np
+    import embedding_engine
+    from langchain_core.documents import Document
+
+    model = MagicMock()
+    model.encode.side_effect = lambda texts, **kw: np.array([[float(len(t))] for t in texts])
+    monkeypatch.setattr(embedding_engine, "_load_model", lambda path, backend: (model, backend))
+
+    engine = embedding_engine.EmbeddingEngine(backend="int8", insert_batch=2)
+    assert engine.embed_documents(["a", "ccc", "bb"]) == [[1.0], [3.0], [2.0]]
+    assert model.encode.call_args[0][0] == ["ccc", "bb", "a"]
+
+    vs = MagicMock()
+    docs = [Document(page_content="x" * n, metadata={"n": n}) for n in (1, 5, 3)]
+    vs.add_embeddings.side_effect = lambda texts, embeddings, metadatas, batch_size: [len(t) for t in texts]
+    assert engine.insert_documents(vs, docs) == [1, 5, 3]  # pks aligned on input order
+    assert [c.kwargs["texts"] for c in vs.add_embeddings.call_args_list] == [["xxxxx", "xxx"], ["x"]]
+    assert engine.stats()["chunks"] == 6
+
+
+@pytest.mark.asyncio
+async def test_lexical_index_exact_codes_and_hybrid_fusion(tmp_path):
+    from langchain_core.documents import Document
+    from lexical_index import LexicalIndex
+    import retriever as rt
+
+    idx = LexicalIndex.create(str(tmp_path))
+    docs = [
+        Document(page_content="Printer reports error E-4012 on paper jam", metadata={"source": "a.pdf"}),
+        Document(page_content="Restart the server to clear the error", metadata={"source": "a.pdf"}),
+        Document(page_content="HSM-9000.2 firmware upgrade", metadata={"source": "b.pdf"}),
+    ]
+    idx.add_documents(docs, [10, 11, 12])
+    assert [d.metadata["pk"] for d in idx.search_documents("what is E-4012 ?", 2)] == [10]
+    assert idx.search_documents("hsm-9000.2", 1)[0].metadata["source"] == "b.pdf"
+
+    assert idx.delete_source("a.pdf") == 2
+    idx.save()
+    idx = LexicalIndex.load(str(tmp_path))
+    assert idx.n_docs == 1 and idx.search("error", 5) == []
+
+    dense = [Document(page_content="x", metadata={"pk": 1}), Document(page_content="y", metadata={"pk": 2})]
+    sparse = [Document(page_content="y", metadata={"pk": 2}), Document(page_content="z", metadata={"pk": 3})]
+    assert [d.metadata["pk"] for d in rt.rrf_fuse([dense, sparse], k=60)] == [2, 1, 3]
+
+    # no lexical index -> "hybrid" falls back to vector search
+    mock_retriever = MagicMock()
+    mock_retriever.ainvoke = AsyncMock(return_value=dense)
+    docs = await rt.search_documents("q", mock_retriever, k=2, mode="hybrid", lexical=None)
+    assert docs == dense
+
+
+def test_lexical_index_publishes_generations_and_compacts_docstore(tmp_path):
+    import os
+    from langchain_core.documents import Document
+    from lexical_index import LexicalIndex
+
+    def version(tag, pks):
+        return [Document(page_content=f"{tag} chunk {i} error E-{i} " * 10, metadata={"source": "a.pdf"}) for i in pks]
+
+    idx = LexicalIndex.create(str(tmp_path))
+    idx.add_documents(version("v0", range(10)), list(range(10)))
+    idx.save()
+    one_version = os.path.getsize(idx._docs_path)
+    reader = LexicalIndex.load(str(tmp_path))
+
+    idx.delete_source("a.pdf")  # re-upload of the same file
+    idx.add_documents(version("v1", range(10)), list(range(10, 20)))
+    idx.save()
+    # a reader still on the previous generation keeps consistent arrays + docstore
+    assert reader.search_documents("E-3", 1)[0].page_content.startswith("v0")
+    reader = reader.reload_if_changed()
+    assert reader.generation == idx.generation and reader.search_documents("E-3", 1)[0].metadata["pk"] == 13
+
+    for n in range(2, 8):
+        idx.delete_source("a.pdf")
+        idx.add_documents(version(f"v{n}", range(10)), list(range(10 * n, 10 * n + 10)))
+        idx.save()
+    assert os.path.getsize(idx._docs_path) <= 2 * one_version  # rewritten, not append-only forever
+    assert sorted(p for p in os.listdir(tmp_path) if p.startswith("gen-")) == ["gen-000007", "gen-000008"]
+    idx = LexicalIndex.load(str(tmp_path))
+    assert idx.n_docs == 10 and idx.search_documents("E-3", 1)[0].metadata["pk"] == 73
+
+    LexicalIndex.create(str(tmp_path)).save()  # full rebuild: new generation, empty index
+    assert LexicalIndex.load(str(tmp_path)).n_docs == 0
+
+
+def test_metrics_http_middleware_and_generation():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from prometheus_client import REGISTRY
+    import metrics
+
+    app = FastAPI()
+    metrics.instrument_app(app)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        return {"id": item_id}
+
+    labels = {"method": "GET", "endpoint": "/items/{item_id}", "status": "200"}
+    before = REGISTRY.get_sample_value("http_requests_total", labels) or 0.0
+    client = TestClient(app)
+    assert client.get("/items/1").status_code == 200
+    assert client.get("/items/2").status_code == 200
+    assert REGISTRY.get_sample_value("http_requests_total", labels) == before + 2
+    assert REGISTRY.get_sample_value(
+        "http_request_duration_seconds_count", {"method": "GET", "endpoint": "/items/{item_id}"}
+    ) >= 2
+
+    count = REGISTRY.get_sample_value("rag_generation_tokens_per_second_count") or 0.0
+    metrics.observe_generation(ttft=0.5, n_tokens=11, elapsed=2.5)  # 10 tokens in 2 s
+    assert REGISTRY.get_sample_value("rag_generation_tokens_per_second_count") == count + 1
+    assert REGISTRY.get_sample_value("rag_time_to_first_token_seconds_count") >= 1
+
+
+def test_cross_encoder_reranker_cache_and_budget(monkeypatch):
+    from langchain_core.documents import Document
+    import reranker
+
+    model = MagicMock()
+    model.predict.side_effect = lambda pairs, **kw: [float(len(doc)) for _, doc in pairs]
+    monkeypatch.setattr(reranker, "_load_cross_encoder", lambda path, max_length: model)
+
+    rr = reranker.CrossEncoderReranker("x", batch_size=2, budget_ms=0)
+    docs = [Document(page_content="b" * n, metadata={"pk": n}) for n in (1, 3, 2)]
+    assert [d.metadata["pk"] for d in rr.rerank("q", docs, top_k=2)] == [3, 2]
+    assert model.predict.call_count == 2
+
+    # same question (modulo whitespace) -> scores served from the cache
+    assert [d.metadata["pk"] for d in rr.rerank("  q ", docs)] == [3, 2, 1]
+    assert model.predict.call_count == 2 and rr.stats()["score_hits"] == 3
+
+    # budget exhausted before scoring -> vector order kept
+    rr.budget_s = 1e-9
+    assert [d.metadata["pk"] for d in rr.rerank("other", docs, top_k=2)] == [1, 3]
+    assert rr.stats()["budget_fallbacks"] == 1
+
+
+def test_redis_chat_history_window_system_and_compaction():
+    import fakeredis
+    import generator
+    from redis_db import get_chat_history
+
+    r = fakeredis.FakeRedis(decode_responses=True)
+    hist = get_chat_history(r, "s1", max_messages=4, summarizer=generator.summarize_dropped_turns)
+    hist.set_system_message("sys")
+    hist.set_system_message("ignored")
+    for i in range(3):
+        hist.add_message(HumanMessage(content=f"q{i}"))
+        hist.add_ai_message(f"a{i}", also=lambda pipe: pipe.incr("responses:test"))
+
+    # only the 4 most recent turns are kept; dropped questions go to the summary
+    assert r.llen(hist.key) == 4 and r.get("responses:test") == "3"
+    assert r.get(hist.summary_key) == "- q0"
+
+    fresh = get_chat_history(r, "s1")
+    window = fresh.window(2)
+    assert [m.content for m in window[1:]] == ["q2", "a2"]
+    assert isinstance(window[0], SystemMessage) and window[0].content.startswith("sys\n\n")
+    assert "- q0" in window[0].content
+
+    # writes extend the cached window without re-reading Redis
+    fresh.add_message(HumanMessage(content="q3"))
+    assert fresh.last_message().content == "q3"
+    assert [m.content for m in fresh.window(3)[1:]] == ["q2", "a2", "q3"]
+
+    # legacy sessions stored the system prompt at the head of the list
+    r.rpush("chat_history:old", '{"role": "system", "content": "legacy"}', '{"role": "user", "content": "hi"}')
+    old = get_chat_history(r, "old")
+    assert [m.content for m in old.window(5)] == ["legacy", "hi"]
+
+
+def test_prompt_budget_counts_tokens_and_splits_budget():
+    from langchain_core.documents import Document
+    from prompt_budget import PromptBudget, TokenCounter, MESSAGE_OVERHEAD
+
+    tokenize = MagicMock(side_effect=lambda data: data.split())  # 1 token per word
+    counter = TokenCounter(tokenize)
+    assert counter.count("a b c") == 3 and counter.count("a b c") == 3
+    assert tokenize.call_count == 1  # cached by text
+
+    budget = PromptBudget(counter, n_ctx=60, max_new_tokens=10, context_tokens=20, template="t")
+    docs = [Document(page_content="w " * 12), Document(page_content="w " * 12)]
+    kept, used = budget.fit_documents(docs)
+    assert len(kept) == 1 and used == 13
+
+    # 60 - 10 - (1 + overhead) - 13 tokens left for history
+    history = [SystemMessage(content="s")] + [
+        HumanMessage(content="x " * 8) if i % 2 == 0 else AIMessage(content="y " * 8) for i in range(6)
+    ]
+    trimmed = budget.trim_history(history, used)
+    assert trimmed == [history[0], history[5]]  # ends on the latest human turn
+    assert counter.count_messages(trimmed) <= 60 - 10 - (1 + MESSAGE_OVERHEAD) - used
+
+    # a huge question still goes out alone with the system prompt
+    huge = [SystemMessage(content="s"), HumanMessage(content="z " * 500)]
+    assert budget.trim_history(huge, used) == huge
+
+    # the first chunk alone over budget is truncated, not dropped
+    kept, used = budget.fit_documents([Document(page_content="w " * 100)])
+    assert len(kept) == 1 and used <= 20
+
+
+def test_prompt_state_cache_prefix_lookup_and_disk_spill(tmp_path):
+    from types import SimpleNamespace
+    from prompt_cache import PromptStateCache
+
+    def state(n):
+        return SimpleNamespace(llama_state_size=n)
+
+    cache = PromptStateCache(capacity_bytes=100, disk_dir=str(tmp_path), disk_capacity_bytes=10_000)
+    system = (1, 2, 3)
+    cache[system] = state(60)
+    # next turn of a session: longest shared prefix wins
+    cache[system + (4, 5, 6)] = state(60)  # evicts the system state to disk
+    assert len(cache.cache_state) == 1 and cache.stats()["disk_entries"] == 1
+
+    assert (1, 2, 3, 4, 5, 6, 7) in cache
+    cache[(1, 2, 3, 4, 5, 6, 7)]
+    assert cache.hits == 1 and cache.reused_tokens == 6
+
+    # unrelated prompt pushes the session state to disk; it comes back on the next turn
+    cache[(8, 8)] = state(60)
+    promoted = cache[(1, 2, 3, 4, 5, 6, 7, 8)]
+    assert promoted.llama_state_size == 60 and cache.disk_hits == 1
+    assert list(cache.cache_state) == [system + (4, 5, 6)]
+
+    with pytest.raises(KeyError):
+        cache[(7, 7)]
+    assert (7, 7) not in cache and cache.misses == 1
+
+
+
+def test_prompt_cache_spill_dir_per_instance_and_model(tmp_path):
+    import os
+    from prompt_cache import model_fingerprint, spill_dir
+
+    model = tmp_path / "model.gguf"
+    model.write_bytes(b"weights-v1" * 1000)
+    base = str(tmp_path / "kv")
+    old = model_fingerprint(str(model), 4096)
+    assert model_fingerprint(str(model), 8192) != old
+
+    w0, w1 = spill_dir(base, old, "worker0"), spill_dir(base, old, "worker1")
+    assert w0 != w1
+    for d in (w0, w1, os.path.join(base, "slot0")):
+        os.makedirs(d)
+
+    # model swapped: previous states (and the legacy slotN layout) are dropped
+    model.write_bytes(b"weights-v2" * 1000)
+    new = model_fingerprint(str(model), 4096)
+    assert new != old
+    assert spill_dir(base, new, "worker0") == os.path.join(base, new, "worker0")
+    assert os.listdir(base) == []
+
+
+def _fake_llm_worker(worker_id, n_threads, jobs, events, current, cancelled):
+    import os
+    import time
+    from llm_workers import _serve
+
+    def stream(inputs):
+        question = inputs["messages"][-1].content
+        if question == "crash":
+            os._exit(1)
+        for word in question.split():
+            if word == "slow":
+                time.sleep(0.2)
+            yield word
+
+    events.put((worker_id, None, "ready", os.getpid()))
+    _serve(worker_id, stream, jobs, events, current, cancelled)
+
+
+@pytest.mark.asyncio
+async def test_llm_worker_pool_streams_and_restarts_crashed_worker():
+    import asyncio
+    from llm_workers import LLMWorkerPool, WorkerCrashedError
+
+    pool = LLMWorkerPool(2, health_interval_s=0.05, start_timeout_s=10,
+                         start_method="fork", target=_fake_llm_worker).start()
+    try:
+        assert pool.health()["healthy"] == 2
+        chains = pool.chains()
+
+        async def ask(chain, text):
+            return await chain.ainvoke({"messages": [HumanMessage(content=text)], "context": []})
+
+        answers = await asyncio.gather(ask(chains[0], "a b"), ask(chains[1], "c d e"))
+        assert answers == ["ab", "cde"]
+
+        with pytest.raises(WorkerCrashedError):
+            await asyncio.wait_for(ask(chains[0], "crash"), timeout=10)
+        assert await asyncio.to_thread(pool.wait_ready, 10)
+        assert sum(w["restarts"] for w in pool.health()["workers"]) == 1
+        assert await ask(chains[1], "still up") == "stillup"
+    finally:
+        pool.stop()
+
+
+@pytest.mark.asyncio
+async def test_llm_worker_pool_skips_jobs_abandoned_in_queue():
+    import asyncio
+    from llm_workers import LLMWorkerPool
+
+    pool = LLMWorkerPool(1, start_timeout_s=10, start_method="fork", target=_fake_llm_worker).start()
+    try:
+        chain = pool.chains()[0]
+
+        async def ask(text):
+            return await chain.ainvoke({"messages": [HumanMessage(content=text)], "context": []})
+
+        busy = asyncio.create_task(ask("slow slow"))
+        await asyncio.sleep(0.05)
+        abandoned = asyncio.create_task(ask("never generated"))  # queued behind the busy job
+        await asyncio.sleep(0.05)
+        abandoned.cancel()
+        await asyncio.gather(abandoned, return_exceptions=True)
+
+        assert await busy == "slowslow"
+        assert await ask("next one") == "nextone"
+        assert pool.health()["workers"][0]["jobs"] == 2  # the abandoned job was skipped, not generated
+    finally:
+        pool.stop()
+
+
+def test_ingest_jobs_report_progress_per_file():
+    from ingest_jobs import IngestJobManager
+
+    def fake_ingest(path, progress):
+        if path.endswith("bad.pdf"):
+            raise ValueError("Unable to extract text from PDF.")
+        progress.status = "extracting"
+        for p in range(1, 4):
+            progress.on_page(p, 3)
+        progress.chunks = 5
+        progress.on_batch("embedded", 5)
+        progress.on_batch("inserted", 5)
+
+    manager = IngestJobManager(fake_ingest, max_workers=1, max_jobs=1)
+    job = manager.submit([("/tmp/a.pdf", "a.pdf"), ("/tmp/bad.pdf", "bad.pdf")])
+    manager.shutdown(wait=True)
+
+    status = manager.get(job.job_id).to_dict()
+    assert status["status"] == "partial" and status["finished_at"] is not None
+    good, bad = status["files"]
+    assert (good["pages_extracted"], good["pages_total"], good["chunks_embedded"], good["rows_inserted"]) == (3, 3, 5, 5)
+    assert good["status"] == "done"
+    assert bad["status"] == "failed" and "extract" in bad["error"]
+    assert manager.get("unknown") is None
+
+
+def test_schema_normalizer_caches_plan_and_casts_in_one_pass():
+    from types import SimpleNamespace
+    from pymilvus import DataType
+    from schema_normalizer import SchemaNormalizer
+
+    fields = [("pk", DataType.INT64), ("text", DataType.VARCHAR), ("vector", DataType.FLOAT_VECTOR),
+              ("source", DataType.VARCHAR), ("page", DataType.INT64), ("score", DataType.DOUBLE),
+              ("ocr", DataType.BOOL), ("extra", DataType.JSON)]
+    describe = MagicMock(return_value=(("id-1", tuple(fields)), fields))
+    normalizer = SchemaNormalizer(ttl_s=3600, describe=describe)
+    vs = SimpleNamespace(text_field="text", vector_field="vector")
+
+    docs = [SimpleNamespace(metadata={"source": 3, "page": "12", "ocr": "yes", "junk": 1}),
+            SimpleNamespace(metadata={"page": "n/a", "score": ""})]
+    normalizer.normalize(vs, "rag_docs", docs)
+    normalizer.normalize(vs, "rag_docs", [SimpleNamespace(metadata=None)])
+    assert describe.call_count == 1  # schema read once, not per call
+
+    assert docs[0].metadata == {"source": "3", "page": 12, "score": 0.0, "ocr": True, "extra": {}}
+    assert docs[1].metadata == {"source": "", "page": 0, "score": 0.0, "ocr": False, "extra": {}}
+    assert docs[0].metadata["extra"] is not docs[1].metadata["extra"]
+    # page metadata that this (pre page-chunking) schema would silently drop
+    assert normalizer.missing(vs, "rag_docs", ["source", "page_start", "heading"]) == ["page_start", "heading"]
+    assert normalizer.missing(SimpleNamespace(schema_free=True), "rag_docs", ["page_start"]) == []
+    assert describe.call_count == 1
+
+    normalizer.invalidate("rag_docs")
+    normalizer.normalize(vs, "rag_docs", [])
+    assert describe.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_retrieval_bench_recall_mrr_and_percentiles(tmp_path):
+    import json
+    from langchain_core.documents import Document
+    from lexical_index import LexicalIndex
+    from retrieval_bench import build_memory_retriever, iter_docstore, load_queries, run_benchmark, score
+
+    class BagOfWords:
+        vocab = ["hsm", "pin", "reset", "error", "0x8000", "firmware", "update"]
+
+        def embed_documents(self, texts):
+            return [[float(w in t.lower()) + 1e-3 for w in self.vocab] for t in texts]
+
+        def embed_query(self, text):
+            return self.embed_documents([text])[0]
+
+    lexical = LexicalIndex.create(str(tmp_path / "bm25"))
+    lexical.add_documents([
+        Document(page_content="--- Page 3 ---\nReset the HSM admin PIN", metadata={"source": "/data/admin.pdf"}),
+        Document(page_content="--- Page 7 ---\nError 0x8000 during firmware update", metadata={"source": "/data/errors.pdf"}),
+        Document(page_content="Firmware update procedure", metadata={"source": "/data/update.pdf"}),
+    ], [1, 2, 3])
+    retriever = build_memory_retriever(list(iter_docstore(lexical)), BagOfWords(), k=3)
+
+    qfile = tmp_path / "queries.jsonl"
+    qfile.write_text("\n".join(json.dumps(q) for q in [
+        {"question": "reset pin", "source": "admin.pdf", "page": 3},
+        {"question": "error 0x8000", "source": ["errors.pdf"], "page": 7},
+        {"question": "reset pin", "source": "admin.pdf", "page": 9},  # wrong page: never relevant
+    ]))
+    queries = load_queries(str(qfile))
+
+    results = await run_benchmark(queries, [{"name": "vector", "mode": "vector"}, {"name": "hybrid", "mode": "hybrid"}],
+                                  retriever, [1, 3], lexical)
+    for r in results:
+        assert r["recall@1"] == round(2 / 3, 4) and r["recall@3"] == round(2 / 3, 4)
+        assert r["mrr"] == round(2 / 3, 4) and r["misses"] == ["reset pin"]
+        assert set(r["latency_ms"]) == {"p50", "p95", "p99", "mean"}
+
+    # ef is passed per query: a config without "ef" never inherits the previous one
+    import retrieval_bench
+    seen = []
+    real_search = retrieval_bench.rt.search_documents
+
+    async def spy(*args, ef=None, **kwargs):
+        seen.append(ef)
+        return await real_search(*args, ef=ef, **kwargs)
+
+    retrieval_bench.rt.search_documents = spy
+    try:
+        await run_benchmark(queries[:1], [{"name": "ef64", "ef": 64}, {"name": "default"}], retriever, [1], lexical)
+    finally:
+        retrieval_bench.rt.search_documents = real_search
+    assert seen == [64, 64, None, None]  # warm-up + query per config
+
+    s = score([1, 2, None, 4], [0.01, 0.02, 0.03, 0.04], [1, 2])
+    assert (s["recall@1"], s["recall@2"], s["mrr"]) == (0.25, 0.5, round((1 + 0.5 + 0.25) / 4, 4))
+    assert s["latency_ms"]["p50"] == 25.0
+
+
+@pytest.mark.asyncio
+async def test_fake_llm_is_deterministic_and_streams_through_chain():
+    import time
+    import generator
+    from fake_llm import FakeChatModel
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+    # same shape as get_chain_generator: prompt | llm | str parser
+    prompt = ChatPromptTemplate.from_messages([("system", generator.SYSTEM_TEMPLATE), MessagesPlaceholder("messages")])
+    chain = prompt | FakeChatModel(tokens_per_s=200, n_tokens=10) | StrOutputParser()
+    inputs = {"messages": [HumanMessage(content="reset pin")]}
+    start = time.perf_counter()
+    parts = [t async for t in generator._astream_text(chain, inputs)]
+    assert len(parts) == 10 and time.perf_counter() - start >= 10 / 200
+    assert "".join(parts) == await chain.ainvoke(inputs)
+
+
+@pytest.mark.asyncio
+async def test_load_test_reports_latency_errors_and_slot_wait():
+    import asyncio
+    import httpx
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse, PlainTextResponse
+    from load_test import LoadConfig, bucket_quantile, run_load
+
+    app = FastAPI()
+    state = {"chats": 0}
+
+    @app.post("/chat")
+    async def chat(user_input: str, session_id: str, timeout: float | None = None):
+        state["chats"] += 1
+        if state["chats"] % 5 == 0:
+            return JSONResponse(status_code=429, content={"error": "full"})
+        await asyncio.sleep(0.01)
+        return {"response": "ok", "duration": 0.01}
+
+    @app.post("/retrieve")
+    async def retrieve(payload: dict):
+        return {"documents": []}
+
+    @app.get("/chat/history")
+    async def history(session_id: str):
+        return {"history": []}
+
+    @app.get("/metrics")
+    async def prom():
+        n = state["chats"]
+        return PlainTextResponse(
+            f'rag_chat_slot_wait_seconds_bucket{{le="0.5"}} {n}\n'
+            f'rag_chat_slot_wait_seconds_bucket{{le="+Inf"}} {n}\n'
+            f"rag_chat_slot_wait_seconds_count {n}\nrag_chat_slot_wait_seconds_sum {0.2 * n}\n"
+            f"rag_chat_queue_depth 1.0\n"
+        )
+
+    cfg = LoadConfig(rate=50, duration=0.3, turns=2, think_s=0.01,
+                     mix={"chat": 0.6, "retrieve": 0.2, "history": 0.2})
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        report = await run_load(client, cfg, seed=1)
+
+    chat = report["endpoints"]["/chat"]
+    assert chat["count"] == state["chats"] and chat["errors"] == state["chats"] // 5
+    assert chat["status"].get("429") == chat["errors"] and chat["latency_ms"]["p50"] >= 10
+    assert report["endpoints"]["/retrieve"]["error_rate"] == 0.0
+    assert report["chat"]["slot_wait"]["count"] == state["chats"]
+    assert report["chat"]["slot_wait"]["mean_s"] == 0.2 and report["chat"]["queue_depth_max"] == 1.0
+
+    assert bucket_quantile([(0.1, 50), (1.0, 100), (float("inf"), 100)], 0.75) == pytest.approx(0.55)
+
+
+@pytest.mark.asyncio
+async def test_index_profile_per_request_ef_and_tuning_choice(tmp_path):
+    import numpy as np
+    from langchain_core.documents import Document
+    import retriever as rt
+    from index_config import IndexProfile, load_profile, save_profile
+    from index_tuning import choose_profile, exact_topk, pareto_frontier, sweep
+
+    hnsw = IndexProfile(build={"M": 16, "efConstruction": 200}, search={"fast": 32, "accurate": 128})
+    assert hnsw.index_params()["params"] == {"M": 16, "efConstruction": 200}
+    assert hnsw.search_params("fast", k=50)["params"] == {"ef": 50}  # Milvus: ef >= k
+    assert hnsw.search_params("accurate", ef=256)["params"] == {"ef": 256}
+    ivf = IndexProfile(index_type="IVF_SQ8", build={"nlist": 64}, search={"fast": 8, "accurate": 32})
+    assert ivf.search_params(ef=16)["params"] == {"nprobe": 16}
+    with pytest.raises(ValueError):
+        IndexProfile(index_type="IVF_FLAT", build={"M": 16})
+    save_profile(ivf, str(tmp_path / "profile.json"))
+    assert load_profile(str(tmp_path / "profile.json")) == ivf
+
+    # per-request override reaches the vector store as Milvus `param`
+    class Store:
+        embeddings = MagicMock(embed_documents=lambda texts: [[1.0, 0.0] for _ in texts])
+        search_params = hnsw.search_params("accurate")
+
+        def __init__(self):
+            self.calls = []
+
+        async def asimilarity_search_by_vector(self, vector, k, **kwargs):
+            self.calls.append(kwargs)
+            return [Document(page_content="x", metadata={"pk": 1})]
+
+    store = Store()
+    retriever = MagicMock(spec=rt.VectorStoreRetriever, vectorstore=store)
+    await rt.search_documents("q", retriever, k=2, ef=64)
+    await rt.search_documents("q", retriever, k=2)
+    assert store.calls[0]["param"]["params"] == {"ef": 64} and store.calls[1] == {}
+
+    # sweep over an exact backend whose recall grows with ef
+    rng = np.random.default_rng(0)
+    docs, queries = rng.normal(size=(50, 8)), rng.normal(size=(5, 8))
+    exact = exact_topk(docs, queries, 4)
+
+    class Backend:
+        n_vectors = 50
+
+        def build(self, index_type, build):
+            self.m = build.get("M", 0)
+            return 0.0
+
+        def search(self, vector, key, value, k):
+            i = next(j for j, q in enumerate(queries) if q is vector or np.array_equal(q, vector))
+            keep = min(k, value // 8 + self.m // 16)  # exact neighbours kept, the rest are misses
+            return list(exact[i][:keep]) + [-1] * (k - keep)
+
+    points = sweep(Backend(), [{"index_type": "HNSW", "build": {"M": 16, "efConstruction": 100}}],
+                   queries, exact, 4, {"ef": [8, 16, 24, 32]})
+    assert [p["recall"] for p in points] == [0.5, 0.75, 1.0, 1.0]
+    for p, lat in zip(points, [1.0, 2.0, 3.0, 4.0]):
+        p["p95_ms"] = lat
+    assert [p["value"] for p in pareto_frontier(points)] == [8, 16, 24]
+    profile, chosen = choose_profile(points, fast_recall=0.7, accurate_recall=0.99)
+    assert profile.search == {"fast": 16, "accurate": 24} and profile.build["M"] == 16
+
+
+@pytest.mark.asyncio
+async def test_faiss_store_incremental_delete_and_atomic_persist(tmp_path):
+    import numpy as np
+    import retriever as rt
+    from faiss_store import FaissVectorStore
+
+    rng = np.random.default_rng(0)
+    vecs = rng.normal(size=(40, 16)).astype("float32")
+
+    class Emb:
+        def embed_documents(self, texts):
+            return [vecs[int(t)].tolist() for t in texts]
+
+        def embed_query(self, text):
+            return vecs[int(text)].tolist()
+
+    emb = Emb()
+
+    store = FaissVectorStore(emb, str(tmp_path / "faiss"), hnsw_m=8)
+    ids = store.add_embeddings([str(i) for i in range(30)], vecs[:30],
+                               [{"source": f"doc{i % 3}.pdf"} for i in range(30)])
+    assert ids == list(range(1, 31))
+    retriever = rt.get_retriever(store, k=3)
+    docs = await rt.search_documents("4", retriever, k=3)
+    assert docs[0].metadata == {"source": "doc1.pdf", "pk": 5}
+
+    assert store.delete_source("doc1.pdf") == 10
+    assert all(d.metadata["source"] != "doc1.pdf" for d in store.similarity_search("4", k=10))
+    store.persist()
+    gen = (tmp_path / "faiss" / "CURRENT").read_text()
+
+    # reload (memory-mapped), then incremental add on the mapped index
+    again = FaissVectorStore(emb, str(tmp_path / "faiss"), hnsw_m=8).load()
+    assert again.ntotal == 20 and again.tombstones == store.tombstones
+    assert again.add_embeddings(["35"], vecs[35:36], [{"source": "new.pdf"}]) == [31]
+    assert again.similarity_search("35", k=1, param={"params": {"ef": 16}})[0].metadata["pk"] == 31
+    assert (tmp_path / "faiss" / "CURRENT").read_text() == gen  # unsaved until persist()
+    again.persist()
+    assert sorted(p.name for p in (tmp_path / "faiss").iterdir()) == ["CURRENT", "gen-000002"]
+    assert store.reload_if_changed() is False  # checked at most every reload_check_s
+    store._checked_at = 0
+    assert store.reload_if_changed() is True and store.ntotal == 21
+
+    # IVF_PQ stays exact until enough vectors to train, then switches
+    ivf = FaissVectorStore(emb, str(tmp_path / "ivf"), index_type="IVF_PQ", nlist=4, pq_m=4, pq_nbits=4)
+    ivf.add_embeddings(["1"], vecs[1:2])
+    assert ivf.kind == "FLAT"
+    big = rng.normal(size=(ivf.train_size, 16)).astype("float32")
+    ivf.add_embeddings(["x"] * len(big), big)
+    assert ivf.kind == "IVF_PQ" and ivf.index.ntotal == ivf.train_size + 1
+    ivf.delete([1])
+    assert ivf.index.ntotal == ivf.train_size
+
+
+def test_dashboard_latency_histograms_and_quantiles():
+    import fakeredis
+    import dashboard_metrics as dm
+
+    r = fakeredis.FakeRedis(decode_responses=True)
+    pipe = r.pipeline(transaction=False)
+    for seconds in [0.4] * 50 + [1.8] * 45 + [25.0] * 5:
+        dm.record_response(pipe, seconds, day="2026-01-02")
+    pipe.execute()
+    assert r.hlen(dm.hist_key("2026-01-02")) == 5  # 3 buckets + count + sum, whatever the traffic
+    assert r.get("responses:2026-01-02") == "100" and r.ttl(dm.hist_key("2026-01-02")) > 0
+
+    day, empty = dm.fetch_latency(r, ["2026-01-02", "2026-01-03"])
+    assert day["count"] == 100 and day["mean"] == pytest.approx((0.4 * 50 + 1.8 * 45 + 25 * 5) / 100)
+    assert 0.25 < day["p50"] <= 0.5 and 1.5 < day["p95"] <= 2.0 and 20.0 < day["p99"] <= 25.0
+    assert empty == {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None}
+
+    # legacy lists are folded into the same histograms
+    r.rpush("response_times:2026-01-03", 0.4, 0.4, 3.5)
+    assert dm.migrate_response_times(r) == 3
+    assert not r.exists("response_times:2026-01-03")
+    assert dm.fetch_latency(r, ["2026-01-03"])[0]["count"] == 3
+
+
+def test_dashboard_rollups_constant_round_trips():
+    import fakeredis
+    import dashboard_metrics as dm
+
+    r = fakeredis.FakeRedis()
+    for sid in ["s1", "s2", "s2", "s3"]:
+        dm.record_user(r, sid, day="2026-03-01")
+    r.sadd("users:2026-02-28", "old1", "old2")  # legacy SET format
+    r.set("feedback:positive:2026-03-01", 3)
+    r.set("feedback:negative:2026-03-01", 1)
+    pipe = r.pipeline(transaction=False)
+    for seconds in (1.0, 2.0, 4.0):
+        dm.record_response(pipe, seconds, day="2026-03-01")
+    dm.record_response(pipe, 0.5, day="2026-03-02")
+    pipe.execute()
+
+    calls = []
+    real = r.pipeline
+    r.pipeline = lambda *a, **kw: calls.append(1) or real(*a, **kw)
+    days = dm.last_days(90, "2026-03-02")
+    rows = dm.fetch_rollups(r, days, now="2026-03-02")
+    assert len(calls) == 3  # read rollups, read raw counters, write rollups — not 90 x N
+    by_day = dict(zip(days, rows))
+    assert by_day["2026-03-01"]["users"] == 3 and by_day["2026-02-28"]["users"] == 2
+    assert (by_day["2026-03-01"]["positive"], by_day["2026-03-01"]["negative"], by_day["2026-03-01"]["responses"]) == (3, 1, 3)
+    assert by_day["2026-03-01"]["latency_mean"] == pytest.approx(7 / 3) and by_day["2026-01-01"]["p50"] is None
+    assert r.hget("rollup:2026-03-01", "final") == b"1" and not r.exists("rollup:2026-03-02")  # today stays live
+
+    calls.clear()
+    again = dm.fetch_rollups(r, days, now="2026-03-02")
+    assert again == rows and len(calls) == 2  # closed days come straight from their rollup
+
+    assert dm.migrate_user_sets(r) == 2 and not r.exists("users:2026-02-28")
+    assert r.pfcount("users_hll:2026-02-28") == 2
+
+
+def test_page_chunker_keeps_pages_and_headings_streaming():
+    from page_chunker import chunk_pages
+
+    consumed = []
+
+    def pages():
+        for no in range(1, 7):
+            consumed.append(no)
+            lines = [f"Section {no}", f"Paragraph of page {no}. " * 6, "", f"Second paragraph {no}. " * 5, ""]
+            yield no, lines, ([0] if no % 2 else [])
+
+    chunks = chunk_pages(pages(), chunk_size=300, overlap=120, metadata={"source": "/data/a.pdf"})
+    first = next(chunks)
+    assert consumed == [1, 2]  # generator: pages are pulled lazily, not the whole document up front
+    docs = [first, *chunks]
+
+    assert all(len(d.page_content) <= 300 for d in docs)
+    assert all(d.metadata["source"] == "/data/a.pdf" for d in docs)
+    assert docs[0].metadata["page_start"] == 1 and docs[-1].metadata["page_end"] == 6
+    assert all(d.metadata["page_start"] <= d.metadata["page_end"] for d in docs)
+    page2 = next(d for d in docs if d.metadata["page_start"] == 2)
+    assert page2.metadata["heading"] == "Section 1"  # heading carries over untitled pages
+    assert docs[-1].metadata["heading"] == "Section 5"
+    # overlap: each chunk starts with the end of the previous one
+    assert all(b.page_content[:30] in a.page_content[-120:] for a, b in zip(docs, docs[1:]))
+
+    long = list(chunk_pages([(1, ["word " * 400], [])], chunk_size=200, overlap=0))
+    assert len(long) >= 10 and all(len(d.page_content) <= 200 for d in long)
+
+
+def test_page_chunker_overlap_spans_long_paragraphs():
+    from page_chunker import chunk_pages
+
+    # paragraphs longer than the overlap: a character-level tail is still carried over
+    paragraphs = [" ".join(f"p{i}w{j}" for j in range(60))[:350].rsplit(" ", 1)[0] for i in range(12)]
+    lines = [line for p in paragraphs for line in (p, "")]
+    docs = list(chunk_pages([(1, lines, [])], chunk_size=1200, overlap=150))
+
+    assert len(docs) >= 3 and all(len(d.page_content) <= 1200 for d in docs)
+    for a, b in zip(docs, docs[1:]):
+        shared = b.page_content.split("\n\n")[0]
+        assert a.page_content.endswith(shared)
+        assert 130 <= len(shared) <= 150  # ~overlap, cut at a word boundary
+        assert not shared.split()[0].startswith("w")  # no partial word
+
+
+def test_pdf_layout_single_parse_matches_legacy_extraction():
+    import fitz
+    import extract_bench
+    import pdf_layout
+
+    doc = fitz.open(stream=extract_bench.synthetic_pdf(3), filetype="pdf")
+    toc = doc.new_page()
+    toc.insert_text((72, 72), "Table of Contents", fontsize=12)
+
+    calls = []
+    page = doc.load_page(0)
+    real = page.get_text
+    page.get_text = lambda *a, **kw: calls.append(a[0]) or real(*a, **kw)
+    lines, headings = pdf_layout.page_lines(page, mode="layout")
+    assert calls == ["dict"]  # one parse per page, skip detection included
+    assert [lines[i] for i in headings] == ["1. Section title"]
+
+    for pno in range(3):
+        ref = extract_bench._canonical(extract_bench.legacy_page_lines(doc.load_page(pno)))
+        assert extract_bench._canonical(pdf_layout.page_lines(doc.load_page(pno), mode="layout")) == ref
+        fast = pdf_layout.page_lines(doc.load_page(pno), mode="fast")
+        assert pdf_layout.join_lines(fast[0]).split() == ref[0].split()
+    assert pdf_layout.page_lines(doc.load_page(3)) is None  # TOC page skipped
+    assert [p for p, _, _ in pdf_layout.iter_pages(doc, mode="fast")] == [1, 2, 3]
+    with pytest.raises(ValueError):
+        pdf_layout.page_lines(doc.load_page(0), mode="rawdict")
+
+
+def test_chunk_dedup_links_exact_and_near_duplicates_across_sources(tmp_path):
+    import random
+    from langchain_core.documents import Document
+    from chunk_dedup import DedupIndex
+
+    random.seed(7)
+    vocab = [f"term{i}" for i in range(2000)]
+    texts = [" ".join(random.choices(vocab, k=150)) for _ in range(4)]
+    doc = lambda t: Document(page_content=t)  # noqa: E731
+
+    idx = DedupIndex(str(tmp_path / "dedup"))
+    kept, dups = idx.filter("v1.pdf", [doc(t) for t in texts])
+    assert len(kept) == 4 and not dups
+    idx.add("v1.pdf", kept)
+    idx.save()
+
+    idx = DedupIndex.load(str(tmp_path / "dedup"))
+    words = texts[1].split()
+    words[70] = "revised"
+    v2 = [doc(texts[0].upper()), doc(" ".join(words)), doc("brand new paragraph " * 10)]
+    kept, dups = idx.filter("v2.pdf", v2)
+    assert [d.page_content for d in kept] == [v2[2].page_content]
+    assert [(src, kind) for _, src, kind in dups] == [("v1.pdf", "exact"), ("v1.pdf", "near")]
+    assert idx.filter("v1.pdf", [doc(texts[0])])[1] == []  # same source is never its own duplicate
+    idx.add("v2.pdf", kept, dups)
+
+    report = idx.report(dim=768)
+    assert report["run"]["vectors"] == 2 and report["run"]["vector_bytes"] == 2 * 768 * 4
+    assert report["total"]["text_bytes"] == sum(len(d.page_content) for d, _, _ in dups)
+    assert idx.dependents(["v1.pdf"]) == ["v2.pdf"]
+
+    idx.delete_source("v1.pdf")  # canonical gone: v2 chunks are no longer duplicates
+    assert idx.filter("v3.pdf", [doc(texts[0])])[1] == [] and idx.n_rows == 1
+
+
+def test_preprocess_page_streams_keep_order_and_alignment(tmp_path):
+    from collections import deque
+    from concurrent.futures import Future
+    import extract_bench
+    import preprocess
+
+    a, missing, b = tmp_path / "a.pdf", tmp_path / "missing.pdf", tmp_path / "b.pdf"
+    a.write_bytes(extract_bench.synthetic_pdf(3))
+    b.write_bytes(extract_bench.synthetic_pdf(2))
+    files = [str(a), str(missing), str(b)]
+    plan = preprocess._plan_extraction(files, 1)
+    assert [r for _, _, r in plan] == [[(0, 1), (1, 2), (2, 3)], [], [(0, 1), (1, 2)]]
+
+    got = {}
+    for fpath, _, pages in preprocess.iter_page_streams(files, workers=2, pages_per_task=1):
+        try:
+            got[fpath] = [p for p, _, _ in pages]
+        except RuntimeError as e:
+            got[fpath] = e
+    assert got[str(a)] == [1, 2, 3] and got[str(b)] == [1, 2]
+    assert isinstance(got[str(missing)], RuntimeError)
+
+    # flux non consommés : vidés avant le fichier suivant, b reste aligné
+    streams = preprocess.iter_page_streams(files, workers=2, pages_per_task=1)
+    next(streams), next(streams)
+    _, _, pages = next(streams)
+    assert [lines[0] for _, lines, _ in pages] == ["1. Section title", "2. Section title"]
+
+    # plage en échec au milieu d'un fichier : toutes ses plages sont retirées de la file
+    futures = [Future() for _ in range(4)]
+    futures[0].set_result([(1, ["x"], [])])
+    futures[1].set_exception(OSError("boom"))
+    futures[2].set_result([(3, ["z"], [])])
+    futures[3].set_result([(1, ["next"], [])])
+    inflight = deque(futures)
+    pages = preprocess._pooled_pages("f.pdf", [(0, 1), (1, 2), (2, 3)], inflight, lambda: None)
+    assert next(pages)[0] == 1
+    with pytest.raises(RuntimeError, match="boom"):
+        next(pages)
+    assert list(inflight) == [futures[3]]